@@ -11,12 +11,73 @@ def connect():
     return psycopg2.connect("dbname=tournaments")
 
 
+def applyEvents(c):
+    """Bring the standings projection up to date with the match log.
+
+    Only the events reported since the checkpoint of the projection (the
+    tail of the log) are applied, after which the checkpoint is moved to the
+    last of them. The checkpoint row stays locked until the end of the
+    transaction, so events are applied exactly once and in order. Called by
+    the writers (see reportMatches and rebuildStandings), so that reading
+    standings takes no lock.
+
+    Args:
+      c: cursor of the transaction to apply the events in.
+    """
+    c.execute("SELECT event_id FROM checkpoints "
+              "WHERE projection = 'standings' FOR UPDATE")
+    checkpoint = c.fetchone()[0]
+
+    c.execute(
+        "WITH tail AS ("
+        "    SELECT id, winner_id, loser_id FROM match_events WHERE id > %s"
+        "), applied AS ("
+        "    UPDATE matches AS m "
+        "    SET wins = m.wins + t.wins, matches = m.matches + t.matches "
+        "    FROM (SELECT player_id, count(*) AS matches, sum(won) AS wins "
+        "          FROM (SELECT winner_id AS player_id, 1 AS won FROM tail "
+        "                UNION ALL "
+        "                SELECT loser_id, 0 FROM tail) AS e "
+        "          GROUP BY player_id) AS t "
+        "    WHERE m.player_id = t.player_id"
+        ") "
+        "UPDATE checkpoints SET event_id = (SELECT max(id) FROM tail) "
+        "WHERE projection = 'standings' AND EXISTS (SELECT 1 FROM tail)",
+        (checkpoint, )
+        )
+
+
+def rebuildStandings():
+    """Rebuild the standings projection by replaying the whole match log.
+
+    Used to recover the projection or to audit it; standings are otherwise
+    kept current by applying only the tail of the log (see applyEvents).
+    """
+    db = connect()
+    c = db.cursor()
+
+    c.execute("SELECT event_id FROM checkpoints "
+              "WHERE projection = 'standings' FOR UPDATE")
+    c.execute("UPDATE matches SET wins = 0, matches = 0")
+    c.execute("UPDATE checkpoints SET event_id = 0 "
+              "WHERE projection = 'standings'")
+    applyEvents(c)
+
+    db.commit()
+    db.close()
+
+
 def deleteMatches():
     """Remove all the match records from the database."""
     db = connect()
     c = db.cursor()
 
-    c.execute("DELETE FROM matches")
+    c.execute("SELECT event_id FROM checkpoints "
+              "WHERE projection = 'standings' FOR UPDATE")
+    c.execute("DELETE FROM match_events")
+    c.execute("UPDATE matches SET wins = 0, matches = 0")
+    c.execute("UPDATE checkpoints SET event_id = 0 "
+              "WHERE projection = 'standings'")
 
     db.commit()
     db.close()
@@ -63,11 +124,12 @@ def registerPlayer(name):
     db = connect()
     c = db.cursor()
 
-    c.execute("INSERT INTO players (name) VALUES (%s)", (name, ))
-
-    c.execute("SELECT id FROM v_newPlayerID")
-    latest_id = c.fetchone()
-    c.execute("INSERT INTO matches VALUES (%s, 0, 0)", (latest_id, ))
+    c.execute(
+        "WITH new_player AS ("
+        "    INSERT INTO players (name) VALUES (%s) RETURNING id"
+        ") "
+        "INSERT INTO matches SELECT id, 0, 0 FROM new_player", (name, )
+        )
 
     db.commit()
     db.close()
@@ -104,21 +166,49 @@ def reportMatch(winner, loser):
     number of matches increased by 1 and the winner gets number of wins
     increased by 1.
 
+    The match is appended to the match log and applied to the standings
+    in the same transaction (see reportMatches).
+
     Args:
       winner:  the id number of the player who won
       loser:  the id number of the player who lost
     """
+    reportMatches([(winner, loser)])
+
+
+def reportMatches(pairs):
+    """Record the outcomes of several matches by a single statement.
+
+    Matches are appended to the match log in order of pairs and applied to
+    the standings within the same transaction. The checkpoint of the
+    standings is locked by the appending statement, so that reports are
+    applied one transaction after another.
+
+    Args:
+      pairs: list of tuples (winner, loser) of the id numbers of the player
+        who won and the player who lost each match
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return
+
     db = connect()
     c = db.cursor()
 
     c.execute(
-        "UPDATE matches SET matches = matches + 1 "
-        "WHERE player_id = %s OR player_id = %s", (winner, loser, )
-        )
-    c.execute(
-        "UPDATE matches SET wins = wins + 1 "
-        "WHERE player_id = %s", (winner, )
+        "WITH checkpoint AS ("
+        "    SELECT event_id FROM checkpoints "
+        "    WHERE projection = 'standings' FOR UPDATE"
+        ") "
+        "INSERT INTO match_events (winner_id, loser_id) "
+        "SELECT p.winner_id, p.loser_id "
+        "FROM checkpoint, unnest(%s::integer[], %s::integer[]) "
+        "    WITH ORDINALITY AS p (winner_id, loser_id, position) "
+        "ORDER BY p.position",
+        ([winner for (winner, loser) in pairs],
+         [loser for (winner, loser) in pairs], )
         )
+    applyEvents(c)
 
     db.commit()
     db.close()
@@ -16,16 +16,31 @@ CREATE TABLE players (
     name text NOT NULL
 );
 
+-- append-only log of reported matches
+CREATE TABLE match_events (
+    id serial PRIMARY KEY,
+    winner_id integer NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+    loser_id integer NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+    reported timestamptz NOT NULL DEFAULT now()
+);
+
+-- standings projection: wins and matches of each player as of the last event
+-- applied (see checkpoints)
 CREATE TABLE matches (
-    player_id integer REFERENCES players(id) ON DELETE CASCADE,
+    player_id integer PRIMARY KEY REFERENCES players(id) ON DELETE CASCADE,
     wins integer NOT NULL,
     matches integer NOT NULL
 );
 
--- Views --
-CREATE VIEW v_newPlayerID AS
-    SELECT id FROM players ORDER BY id DESC LIMIT 1;
+-- id of the last event of match_events applied to each projection
+CREATE TABLE checkpoints (
+    projection text PRIMARY KEY,
+    event_id integer NOT NULL
+);
+
+INSERT INTO checkpoints VALUES ('standings', 0);
 
+-- Views --
 CREATE VIEW v_standings AS
     SELECT players.id, players.name, matches.wins, matches.matches
     FROM players, matches WHERE players.id = matches.player_id ORDER BY matches.wins
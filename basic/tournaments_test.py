@@ -2,6 +2,8 @@
 #
 # Test cases for tournament.py
 
+import threading
+
 from tournaments import *
 
 def testDeleteMatches():
@@ -125,6 +127,67 @@ def testPairings():
     print "8. After one match, players with one win are paired."
 
 
+def testRebuildStandings():
+    deleteMatches()
+    deletePlayers()
+    registerPlayer("Bruno Walton")
+    registerPlayer("Boots O'Neal")
+    registerPlayer("Cathy Burton")
+    registerPlayer("Diane Grant")
+    standings = playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportMatch(id1, id2)
+    reportMatch(id3, id4)
+    standings = playerStandings()
+    reportMatch(id1, id3)
+    db = connect()
+    c = db.cursor()
+    c.execute("SELECT count(*) FROM match_events")
+    events = c.fetchone()[0]
+    c.execute("UPDATE matches SET wins = 0")
+    db.commit()
+    db.close()
+    if events != 3:
+        raise ValueError("Each reported match should be logged once.")
+    rebuildStandings()
+    rebuilt = dict((i, (w, m)) for (i, n, w, m) in playerStandings())
+    if rebuilt != {id1: (2, 2), id2: (0, 1), id3: (1, 2), id4: (0, 1)}:
+        raise ValueError(
+            "Standings should be rebuilt by replaying the match log.")
+    # standings are read without waiting for the checkpoint
+    db = connect()
+    c = db.cursor()
+    c.execute("SELECT * FROM checkpoints FOR UPDATE")
+    reader = threading.Thread(target=playerStandings)
+    reader.daemon = True
+    reader.start()
+    reader.join(5)
+    db.rollback()
+    db.close()
+    if reader.is_alive():
+        raise ValueError("Reading standings should not take a lock.")
+    print "9. Standings can be rebuilt from the match log."
+
+
+def testReportMatchesBatch():
+    deleteMatches()
+    deletePlayers()
+    registerPlayer("Twilight Sparkle")
+    registerPlayer("Fluttershy")
+    registerPlayer("Applejack")
+    registerPlayer("Pinkie Pie")
+    standings = playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportMatches([(id1, id2), (id3, id4)])
+    reportMatches([(id1, id3)])
+    reportMatches([])
+    standings = dict((i, (w, m)) for (i, n, w, m) in playerStandings())
+    if standings != {id1: (2, 2), id2: (0, 1), id3: (1, 2), id4: (0, 1)}:
+        raise ValueError(
+            "Matches reported together should update standings.")
+    print "10. Several matches can be reported at once."
+
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -134,6 +197,8 @@ if __name__ == '__main__':
     testStandingsBeforeMatches()
     testReportMatches()
     testPairings()
+    testRebuildStandings()
+    testReportMatchesBatch()
     print "Success!  All tests pass!"
 
 
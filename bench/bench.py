@@ -0,0 +1,431 @@
+"""Benchmark of the 'extra' tournaments module on synthetic data.
+
+A throwaway PostgreSQL cluster is created (initdb in a temporary directory)
+and started on a unix socket only, the schema from extra/tournaments.sql is
+loaded and for each of the requested sizes N players are created, registered
+for M tournaments and R rounds of each tournament are paired by
+swissPairings and reported by reportMatch. Durations of registration,
+reporting results, standings, pairings and counts are collected. Then a
+league night is simulated: many tournaments are played at once and each
+round is turned over for all of them (pairAllOngoing and reporting the whole
+round), compared with pairing the tournaments one by one by swissPairings.
+The whole benchmark is repeated (3 times by default) and each operation is
+reported by the repeat of its median (p50) duration, so that single slow
+calls or a disturbed repeat (e.g. by a checkpoint of the server) do not skew
+the results. Results are written as JSON, so that runs can be compared. If a
+baseline (JSON of an earlier run) is provided, the run fails when the median
+duration of any operation got slower than the baseline by more than the
+tolerance.
+
+Usage:
+    python bench/bench.py [--sizes 16,128,1024,16384] [--tours 2]
+                          [--rounds 3] [--league-tours 200]
+                          [--league-players 32] [--output results.json]
+                          [--repeat 3] [--baseline baseline.json]
+                          [--tolerance 1.0]
+                          [--pg-bin /usr/lib/postgresql/16/bin]
+                          [--dsn 'host=/tmp dbname=postgres']
+
+PostgreSQL binaries (initdb, pg_ctl, psql) are looked up in --pg-bin, the
+PG_BIN environment variable or PATH. initdb refuses to run as root; an
+existing (disposable!) server can be used with --dsn instead (DSN of any
+database other than 'tournaments', which gets recreated by
+extra/tournaments.sql).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTRA = os.path.join(ROOT, 'extra')
+sys.path.insert(0, EXTRA)
+
+import tournaments as t  # noqa: E402 (needs the path above)
+
+try:
+    import numpy  # needed for tiebreaks (optional)
+except ImportError:
+    numpy = None
+
+
+SIZES = (16, 128, 1024, 16384)
+# Durations of identical runs differ by up to 80% on a busy machine (even
+# by their median over repeats), so only operations at least twice as slow
+# as the baseline (see --tolerance) and slower by more than NOISE seconds
+# (operations taking about a millisecond differ by as much) are reported as
+# regressions.
+TOLERANCE = 1.0
+NOISE = 0.002
+
+
+# SUPPORTING FUNCTIONS
+
+
+def s_log(message):
+    """Print progress message to stderr (stdout is kept for results)."""
+    sys.stderr.write(message + "\n")
+    sys.stderr.flush()
+
+
+def s_binary(name, pg_bin):
+    """Return path of PostgreSQL binary of given name."""
+    if pg_bin:
+        return os.path.join(pg_bin, name)
+    return name
+
+
+@contextmanager
+def s_cluster(pg_bin):
+    """Run a throwaway PostgreSQL cluster in a temporary directory.
+
+    The cluster listens on a unix socket in the same directory only and runs
+    with fsync off (durability does not matter for a benchmark).
+
+    Yields DSN of the 'postgres' database of the cluster.
+    """
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        raise SystemExit("initdb can not be run as root, run the benchmark "
+                         "as another user or use --dsn.")
+    tmp = tempfile.mkdtemp(prefix='tournaments_bench_')
+    data = os.path.join(tmp, 'data')
+    log = os.path.join(tmp, 'postgres.log')
+    try:
+        s_log("Creating cluster in '{0}'.".format(tmp))
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                [s_binary('initdb', pg_bin), '-D', data, '-U', 'postgres',
+                 '-A', 'trust', '-E', 'UTF8', '--no-sync'],
+                stdout=devnull)
+            subprocess.check_call(
+                [s_binary('pg_ctl', pg_bin), '-D', data, '-l', log, '-w',
+                 '-o', "-k {0} -c listen_addresses='' -F".format(tmp),
+                 'start'],
+                stdout=devnull)
+        try:
+            yield 'host={0} user=postgres dbname=postgres'.format(tmp)
+        finally:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call([s_binary('pg_ctl', pg_bin), '-D', data,
+                                 '-m', 'immediate', '-w', 'stop'],
+                                stdout=devnull)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def s_loadSchema(dsn, pg_bin):
+    """Create the 'tournaments' database by running extra/tournaments.sql."""
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            [s_binary('psql', pg_bin), '-q', '-d', dsn,
+             '-f', os.path.join(EXTRA, 'tournaments.sql')],
+            stdout=devnull, stderr=devnull)
+
+
+def s_summary(samples):
+    """Return statistics of a list of durations (in seconds)."""
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        'count': n,
+        'total': sum(samples),
+        'mean': sum(samples) / n,
+        'p50': samples[n // 2],
+        'p95': samples[min(n - 1, int(n * 0.95))],
+        'max': samples[-1],
+    }
+
+
+def s_median(runs):
+    """Combine statistics of repeats of a benchmark.
+
+    Args:
+        runs: List of results of the repeats, each a dictionary mapping name
+              of each operation to statistics of its durations.
+    Returns:
+        A dictionary mapping name of each operation to statistics of the
+        repeat of median p50 duration, with p50 durations of all repeats (in
+        order of the repeats) added as 'repeats'.
+    """
+    res = {}
+    for op in runs[0]:
+        stats = [run[op] for run in runs if op in run]
+        median = sorted(stats, key=lambda s: s['p50'])[len(stats) // 2]
+        res[op] = dict(median, repeats=[s['p50'] for s in stats])
+    return res
+
+
+def s_regressions(results, baseline, tolerance):
+    """Compare median (p50) durations of a run with a baseline.
+
+    Args:
+        results: Results of the current run (see benchSize) by size.
+        baseline: Results of an earlier run by size.
+        tolerance: Allowed slowdown as fraction of the baseline.
+    Returns:
+        A list of strings describing operations that got slower.
+    """
+    res = []
+    # sizes (numbers of players) first, then other scenarios
+    for (size, ops) in sorted(results.items(), key=lambda x: (
+            not x[0].isdigit(), int(x[0]) if x[0].isdigit() else 0, x[0])):
+        label = "{0} players".format(size) if size.isdigit() else size
+        for (op, stats) in sorted(ops.items()):
+            old = baseline.get(size, {}).get(op)
+            if old is None:
+                continue
+            (new_p50, old_p50) = (stats['p50'], old['p50'])
+            if (new_p50 > old_p50 * (1 + tolerance) and
+                    new_p50 - old_p50 > NOISE):
+                res.append("{0}, {1}: {2:.2f}ms (baseline "
+                           "{3:.2f}ms)".format(label, op, new_p50 * 1000,
+                                               old_p50 * 1000))
+    return res
+
+
+# BENCHMARK
+
+
+def benchSize(n, tours, rounds, seed=0):
+    """Run the benchmark for one number of players.
+
+    Args:
+        n: Number of players.
+        tours: Number of tournaments all players are registered for.
+        rounds: Number of rounds played in each tournament.
+        seed: Seed of random results of matches.
+    Returns:
+        A dictionary mapping name of each operation to statistics of its
+        durations (see s_summary).
+    """
+    rng = random.Random(seed)
+    samples = {}
+
+    def timed(op, f, *args):
+        start = timer()
+        res = f(*args)
+        samples.setdefault(op, []).append(timer() - start)
+        return res
+
+    t.a_deleteAllTours()
+    t.a_deleteAllPlayers()
+
+    player_ids = [timed('create_player', t.createNewPlayer,
+                        "Player {0}".format(i)) for i in range(n)]
+
+    for k in range(tours):
+        tour_id = timed('create_tour', t.createNewTour,
+                        "Tournament {0}".format(k))
+        timed('register', t.registerPlayers, tour_id, *player_ids)
+        t.changeTourStatus(tour_id, 'ongoing')
+
+        for r in range(rounds):
+            pairings = timed('pairings', t.swissPairings, tour_id)
+            for (id1, n1, id2, n2) in pairings:
+                if id1 == id2:
+                    (s1, s2) = (0, 0)
+                else:
+                    (s1, s2) = rng.choice(((1, 0), (0, 1), (1, 1)))
+                timed('report', t.reportMatch, tour_id, id1, s1, id2, s2)
+            timed('standings', t.tournamentStandings, tour_id)
+            if numpy is not None:
+                timed('standings_tiebreaks', t.tournamentStandings,
+                      tour_id, ['buchholz', 'sonneborn_berger'])
+
+        timed('count_registered', t.countRegPlayers, tour_id)
+    timed('count_tours', t.countTours)
+    timed('count_players', t.countPlayers, 'active')
+
+    return dict((op, s_summary(s)) for (op, s) in samples.items())
+
+
+def benchLeague(tours, players, rounds, seed=0):
+    """Run the benchmark of a league night.
+
+    Args:
+        tours: Number of tournaments played at once.
+        players: Number of players of each tournament.
+        rounds: Number of rounds played in each tournament.
+        seed: Seed of random results of matches.
+    Returns:
+        A dictionary mapping name of each operation to statistics of its
+        durations (see s_summary), one sample per round:
+            pair_sequential: swissPairings of each tournament one by one
+            pair_all: pairAllOngoing
+            report_round: reportMatches of the round of each tournament
+            round_turnover: pair_all and report_round together
+    """
+    rng = random.Random(seed)
+    samples = {}
+
+    t.a_deleteAllTours()
+    t.a_deleteAllPlayers()
+    tour_ids = t.createNewTours(["League {0}".format(k)
+                                 for k in range(tours)])
+    for tour_id in tour_ids:
+        player_ids = t.createNewPlayers(
+            ["Player {0}/{1}".format(tour_id, i) for i in range(players)])
+        t.registerPlayers(tour_id, *player_ids)
+        t.changeTourStatus(tour_id, 'ongoing')
+
+    for r in range(rounds):
+        start = timer()
+        for tour_id in tour_ids:
+            t.swissPairings(tour_id)
+        samples.setdefault('pair_sequential', []).append(timer() - start)
+
+        start = timer()
+        pairings = t.pairAllOngoing()
+        paired = timer()
+        for tour_id in tour_ids:
+            results = []
+            for (id1, n1, id2, n2) in pairings[tour_id]:
+                if id1 == id2:
+                    (s1, s2) = (0, 0)
+                else:
+                    (s1, s2) = rng.choice(((1, 0), (0, 1), (1, 1)))
+                results.append((id1, s1, id2, s2))
+            t.reportMatches(tour_id, results)
+        end = timer()
+        samples.setdefault('pair_all', []).append(paired - start)
+        samples.setdefault('report_round', []).append(end - paired)
+        samples.setdefault('round_turnover', []).append(end - start)
+
+    return dict((op, s_summary(s)) for (op, s) in samples.items())
+
+
+def s_run(admin_dsn, sizes, args):
+    """Run the benchmark against a PostgreSQL server.
+
+    Args:
+        admin_dsn: DSN of a database of the server other than 'tournaments'.
+        sizes: List of numbers of players.
+        args: Parsed command line arguments.
+    Returns:
+        A dictionary with the results and description of the run.
+    """
+    s_loadSchema(admin_dsn, args.pg_bin)
+    # same server, database created by tournaments.sql
+    dsn = ' '.join(p for p in admin_dsn.split()
+                   if not p.startswith('dbname=')) + ' dbname=tournaments'
+    t.s_configurePool(dsn=dsn)
+    # measure the database, not the cache
+    t.s_configureCache(maxsize=0)
+    with t.s_connect() as db:
+        c = db.cursor()
+        c.execute("SHOW server_version")
+        server_version = c.fetchone()[0]
+        c.close()
+
+    runs = {}
+    try:
+        for r in range(args.repeat):
+            for n in sizes:
+                s_log("Benchmarking {0} players (repeat {1}).".format(
+                    n, r + 1))
+                start = time.time()
+                runs.setdefault(str(n), []).append(
+                    benchSize(n, args.tours, args.rounds))
+                s_log("Done in {0:.1f}s.".format(time.time() - start))
+            if args.league_tours:
+                s_log("Benchmarking league of {0} tournaments of {1} "
+                      "players (repeat {2}).".format(
+                          args.league_tours, args.league_players, r + 1))
+                start = time.time()
+                runs.setdefault('league', []).append(
+                    benchLeague(args.league_tours, args.league_players,
+                                args.rounds))
+                s_log("Done in {0:.1f}s.".format(time.time() - start))
+    finally:
+        t.s_closePool()
+    results = dict((size, s_median(r)) for (size, r) in runs.items())
+
+    return {
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'postgres': server_version,
+            'sizes': sizes,
+            'tours': args.tours,
+            'rounds': args.rounds,
+            'repeat': args.repeat,
+            'league_tours': args.league_tours,
+            'league_players': args.league_players,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the 'extra' tournaments module.")
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help="comma separated numbers of players")
+    parser.add_argument('--tours', type=int, default=2,
+                        help="number of tournaments per size")
+    parser.add_argument('--rounds', type=int, default=3,
+                        help="number of rounds per tournament")
+    parser.add_argument('--league-tours', type=int, default=200,
+                        help="number of tournaments of the league night "
+                             "(0 to skip it)")
+    parser.add_argument('--league-players', type=int, default=32,
+                        help="number of players of each league tournament")
+    parser.add_argument('--output', help="file to write results to "
+                                         "(stdout by default)")
+    parser.add_argument('--baseline', help="results of an earlier run to "
+                                           "compare with")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="number of repeats of the benchmark (results "
+                             "of the median repeat are reported)")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="allowed slowdown against the baseline as a "
+                             "fraction ({0} by default)".format(TOLERANCE))
+    parser.add_argument('--pg-bin', default=os.environ.get('PG_BIN'),
+                        help="directory with initdb, pg_ctl and psql")
+    parser.add_argument('--dsn', help="use existing server instead of a "
+                                      "throwaway cluster (DSN of a database "
+                                      "other than 'tournaments', which gets "
+                                      "recreated)")
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    if args.dsn:
+        report = s_run(args.dsn, sizes, args)
+    else:
+        with s_cluster(args.pg_bin) as dsn:
+            report = s_run(dsn, sizes, args)
+
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + "\n")
+    else:
+        print out
+
+    if baseline is not None:
+        regressions = s_regressions(report['results'], baseline,
+                                    args.tolerance)
+        for r in regressions:
+            s_log("Regression: " + r)
+        if regressions:
+            return 1
+        s_log("No regressions against '{0}'.".format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
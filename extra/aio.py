@@ -0,0 +1,841 @@
+"""Asyncio variant of the public functions of the tournaments module.
+
+The functions have the same names, arguments and results as those of
+tournaments.py, but they are coroutines running their queries on a pool of
+asynchronous connections (aiopg), so that an event loop is never blocked
+waiting for the database and concurrent calls (e.g. requests for different
+tournaments) overlap their waits.
+
+Everything but the database access is shared with tournaments.py: messages
+are logged by the same logger, standings and pairings are cached in the same
+result cache (validated by revision of the tournament the same way) and
+pairings and tiebreaks are computed from the same indexes of opponents.
+Calls of these functions are not recorded by the instrumentation (see
+instrumentation.py).
+
+Requires Python 3.7+ and aiopg. The pool takes its DSN and size from
+tournaments.POOL_SETTINGS and belongs to the event loop which created it;
+close it by s_closePool() before the loop ends.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiopg
+
+import tournaments as t
+from pairing import pairPlayers
+from tournaments import ItemStatus, MatchStatus, Pairing, logger
+
+
+# CONNECTION POOL
+
+_pool = None
+_pool_loop = None
+_pool_lock = None
+
+
+async def s_getPool():
+    """Return the pool of connections of the running event loop.
+
+    The pool is created upon first use (with settings of the pool of
+    tournaments.py) and created again if used by another event loop.
+    """
+    global _pool, _pool_loop, _pool_lock
+    loop = asyncio.get_running_loop()
+    if _pool_loop is not loop:
+        (_pool, _pool_loop, _pool_lock) = (None, loop, asyncio.Lock())
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await aiopg.create_pool(
+                t.POOL_SETTINGS['dsn'], minsize=t.POOL_SETTINGS['minconn'],
+                maxsize=t.POOL_SETTINGS['maxconn'])
+    return _pool
+
+
+async def s_closePool():
+    """Close all connections of the pool (of the running event loop)."""
+    global _pool
+    if _pool is not None and _pool_loop is asyncio.get_running_loop():
+        _pool.close()
+        await _pool.wait_closed()
+    _pool = None
+
+
+@asynccontextmanager
+async def s_connect():
+    """Lend a cursor of a pooled connection within a transaction.
+
+    To be used as an async context manager. When the block ends the
+    transaction is committed (or rolled back in case of an exception) and
+    the connection is returned to the pool.
+
+    Yields a database cursor.
+    """
+    pool = await s_getPool()
+    async with pool.acquire() as db:
+        async with db.cursor() as c:
+            async with c.begin():
+                yield c
+
+
+# SUPPORTING FUNCTIONS
+
+
+async def s_getRevision(c, tour_id):
+    """Return revision of given tournament (see tournaments.s_getRevision)."""
+    await c.execute("SELECT revision FROM tournaments WHERE id = %s",
+                    (tour_id,))
+    res = await c.fetchone()
+    return res[0] if res else None
+
+
+async def s_getOpponentIndex(c, tour_id):
+    """Return index of opponents of given tournament brought up to date.
+
+    Same as tournaments.s_getOpponentIndex (sharing its indexes), but
+    matches recorded since the last update are fetched asynchronously.
+    """
+    index = t.s_loadedOpponentIndex(tour_id)
+    await c.execute("SELECT id, pl1_id, pl2_id, winner_id FROM matchesRaw "
+                    "WHERE tour_id = %s AND id > %s AND archived = "
+                    "(SELECT archived FROM tournaments WHERE id = %s) "
+                    "ORDER BY id",
+                    (tour_id, index.last_match_id, tour_id))
+    rows = await c.fetchall()
+    # matches added meanwhile by others are skipped by the index
+    with index.lock:
+        index.addMatches(rows)
+    return index
+
+
+async def s_checkTourPlayers(c, tour_id, player_ids, active=False,
+                             registered=True, lock=False):
+    """Validate a tournament and players for an operation in one query.
+
+    See tournaments.s_checkTourPlayers.
+    """
+    await c.execute("WITH t AS (SELECT id, status FROM tournaments "
+                    "WHERE id = %(tour_id)s {0}) "
+                    "SELECT t.status, i.id, "
+                    "CASE WHEN p.id IS NULL THEN 'invalid' "
+                    "WHEN %(active)s AND p.status != 'active' "
+                    "THEN 'inactive' "
+                    "WHEN %(registered)s AND r.player_id IS NULL "
+                    "THEN 'unregistered' "
+                    "WHEN NOT %(registered)s AND r.player_id IS NOT NULL "
+                    "THEN 'registered' "
+                    "END "
+                    "FROM (VALUES (%(tour_id)s::int)) AS q (tour_id) "
+                    "LEFT JOIN t ON t.id = q.tour_id "
+                    "LEFT JOIN unnest(%(ids)s::int[]) AS i (id) ON true "
+                    "LEFT JOIN players AS p ON p.id = i.id "
+                    "LEFT JOIN registrations AS r "
+                    "ON r.tour_id = q.tour_id AND r.player_id = i.id "
+                    "AND NOT r.archived".format(
+                        'FOR NO KEY UPDATE' if lock else ''),
+                    {'tour_id': tour_id, 'ids': list(player_ids),
+                     'active': active, 'registered': registered})
+    rows = await c.fetchall()
+
+    tour_status = rows[0][0]
+    rejected = dict((i, reason) for (s, i, reason) in rows
+                    if i is not None and reason is not None)
+    return tour_status, rejected
+
+
+async def s_getPairingsOf(c, tour_id, matches):
+    """Read pairings of results of matches (see t.s_getPairingsOf)."""
+    await c.execute("SELECT p.id, p.pl1_id, p.pl2_id, p.abandoned, false "
+                    "FROM pairings AS p "
+                    "WHERE p.tour_id = %(tour_id)s "
+                    "AND p.id = ANY (%(ids)s::int[]) "
+                    "UNION ALL "
+                    "SELECT p.id, p.pl1_id, p.pl2_id, p.abandoned, true "
+                    "FROM pairings AS p "
+                    "WHERE p.tour_id = %(tour_id)s "
+                    "AND p.round = (SELECT max(round) FROM rounds "
+                    "WHERE tour_id = %(tour_id)s) "
+                    "AND NOT p.abandoned "
+                    "AND p.pl1_id = ANY (%(players)s::int[]) "
+                    "AND NOT EXISTS (SELECT 1 FROM matchesRaw AS m "
+                    "WHERE m.pairing_id = p.id) "
+                    "ORDER BY 1",
+                    {'tour_id': tour_id,
+                     'ids': list(set(m[5] for m in matches
+                                     if m[5] is not None)),
+                     'players': list(set(m[i] for m in matches
+                                         for i in (0, 2)))})
+    return await c.fetchall()
+
+
+async def s_getStatuses(type_name, reload=False):
+    """Return valid values of a status type (see t.s_getStatuses).
+
+    The catalog is shared with the synchronous functions.
+    """
+    statuses = None if reload else t._statuses.get(type_name)
+    if statuses is None:
+        async with s_connect() as c:
+            await c.execute("SELECT unnest(enum_range(NULL::{0}))::text"
+                            .format(type_name))
+            statuses = tuple(s[0] for s in await c.fetchall())
+        t._statuses[type_name] = statuses
+    return statuses
+
+
+async def s_countTP(c_type, *status):
+    """Count tournaments or players (see tournaments.s_countTP)."""
+    types = {
+        't': {'status': 'tourStatus', 'view': 'v_toursCountByStatus'},
+        'p': {'status': 'playerStatus', 'view': 'v_playersCountByStatus'}
+    }
+    if c_type not in types:
+        logger.warning("Invalid c_type: '%s'!", c_type)
+        return None
+
+    db_statuses = await s_getStatuses(types[c_type]['status'])
+    if status:
+        if not set(status) <= set(db_statuses):
+            db_statuses = await s_getStatuses(types[c_type]['status'],
+                                              reload=True)
+        for s in status:
+            if s not in db_statuses:
+                logger.warning("Invalid status: '%s'!", s)
+                return None
+    else:
+        status = db_statuses
+    async with s_connect() as c:
+        await c.execute("SELECT coalesce(sum(count), 0)::bigint FROM {0} "
+                        "WHERE status = ANY (%s)".format(
+                            types[c_type]['view']), (list(status),))
+        res = (await c.fetchone())[0]
+    return res
+
+
+async def s_createTP(table, status, names):
+    """Insert tournaments or players by one statement (see s_createTP)."""
+    names = list(names)
+    if not names:
+        return []
+    async with s_connect() as c:
+        await c.execute("INSERT INTO {0} (name, status) "
+                        "SELECT n.name, %s "
+                        "FROM unnest(%s::text[]) WITH ORDINALITY "
+                        "AS n (name, ord) "
+                        "ORDER BY n.ord "
+                        "RETURNING id".format(table), (status, names))
+        res = sorted(r[0] for r in await c.fetchall())
+    return res
+
+
+async def s_editTP(table, r_id, **kwargs):
+    """Change name and/or status of a player or a tournament.
+
+    See tournaments.s_editTP.
+    """
+    name = kwargs.get('name')
+    status = kwargs.get('status')
+
+    async with s_connect() as c:
+        await c.execute("SELECT id FROM {0} WHERE id = %s".format(table),
+                        (r_id,))
+        if await c.fetchone() is None:
+            logger.warning("Invalid id '%s'!", r_id)
+            return None
+        # archived tournaments stay closed (see tournaments.archiveTour)
+        if status and table == 'tournaments':
+            await c.execute("SELECT archived FROM tournaments "
+                            "WHERE id = %s", (r_id,))
+            if (await c.fetchone())[0]:
+                logger.warning("Tournament '%s' is archived!", r_id)
+                return None
+        if name:
+            await c.execute("UPDATE {0} SET name = %s "
+                            "WHERE id = %s".format(table), (name, r_id))
+            logger.info("Name of %s id '%s' changed to '%s'.",
+                        table[0:-1], r_id, name)
+        if status:
+            await c.execute("UPDATE {0} SET status = %s "
+                            "WHERE id = %s".format(table), (status, r_id))
+            logger.info("Status of %s id '%s' changed to '%s'.",
+                        table[0:-1], r_id, status)
+
+    # names of players appear in results cached for any tournament
+    if table == 'tournaments':
+        t.s_invalidateCache(r_id)
+    elif name:
+        t.s_invalidateCache()
+    return True
+
+
+# USER FUNCTIONS
+
+
+async def createNewTour(name):
+    """Add a new tournament (see tournaments.createNewTour)."""
+    async with s_connect() as c:
+        await c.execute("INSERT INTO tournaments (name, status) "
+                        "VALUES (%s, 'planned') RETURNING id", (name,))
+        tour_id = (await c.fetchone())[0]
+    logger.info("Tournament '%s' created with the following id: '%s'.",
+                name, tour_id)
+    return tour_id
+
+
+async def createNewTours(names):
+    """Add multiple tournaments at once (see tournaments.createNewTours)."""
+    tour_ids = await s_createTP('tournaments', 'planned', names)
+    logger.info("%s tournaments created.", len(tour_ids))
+    return tour_ids
+
+
+async def changeTourName(tour_id, new_name):
+    """Change name of tournament (see tournaments.changeTourName)."""
+    return await s_editTP('tournaments', tour_id, name=new_name)
+
+
+async def changeTourStatus(tour_id, new_status):
+    """Change status of tournament (see tournaments.changeTourStatus)."""
+    return await s_editTP('tournaments', tour_id, status=new_status)
+
+
+async def archiveTour(tour_id):
+    """Move a closed tournament to the archived partitions.
+
+    See tournaments.archiveTour.
+    """
+    async with s_connect() as c:
+        await c.execute("SELECT status, archived FROM tournaments "
+                        "WHERE id = %s FOR UPDATE", (tour_id,))
+        res = await c.fetchone()
+        if res is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        if res[1]:
+            logger.warning("Tournament '%s' is already archived!", tour_id)
+            return None
+        if res[0] != 'closed':
+            logger.warning("Unable to archive tournament '%s' with status "
+                           "'%s'!", tour_id, res[0])
+            return None
+        await c.execute("UPDATE tournaments SET archived = true "
+                        "WHERE id = %s", (tour_id,))
+        await c.execute("UPDATE matchesRaw SET archived = true "
+                        "WHERE tour_id = %s AND NOT archived", (tour_id,))
+        matches = c.rowcount
+        await c.execute("UPDATE registrations SET archived = true "
+                        "WHERE tour_id = %s AND NOT archived", (tour_id,))
+    t.s_invalidateCache(tour_id)
+
+    logger.info("Tournament '%s' archived (%s matches moved).", tour_id,
+                matches)
+    return True
+
+
+async def countTours(*status):
+    """Count tournaments (see tournaments.countTours)."""
+    return await s_countTP('t', *status)
+
+
+async def createNewPlayer(name):
+    """Add a new player (see tournaments.createNewPlayer)."""
+    async with s_connect() as c:
+        await c.execute("INSERT INTO players (name, status) "
+                        "VALUES (%s, 'active') RETURNING id", (name,))
+        player_id = (await c.fetchone())[0]
+    logger.info("Player '%s' created with the following id: '%s'.",
+                name, player_id)
+    return player_id
+
+
+async def createNewPlayers(names):
+    """Add multiple players at once (see tournaments.createNewPlayers)."""
+    player_ids = await s_createTP('players', 'active', names)
+    logger.info("%s players created.", len(player_ids))
+    return player_ids
+
+
+async def changePlayerName(player_id, new_name):
+    """Change name of player (see tournaments.changePlayerName)."""
+    return await s_editTP('players', player_id, name=new_name)
+
+
+async def changePlayerStatus(player_id, new_status):
+    """Change status of player (see tournaments.changePlayerStatus)."""
+    return await s_editTP('players', player_id, status=new_status)
+
+
+async def countPlayers(*status):
+    """Count players (see tournaments.countPlayers)."""
+    return await s_countTP('p', *status)
+
+
+async def registerPlayers(tour_id, *player_id):
+    """Register players for a tournament (see tournaments.registerPlayers)."""
+    # drop duplicate ids (keeping the order in which they were provided)
+    unique_ids, seen = [], set()
+    for p in player_id:
+        if p not in seen:
+            seen.add(p)
+            unique_ids.append(p)
+    player_id = unique_ids
+
+    async with s_connect() as c:
+        tour_status, rejected = await s_checkTourPlayers(
+            c, tour_id, player_id, active=True, registered=False)
+        if tour_status is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        if tour_status != 'planned':
+            logger.warning("Unable to register for tournament id '%s'! "
+                           "Tournament no longer in 'planned' phase.",
+                           tour_id)
+            return None
+        res = []
+        accepted = []
+        for p in player_id:
+            if rejected.get(p) == 'invalid':
+                logger.warning("Invalid player id '%s'!", p)
+                res.append(ItemStatus(p, 'invalid'))
+            elif rejected.get(p) == 'inactive':
+                logger.warning("Unable to register player id '%s'! Player "
+                               "inactive.", p)
+                res.append(ItemStatus(p, 'inactive'))
+            elif rejected.get(p) == 'registered':
+                logger.info("Player id '%s' already registered for "
+                            "tournament id '%s'.", p, tour_id)
+                res.append(ItemStatus(p, 'already_registered'))
+            else:
+                accepted.append(p)
+                res.append(ItemStatus(p, 'registered'))
+        if accepted:
+            await c.execute("INSERT INTO registrations (tour_id, player_id) "
+                            "SELECT %s, unnest(%s::int[])",
+                            (tour_id, accepted))
+        if logger.isEnabledFor(logging.INFO):
+            for p in accepted:
+                logger.info("Player id '%s' registered for tournament "
+                            "id '%s'.", p, tour_id)
+
+    t.s_invalidateCache(tour_id)
+    return res
+
+
+async def countRegPlayers(tour_id):
+    """Count players registered to a tournament (see countRegPlayers)."""
+    async with s_connect() as c:
+        await c.execute("SELECT count(*) FROM registrations "
+                        "WHERE tour_id = %s", (tour_id,))
+        res = (await c.fetchone())[0]
+    return res
+
+
+async def deregisterPlayers(tour_id, *player_id):
+    """Deregister players (see tournaments.deregisterPlayers)."""
+    async with s_connect() as c:
+        tour_status, rejected = await s_checkTourPlayers(c, tour_id,
+                                                         player_id)
+        if tour_status is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        if tour_status != 'planned':
+            logger.warning("Unable to change registrations for tournament "
+                           "id '%s'! Tournament no longer in 'planned' "
+                           "phase.", tour_id)
+            return None
+        if player_id:
+            res = []
+            accepted = []
+            for p in player_id:
+                if rejected.get(p) == 'invalid':
+                    logger.warning("Invalid player id '%s'!", p)
+                    res.append(ItemStatus(p, 'invalid'))
+                elif rejected.get(p) == 'unregistered':
+                    logger.info("Player id '%s' not registered for "
+                                "tournament id '%s'.", p, tour_id)
+                    res.append(ItemStatus(p, 'unregistered'))
+                else:
+                    accepted.append(p)
+                    res.append(ItemStatus(p, 'deregistered'))
+            await c.execute("DELETE FROM registrations WHERE tour_id = %s "
+                            "AND player_id = ANY (%s::int[])",
+                            (tour_id, accepted))
+            if logger.isEnabledFor(logging.INFO):
+                for p in accepted:
+                    logger.info("Player id '%s' deregistered from "
+                                "tournament id '%s'.", p, tour_id)
+        else:
+            await c.execute("DELETE FROM registrations WHERE tour_id = %s "
+                            "RETURNING player_id", (tour_id,))
+            res = [ItemStatus(r[0], 'deregistered')
+                   for r in await c.fetchall()]
+            logger.info("All players of tournament id '%s' deregistered.",
+                        tour_id)
+
+    t.s_invalidateCache(tour_id)
+    return res
+
+
+async def tournamentStandings(tour_id, tiebreaks=None):
+    """Return standings of a tournament (see tournamentStandings)."""
+    if tiebreaks:
+        from tiebreaks import TIEBREAKS, computeTiebreaks
+        invalid = [tb for tb in tiebreaks if tb not in TIEBREAKS]
+        if invalid:
+            logger.warning("Invalid tiebreak/s: %s!", invalid)
+            return None
+
+    key = ('standings', tour_id, tuple(tiebreaks or ()))
+    async with s_connect() as c:
+        revision = await s_getRevision(c, tour_id)
+        if revision is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        res = t._cache.get(key, revision)
+        if res is not None:
+            return list(res)
+
+        await c.execute("SELECT * FROM v_tourStandings WHERE tour_id = %s",
+                        (tour_id,))
+        res = await c.fetchall()
+        if tiebreaks:
+            index = await s_getOpponentIndex(c, tour_id)
+
+    if tiebreaks:
+        with index.lock:
+            values = computeTiebreaks(index, [r[1] for r in res], tiebreaks)
+        res = [r + values[r[1]] for r in res]
+        # by wins, draws and then by tiebreaks (all descending)
+        res.sort(key=lambda r: [-v for v in (r[4], r[5]) + r[8:]])
+
+    t._cache.put(key, revision, res)
+    return list(res)
+
+
+async def reportMatch(tour_id, player1_id, player1_score, player2_id,
+                      player2_score, pairing_id=None, idempotency_key=None):
+    """Record the outcome of a single match (see tournaments.reportMatch)."""
+    async with s_connect() as c:
+        tour_status, rejected = await s_checkTourPlayers(
+            c, tour_id, (player1_id, player2_id), lock=True)
+        if tour_status is None:
+            logger.warning("Invalid id '%s'!", tour_id)
+            return None
+        if tour_status != 'ongoing':
+            logger.warning("Unable to report a match for tournament id '%s'! "
+                           "Tournament needs to be 'ongoing' to report "
+                           "results.", tour_id)
+            return None
+        for p in (player1_id, player2_id):
+            if rejected.get(p) == 'invalid':
+                logger.warning("Invalid player id '%s'!", p)
+                return None
+            if rejected.get(p) == 'unregistered':
+                logger.warning("Player id '%s' not registered for "
+                               "tournament id '%s'!", p, tour_id)
+                return None
+        match = (player1_id, player1_score, player2_id, player2_score,
+                 idempotency_key, pairing_id)
+        (pairing_id, status) = t.s_linkPairings(
+            [match], await s_getPairingsOf(c, tour_id, [match]))[0]
+        if status == 'invalid_pairing':
+            logger.warning("Invalid pairing id '%s'!", pairing_id)
+            return None
+        if status == 'abandoned':
+            logger.warning("Pairing id '%s' was abandoned!", pairing_id)
+            return None
+
+        await c.execute("INSERT INTO matchesRaw "
+                        "(tour_id, pl1_id, pl1_score, pl2_id, pl2_score, "
+                        "pairing_id, idempotency_key) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                        "ON CONFLICT DO NOTHING "
+                        "RETURNING id, pl1_id, pl2_id, winner_id",
+                        (tour_id, player1_id, player1_score,
+                         player2_id, player2_score, pairing_id,
+                         idempotency_key))
+        recorded = await c.fetchall()
+        if not recorded:
+            await c.execute("SELECT id, pl1_id, pl1_score, pl2_id, "
+                            "pl2_score FROM matchesRaw "
+                            "WHERE pairing_id = %s "
+                            "UNION "
+                            "SELECT id, pl1_id, pl1_score, pl2_id, "
+                            "pl2_score FROM matchesRaw "
+                            "WHERE tour_id = %s AND idempotency_key = %s "
+                            "ORDER BY id",
+                            (pairing_id, tour_id, idempotency_key))
+            matches = await c.fetchall()
+            if not matches:
+                logger.warning("Unable to report a match for tournament id "
+                               "'%s'! Conflicting match not found, the "
+                               "match needs to be reported again.", tour_id)
+                return None
+            return t.s_reportedBefore(matches, player1_id, player1_score,
+                                      player2_id, player2_score)
+
+    # committed by now (calls of this module never share a transaction)
+    t.s_addToOpponentIndex(tour_id, recorded)
+    t.s_invalidateCache(tour_id)
+    logger.info("Match id '%s' recorded for tournament id '%s'.",
+                recorded[0][0], tour_id)
+    return ItemStatus(recorded[0][0], 'recorded')
+
+
+async def reportMatches(tour_id, results):
+    """Record the outcome of multiple matches (see reportMatches)."""
+    matches = t.s_parseResults(results)
+    player_ids = set(m[i] for m in matches for i in (0, 2) if m[i] is not None)
+
+    async with s_connect() as c:
+        tour_status, rejected = await s_checkTourPlayers(c, tour_id,
+                                                         player_ids,
+                                                         lock=True)
+        if tour_status is None:
+            logger.warning("Invalid id '%s'!", tour_id)
+            return None
+        if tour_status != 'ongoing':
+            logger.warning("Unable to report matches for tournament id "
+                           "'%s'! Tournament needs to be 'ongoing' to report "
+                           "results.", tour_id)
+            return None
+
+        res = []
+        accepted = []
+        for m in matches:
+            (p1, s1, p2, s2) = m[:4]
+            if None in (p1, s1, p2, s2):
+                status = 'malformed'
+            else:
+                status = rejected.get(p1) or rejected.get(p2) or 'recorded'
+            if status == 'recorded':
+                accepted.append((len(res), m))
+            res.append(MatchStatus(p1, p2, status))
+
+        recorded = []
+        if accepted:
+            links = t.s_linkPairings(
+                [m for (i, m) in accepted],
+                await s_getPairingsOf(c, tour_id,
+                                      [m for (i, m) in accepted]))
+            linked = []
+            for ((i, m), (pairing_id, status)) in zip(accepted, links):
+                if status is None:
+                    linked.append((i, m[:5] + (pairing_id,)))
+                else:
+                    res[i] = res[i]._replace(status=status)
+            accepted = linked
+        if accepted:
+            # all matches by one statement, columns passed as arrays (ids
+            # are generated in order of the matches)
+            await c.execute("INSERT INTO matchesRaw "
+                            "(tour_id, pl1_id, pl1_score, pl2_id, pl2_score, "
+                            "idempotency_key, pairing_id) "
+                            "SELECT %s, m.p1, m.s1, m.p2, m.s2, m.key, "
+                            "m.pairing_id "
+                            "FROM unnest(%s::int[], %s::int[], %s::int[], "
+                            "%s::int[], %s::text[], %s::int[]) "
+                            "WITH ORDINALITY "
+                            "AS m (p1, s1, p2, s2, key, pairing_id, ord) "
+                            "ORDER BY m.ord "
+                            "ON CONFLICT DO NOTHING "
+                            "RETURNING id, pl1_id, pl2_id, winner_id, "
+                            "idempotency_key, pairing_id",
+                            [tour_id] + [list(col) for col in
+                                         zip(*[m for (i, m) in accepted])])
+            recorded = sorted(await c.fetchall())
+            keys = (set(m[4] for (i, m) in accepted if m[4] is not None) -
+                    set(r[4] for r in recorded))
+            pairing_ids = (set(m[5] for (i, m) in accepted
+                               if m[5] is not None) -
+                           set(r[5] for r in recorded))
+            existing = {}
+            if keys or pairing_ids:
+                await c.execute("SELECT idempotency_key, pairing_id, "
+                                "pl1_id, pl1_score, pl2_id, pl2_score "
+                                "FROM matchesRaw WHERE tour_id = %s "
+                                "AND (idempotency_key = ANY (%s::text[]) "
+                                "OR pairing_id = ANY (%s::int[]))",
+                                (tour_id, list(keys), list(pairing_ids)))
+                existing = t.s_existingResults(await c.fetchall(), keys,
+                                               pairing_ids)
+            statuses = t.s_keyedStatuses([m for (i, m) in accepted],
+                                         set(r[4:] for r in recorded),
+                                         existing)
+            for ((i, m), status) in zip(accepted, statuses):
+                res[i] = res[i]._replace(status=status)
+            recorded = [r[:4] for r in recorded]
+
+    # committed by now (calls of this module never share a transaction)
+    t.s_addToOpponentIndex(tour_id, recorded)
+    t.s_invalidateCache(tour_id)
+    return res
+
+
+async def swissPairings(tour_id):
+    """Return pairings for the next round (see tournaments.swissPairings)."""
+    async with s_connect() as c:
+        res = await s_swissPairings(c, tour_id)
+    if res is None:
+        logger.warning("Invalid id '%s'!", tour_id)
+    return res
+
+
+async def s_swissPairings(c, tour_id):
+    """Return pairings for the next round read by an open cursor.
+
+    Same as swissPairings (None in case of invalid tour_id, without logging
+    it), but standings and opponents are read within the transaction of the
+    cursor, so that no other pooled connection is needed.
+    """
+    key = ('pairings', tour_id)
+    revision = await s_getRevision(c, tour_id)
+    if revision is None:
+        return None
+    res = t._cache.get(key, revision)
+    if res is not None:
+        return list(res)
+
+    await c.execute("SELECT s.player_id, p.name, s.points, s.byes "
+                    "FROM player_tour_stats AS s "
+                    "JOIN players AS p ON p.id = s.player_id "
+                    "WHERE s.tour_id = %s "
+                    "ORDER BY s.wins DESC, s.draws DESC, s.omw DESC, "
+                    "s.player_id DESC",
+                    (tour_id,))
+    standings = await c.fetchall()
+    index = await s_getOpponentIndex(c, tour_id)
+
+    names = dict((i, n) for (i, n, points, byes) in standings)
+    with index.lock:
+        (pairs, bye) = pairPlayers(
+            [(i, points, byes) for (i, n, points, byes) in standings], index)
+
+    res = []
+    if bye is not None:
+        res.append((bye, names[bye], bye, names[bye]))
+    for (id1, id2) in pairs:
+        res.append((id1, names[id1], id2, names[id2]))
+
+    t._cache.put(key, revision, res)
+    return list(res)
+
+
+async def s_getPairings(c, tour_id, round_no):
+    """Return stored pairings of a round (see tournaments.getPairings)."""
+    await c.execute("SELECT p.id, p.round, p.pl1_id, n1.name, p.pl2_id, "
+                    "n2.name "
+                    "FROM pairings AS p "
+                    "JOIN players AS n1 ON n1.id = p.pl1_id "
+                    "JOIN players AS n2 ON n2.id = p.pl2_id "
+                    "WHERE p.tour_id = %(tour_id)s AND p.round = coalesce("
+                    "%(round)s, (SELECT max(round) FROM rounds "
+                    "WHERE tour_id = %(tour_id)s)) "
+                    "ORDER BY p.position",
+                    {'tour_id': tour_id, 'round': round_no})
+    return [Pairing(*r) for r in await c.fetchall()]
+
+
+async def startRound(tour_id):
+    """Start the next round of a tournament (see tournaments.startRound)."""
+    async with s_connect() as c:
+        # rounds of a tournament are started one at a time
+        await c.execute("SELECT status, revision FROM tournaments "
+                        "WHERE id = %s FOR UPDATE", (tour_id,))
+        tour = await c.fetchone()
+        if tour is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        (status, revision) = tour
+        if status != 'ongoing':
+            logger.warning("Unable to start a round of tournament id '%s'! "
+                           "Tournament needs to be 'ongoing'.", tour_id)
+            return None
+
+        await c.execute("SELECT r.round, r.revision, count(p.id) FILTER ("
+                        "WHERE NOT p.abandoned AND NOT EXISTS (SELECT 1 "
+                        "FROM matchesRaw AS m WHERE m.pairing_id = p.id)), "
+                        "count(p.id) FILTER (WHERE p.abandoned) "
+                        "FROM (SELECT round, revision FROM rounds "
+                        "WHERE tour_id = %s ORDER BY round DESC LIMIT 1) "
+                        "AS r "
+                        "LEFT JOIN pairings AS p "
+                        "ON p.tour_id = %s AND p.round = r.round "
+                        "GROUP BY r.round, r.revision", (tour_id, tour_id))
+        last = await c.fetchone()
+        if last is not None and (last[2] or (last[1] == revision and
+                                             not last[3])):
+            return await s_getPairings(c, tour_id, last[0])
+        round_no = last[0] + 1 if last is not None else 1
+
+        await c.execute("SELECT pl1_id, pl2_id FROM proposed_pairings "
+                        "WHERE tour_id = %s AND revision = %s "
+                        "ORDER BY position", (tour_id, revision))
+        pairs = await c.fetchall()
+        if not pairs:
+            # paired on this connection (waiting for another one while
+            # holding this one and the lock could exhaust the pool)
+            pairs = [(p[0], p[2])
+                     for p in await s_swissPairings(c, tour_id)]
+        await c.execute("INSERT INTO rounds (tour_id, round, revision) "
+                        "VALUES (%s, %s, %s)", (tour_id, round_no, revision))
+        await c.execute("INSERT INTO pairings "
+                        "(tour_id, round, position, pl1_id, pl2_id) "
+                        "SELECT %s, %s, p.ord - 1, p.pl1_id, p.pl2_id "
+                        "FROM unnest(%s::int[], %s::int[]) WITH ORDINALITY "
+                        "AS p (pl1_id, pl2_id, ord)",
+                        (tour_id, round_no, [p[0] for p in pairs],
+                         [p[1] for p in pairs]))
+        res = await s_getPairings(c, tour_id, round_no)
+
+    logger.info("Round %s of tournament id '%s' started.", round_no, tour_id)
+    return res
+
+
+async def abandonPairing(tour_id, pairing_id):
+    """Mark a pairing as not to be played (see tournaments.abandonPairing)."""
+    async with s_connect() as c:
+        await c.execute("SELECT status FROM tournaments WHERE id = %s "
+                        "FOR UPDATE", (tour_id,))
+        tour = await c.fetchone()
+        if tour is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        if tour[0] != 'ongoing':
+            logger.warning("Unable to abandon a pairing of tournament id "
+                           "'%s'! Tournament needs to be 'ongoing'.", tour_id)
+            return None
+        await c.execute("SELECT EXISTS (SELECT 1 FROM matchesRaw "
+                        "WHERE pairing_id = p.id) "
+                        "FROM pairings AS p "
+                        "WHERE p.id = %s AND p.tour_id = %s",
+                        (pairing_id, tour_id))
+        played = await c.fetchone()
+        if played is None:
+            logger.warning("Invalid pairing id '%s'!", pairing_id)
+            return None
+        if played[0]:
+            logger.warning("Match of pairing id '%s' already recorded!",
+                           pairing_id)
+            return None
+        await c.execute("UPDATE pairings SET abandoned = true WHERE id = %s",
+                        (pairing_id,))
+
+    logger.info("Pairing id '%s' of tournament id '%s' abandoned.",
+                pairing_id, tour_id)
+    return True
+
+
+async def getPairings(tour_id, round_no=None):
+    """Return stored pairings of a round (see tournaments.getPairings)."""
+    async with s_connect() as c:
+        res = await s_getPairings(c, tour_id, round_no)
+        if not res:
+            await c.execute("SELECT id FROM tournaments WHERE id = %s",
+                            (tour_id,))
+            if await c.fetchone() is None:
+                logger.warning("Invalid tournament id '%s'!", tour_id)
+                return None
+    return res
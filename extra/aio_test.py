@@ -0,0 +1,228 @@
+"""Test cases for aio.py (Python 3.7+, aiopg).
+
+Run against the same local database as tournaments_test.py (see
+TOURNAMENTS_DSN in tournaments.py).
+"""
+
+import asyncio
+import random
+import time
+
+import aio
+import tournaments
+
+
+def t_run(coro):
+    """Run coroutine in a new event loop (closing the pool afterwards)."""
+    async def run():
+        try:
+            return await coro
+        finally:
+            await aio.s_closePool()
+    return asyncio.run(run())
+
+
+# TEST FUNCTIONS
+
+def testCreateAndCount():
+    """Test creating tournaments and players and counting them."""
+    async def test():
+        tournaments.a_deleteAllTours()
+        tournaments.a_deleteAllPlayers()
+        tour_id = await aio.createNewTour("Knight or Knave")
+        player_ids = await aio.createNewPlayers(["Elon Musk", "Bruno Walton"])
+        player_ids.append(await aio.createNewPlayer("Boots O'Neal"))
+        if await aio.countTours() != 1 or await aio.countPlayers() != 3:
+            raise ValueError("Created tournaments and players should be "
+                             "counted.")
+        if await aio.countTours('invalid') is not None:
+            raise ValueError("Invalid status should be rejected.")
+        if not await aio.changePlayerStatus(player_ids[2], 'inactive'):
+            raise ValueError("Status of player should be changed.")
+        if await aio.countPlayers('active') != 2:
+            raise ValueError("Only active players should be counted.")
+        if await aio.changeTourStatus(0, 'ongoing') is not None:
+            raise ValueError("Invalid tournament should be rejected.")
+        res = await aio.registerPlayers(tour_id, *player_ids)
+        if [r.status for r in res] != ['registered', 'registered',
+                                       'inactive']:
+            raise ValueError("Only active players should be registered.")
+        if await aio.countRegPlayers(tour_id) != 2:
+            raise ValueError("Registered players should be counted.")
+        res = await aio.deregisterPlayers(tour_id, player_ids[0])
+        if res != [tournaments.ItemStatus(player_ids[0], 'deregistered')]:
+            raise ValueError("Player should be deregistered.")
+    t_run(test())
+    print("1. Success: tournaments and players are created and counted.")
+
+
+def testSameResults():
+    """Test that results are the same as of the synchronous functions."""
+    async def test():
+        player_ids = await aio.createNewPlayers(
+            ["Player {0}".format(i) for i in range(9)])
+        tour_id = await aio.createNewTour("Jolly Roger")
+        await aio.registerPlayers(tour_id, *player_ids)
+        await aio.changeTourStatus(tour_id, 'ongoing')
+        random.seed(0)
+        for r in range(3):
+            pairings = await aio.swissPairings(tour_id)
+            # same pairings as computed by the synchronous function (without
+            # the cache)
+            tournaments.s_invalidateCache(tour_id)
+            if pairings != tournaments.swissPairings(tour_id):
+                raise ValueError("Pairings should be the same as of "
+                                 "tournaments.swissPairings().")
+            (bye, pairs) = (pairings[0], pairings[1:])
+            if await aio.reportMatch(tour_id, bye[0], 0, bye[2], 0) is None:
+                raise ValueError("Bye should be recorded.")
+            res = await aio.reportMatches(
+                tour_id, [(id1, random.randint(0, 3), id2,
+                           random.randint(0, 3))
+                          for (id1, n1, id2, n2) in pairs] + [(1, 2)])
+            if [r.status for r in res] != ['recorded'] * 4 + ['malformed']:
+                raise ValueError("Matches should be recorded.")
+        tournaments.s_invalidateCache(tour_id)
+        if (await aio.tournamentStandings(tour_id) !=
+                tournaments.tournamentStandings(tour_id)):
+            raise ValueError("Standings should be the same as of "
+                             "tournaments.tournamentStandings().")
+        if await aio.reportMatch(tour_id, 0, 1, player_ids[0], 0) is not None:
+            raise ValueError("Match of invalid player should be rejected.")
+    t_run(test())
+    print("2. Success: results are the same as of synchronous functions.")
+
+
+def testConcurrency():
+    """Test that concurrent calls overlap their waits for the database."""
+    async def test():
+        async def slow():
+            async with aio.s_connect() as c:
+                await c.execute("SELECT pg_sleep(0.2)")
+
+        start = time.time()
+        await asyncio.gather(*[slow() for i in range(5)])
+        if time.time() - start > 0.6:
+            raise ValueError("Concurrent queries should overlap.")
+
+        # tournaments played at once
+        tour_ids = await aio.createNewTours(
+            ["Tour {0}".format(i) for i in range(8)])
+
+        async def play(tour_id):
+            player_ids = await aio.createNewPlayers(
+                ["Player {0}/{1}".format(tour_id, i) for i in range(16)])
+            await aio.registerPlayers(tour_id, *player_ids)
+            await aio.changeTourStatus(tour_id, 'ongoing')
+            for r in range(4):
+                for (id1, n1, id2, n2) in await aio.swissPairings(tour_id):
+                    await aio.reportMatch(tour_id, id1, 1, id2, 0)
+            return await aio.tournamentStandings(tour_id)
+
+        results = await asyncio.gather(*[play(i) for i in tour_ids])
+        for (tour_id, standings) in zip(tour_ids, results):
+            if ([r[4] for r in standings] !=
+                    [4, 3, 3, 3, 3, 2, 2, 2, 2, 2, 2, 1, 1, 1, 1, 0]):
+                raise ValueError("Each tournament should be played "
+                                 "correctly when played concurrently.")
+    t_run(test())
+    print("3. Success: concurrent calls overlap.")
+
+
+def testRounds():
+    """Test starting rounds and reporting matches of stored pairings."""
+    async def test():
+        player_ids = await aio.createNewPlayers(
+            ["Player {0}".format(i) for i in range(5)])
+        tour_id = await aio.createNewTour("Jolly Roger")
+        await aio.registerPlayers(tour_id, *player_ids)
+        await aio.changeTourStatus(tour_id, 'ongoing')
+        pairings = await aio.startRound(tour_id)
+        if (pairings != tournaments.getPairings(tour_id) or
+                await aio.startRound(tour_id) != pairings or
+                await aio.getPairings(tour_id, 1) != pairings):
+            raise ValueError("Round should be paired once and stored.")
+        p = pairings[1]
+        if await aio.reportMatch(tour_id, p.player1_id, 1, p.player1_id, 0,
+                                 pairing_id=p.id) is not None:
+            raise ValueError("Match of other players than paired should be "
+                             "rejected.")
+        for p in pairings:
+            await aio.reportMatch(tour_id, p.player1_id, 1, p.player2_id, 0,
+                                  pairing_id=p.id)
+        pairings = await aio.startRound(tour_id)
+        if pairings[0].round != 2 or await aio.getPairings(0) is not None:
+            raise ValueError("Second round should be started.")
+        p = pairings[1]
+        res = [await aio.reportMatch(tour_id, p.player1_id, 1, p.player2_id,
+                                     0, idempotency_key='x')
+               for i in range(2)]
+        if [r.status for r in res] != ['recorded', 'duplicate']:
+            raise ValueError("Retried result should be recorded once.")
+        res = await aio.reportMatches(
+            tour_id, [(p.player1_id, 1, p.player2_id, 0, 'x'),
+                      (p.player1_id, 0, p.player2_id, 1, 'x'),
+                      (p.player2_id, 1, p.player1_id, 0, 'y')])
+        if [r.status for r in res] != ['duplicate', 'conflict', 'recorded']:
+            raise ValueError("Retried results should be recorded once.")
+        if await aio.startRound(tour_id) != pairings:
+            raise ValueError("Round should not end before all of its "
+                             "pairings are played.")
+        if (not await aio.abandonPairing(tour_id, pairings[0].id) or
+                await aio.reportMatch(tour_id, pairings[0].player1_id, 1,
+                                      pairings[0].player2_id, 0,
+                                      pairing_id=pairings[0].id)
+                is not None):
+            raise ValueError("Match of abandoned pairing should be "
+                             "rejected.")
+        p = pairings[2]
+        res = await aio.reportMatches(tour_id,
+                                      [(p.player2_id, 0, p.player1_id, 1)])
+        if (res[0].status != 'recorded' or
+                (await aio.startRound(tour_id))[0].round != 3):
+            raise ValueError("Round reported by reportMatches() should "
+                             "end.")
+        await aio.changeTourStatus(tour_id, 'closed')
+        if (not await aio.archiveTour(tour_id) or
+                await aio.archiveTour(tour_id) is not None or
+                await aio.changeTourStatus(tour_id, 'ongoing') is not None):
+            raise ValueError("Closed tournament should be archived once.")
+    t_run(test())
+    print("4. Success: rounds are paired once and their pairings stored, "
+          "retried results recorded once, closed tournament archived.")
+
+
+def testStartRoundsSmallPool():
+    """Test starting rounds of more tournaments at once than connections."""
+    async def test():
+        tour_ids = await aio.createNewTours(
+            ["Tour {0}".format(i) for i in range(4)])
+        for tour_id in tour_ids:
+            player_ids = await aio.createNewPlayers(
+                ["Player {0}/{1}".format(tour_id, i) for i in range(6)])
+            await aio.registerPlayers(tour_id, *player_ids)
+            await aio.changeTourStatus(tour_id, 'ongoing')
+        await aio.s_closePool()
+        tournaments.s_configurePool(maxconn=2)
+        try:
+            rounds = await asyncio.wait_for(
+                asyncio.gather(*[aio.startRound(i) for i in tour_ids]), 10)
+        finally:
+            await aio.s_closePool()
+            tournaments.s_configurePool(maxconn=10)
+        if [len(r) for r in rounds] != [3] * 4:
+            raise ValueError("Rounds should be started without waiting for "
+                             "a second connection.")
+    t_run(test())
+    print("5. Success: rounds are started with a small pool.")
+
+
+# TESTS
+
+if __name__ == '__main__':
+    testCreateAndCount()
+    testSameResults()
+    testConcurrency()
+    testRounds()
+    testStartRoundsSmallPool()
+    print("All tests passed successfully!")
@@ -0,0 +1,97 @@
+"""Size-bounded LRU cache with a TTL for results read from the database."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache(object):
+    """Results of reads kept in memory until the data they come from changes.
+
+    Each entry is stored together with a version stamp of the data it was
+    computed from (such as revision of a tournament) and is served only
+    while the stamp provided upon lookup is the same and the entry is not
+    older than ttl seconds. The least recently used entries are evicted when
+    the cache is full.
+
+    Keys are tuples whose second item identifies the tournament, so that all
+    entries of a tournament can be invalidated at once (see invalidate).
+
+    Attributes:
+        maxsize: Maximum number of entries.
+        ttl: Maximum age of an entry in seconds (None for no limit).
+        hits, misses, evictions, expirations, invalidations: Counts of
+            lookups served from the cache, lookups not served, entries
+            evicted to make room, stale entries dropped upon lookup and
+            entries dropped by invalidate.
+    """
+
+    def __init__(self, maxsize=256, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version):
+        """Return cached result for given key and version (None if missing).
+
+        Args:
+            key: Tuple (kind, tour_id, ...) identifying the result.
+            version: Current version stamp of the data of the result.
+        """
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                (value, stamp, created) = entry
+                expired = (self.ttl is not None and
+                           time.time() - created > self.ttl)
+                if stamp == version and not expired:
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, version, value):
+        """Store result for given key computed from data of given version."""
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, version, time.time())
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tour_id=None):
+        """Drop entries of given tournament (all entries if None)."""
+        with self.lock:
+            if tour_id is None:
+                keys = list(self._entries)
+            else:
+                keys = [k for k in self._entries if k[1] == tour_id]
+            for k in keys:
+                del self._entries[k]
+            self.invalidations += len(keys)
+
+    def stats(self):
+        """Return dictionary of counts of hits, misses etc. and the size."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
@@ -0,0 +1,311 @@
+"""Instrumentation of database access of the tournaments module.
+
+Every query executed through a connection of the pool (see
+tournaments.s_getPool) is timed by InstrumentedCursor and recorded in the
+registry under the public function which issued it (functions are marked by
+the instrumented decorator) and a fingerprint of its text (literals replaced
+by '?' and rows of a VALUES list collapsed into one, so that batches of any
+size share a fingerprint). Time spent waiting for a pooled connection is
+recorded the same way.
+
+Recording a query costs two timer calls, a dictionary lookup for the
+fingerprint and an update of a few counters under a lock, so the
+instrumentation can be left on; it can be switched off by setting ENABLED to
+False.
+"""
+
+import functools
+import re
+import threading
+from timeit import default_timer as timer
+
+import psycopg2.extensions
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+ENABLED = True
+# number of distinct query texts whose fingerprint is remembered
+FINGERPRINTS = 1024
+# only fingerprints of texts up to this length are remembered (longer ones,
+# e.g. batches with their data, are rarely executed again)
+FINGERPRINT_MAX_LENGTH = 1024
+# name under which queries outside of instrumented functions are recorded
+OTHER = 'other'
+
+# name of the (outermost) instrumented function running in each thread
+_local = threading.local()
+_fingerprints = {}
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_whitespace = re.compile(r"\s+")
+# rows following the first one of a VALUES list (e.g. of execute_values)
+_values = re.compile(r"(\bVALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+",
+                     re.IGNORECASE)
+
+
+class StatsRegistry(object):
+    """Counters of calls, queries and waits for connections by function."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Set all counters to zero."""
+        with self.lock:
+            # function: [calls, errors, seconds, acquires, acquire seconds]
+            self._functions = {}
+            # (function, fingerprint): [calls, rows, seconds]
+            self._queries = {}
+
+    def _function(self, function):
+        f = self._functions.get(function)
+        if f is None:
+            f = self._functions[function] = [0, 0, 0.0, 0, 0.0]
+        return f
+
+    def recordCall(self, function, seconds, failed=False):
+        """Record a finished call of a function."""
+        with self.lock:
+            f = self._function(function)
+            f[0] += 1
+            f[1] += failed
+            f[2] += seconds
+
+    def recordAcquire(self, function, seconds):
+        """Record time a function waited for a pooled connection."""
+        with self.lock:
+            f = self._function(function)
+            f[3] += 1
+            f[4] += seconds
+
+    def recordQuery(self, function, fingerprint, seconds, rows):
+        """Record a query executed by a function."""
+        with self.lock:
+            q = self._queries.get((function, fingerprint))
+            if q is None:
+                q = self._queries[(function, fingerprint)] = [0, 0, 0.0]
+            q[0] += 1
+            q[1] += rows
+            q[2] += seconds
+
+    def dump(self):
+        """Return a copy of all counters.
+
+        Returns:
+            A dictionary with keys:
+                functions: dictionary mapping name of each function to a
+                           dictionary of its calls, errors, seconds,
+                           acquires and acquire_seconds.
+                queries: dictionary mapping name of each function to a
+                         dictionary mapping fingerprint of each of its
+                         queries to a dictionary of its calls, rows and
+                         seconds.
+        """
+        with self.lock:
+            functions = dict(
+                (name, {'calls': f[0], 'errors': f[1], 'seconds': f[2],
+                        'acquires': f[3], 'acquire_seconds': f[4]})
+                for (name, f) in self._functions.items())
+            queries = {}
+            for ((name, fp), q) in self._queries.items():
+                queries.setdefault(name, {})[fp] = {
+                    'calls': q[0], 'rows': q[1], 'seconds': q[2]}
+        return {'functions': functions, 'queries': queries}
+
+
+registry = StatsRegistry()
+
+
+def currentFunction():
+    """Return name of instrumented function running in this thread."""
+    return getattr(_local, 'function', None) or OTHER
+
+
+def fingerprint(query):
+    """Return text of query with literals replaced and whitespace collapsed.
+
+    Queries differing only in literals formatted into their text (ids,
+    statuses) or in the number of rows of a VALUES list share one
+    fingerprint.
+    """
+    fp = _fingerprints.get(query)
+    if fp is None:
+        text = query
+        if isinstance(text, bytes) and not isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        text = _values.sub(r'\1', _literals.sub('?', text))
+        fp = _whitespace.sub(' ', text).strip()
+        if len(query) <= FINGERPRINT_MAX_LENGTH:
+            if len(_fingerprints) >= FINGERPRINTS:
+                _fingerprints.clear()
+            _fingerprints[query] = fp
+    return fp
+
+
+def instrumented(f):
+    """Decorator recording calls of a public function.
+
+    Queries are recorded under the outermost instrumented function of a
+    thread, so that queries of nested calls are counted as part of the
+    operation that caused them.
+    """
+    name = f.__name__
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return f(*args, **kwargs)
+        outermost = getattr(_local, 'function', None) is None
+        if outermost:
+            _local.function = name
+        start = timer()
+        failed = True
+        try:
+            res = f(*args, **kwargs)
+            failed = False
+            return res
+        finally:
+            registry.recordCall(name, timer() - start, failed)
+            if outermost:
+                _local.function = None
+    return wrapper
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor recording time and rows of each executed query."""
+
+    def execute(self, query, vars=None):
+        if not ENABLED:
+            return super(InstrumentedCursor, self).execute(query, vars)
+        start = timer()
+        try:
+            return super(InstrumentedCursor, self).execute(query, vars)
+        finally:
+            registry.recordQuery(currentFunction(), fingerprint(query),
+                                 timer() - start, max(self.rowcount, 0))
+
+    def executemany(self, query, vars_list):
+        if not ENABLED:
+            return super(InstrumentedCursor, self).executemany(query,
+                                                               vars_list)
+        start = timer()
+        try:
+            return super(InstrumentedCursor, self).executemany(query,
+                                                               vars_list)
+        finally:
+            registry.recordQuery(currentFunction(), fingerprint(query),
+                                 timer() - start, max(self.rowcount, 0))
+
+    def copy_expert(self, sql, file, size=8192):
+        if not ENABLED:
+            return super(InstrumentedCursor, self).copy_expert(sql, file,
+                                                               size)
+        start = timer()
+        try:
+            return super(InstrumentedCursor, self).copy_expert(sql, file,
+                                                               size)
+        finally:
+            registry.recordQuery(currentFunction(), fingerprint(sql),
+                                 timer() - start, max(self.rowcount, 0))
+
+
+# PROMETHEUS EXPORT
+
+
+def s_label(value):
+    """Escape value of a Prometheus label."""
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def prometheusText(stats, prefix='tournaments'):
+    """Format statistics in the Prometheus text exposition format.
+
+    Args:
+        stats: Statistics as returned by StatsRegistry.dump (optionally with
+               statistics of the result cache under key 'cache').
+        prefix: Prefix of names of the metrics.
+    Returns:
+        Text of the metrics as string.
+    """
+    lines = []
+
+    def metric(name, kind, help, samples):
+        name = '{0}_{1}'.format(prefix, name)
+        lines.append('# HELP {0} {1}'.format(name, help))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for (labels, value) in samples:
+            labels = ','.join('{0}="{1}"'.format(k, s_label(v))
+                              for (k, v) in labels)
+            value = repr(value) if isinstance(value, float) else str(value)
+            lines.append('{0}{{{1}}} {2}'.format(name, labels, value)
+                         if labels else '{0} {1}'.format(name, value))
+
+    functions = sorted(stats['functions'].items())
+    for (key, name, help) in (
+            ('calls', 'function_calls_total', 'Calls of function.'),
+            ('errors', 'function_errors_total',
+             'Calls of function ended by an exception.'),
+            ('seconds', 'function_seconds_total',
+             'Time spent in function.'),
+            ('acquires', 'connection_acquires_total',
+             'Connections taken from the pool.'),
+            ('acquire_seconds', 'connection_acquire_seconds_total',
+             'Time spent waiting for a pooled connection.')):
+        metric(name, 'counter', help,
+               [((('function', f),), s[key]) for (f, s) in functions])
+
+    queries = [(f, fp, q) for (f, qs) in sorted(stats['queries'].items())
+               for (fp, q) in sorted(qs.items())]
+    for (key, name, help) in (
+            ('calls', 'query_calls_total', 'Executions of query.'),
+            ('rows', 'query_rows_total', 'Rows returned or changed.'),
+            ('seconds', 'query_seconds_total', 'Time spent in query.')):
+        metric(name, 'counter', help,
+               [((('function', f), ('query', fp)), q[key])
+                for (f, fp, q) in queries])
+
+    cache = stats.get('cache')
+    if cache is not None:
+        for key in ('hits', 'misses', 'evictions', 'expirations',
+                    'invalidations'):
+            metric('cache_{0}_total'.format(key), 'counter',
+                   'Cache {0}.'.format(key), [((), cache[key])])
+        metric('cache_size', 'gauge', 'Entries in cache.',
+               [((), cache['size'])])
+
+    return '\n'.join(lines) + '\n'
+
+
+def startExporter(port, stats, host=''):
+    """Serve statistics to Prometheus over HTTP in a background thread.
+
+    Args:
+        port: Port to listen on.
+        stats: Function returning the statistics (see prometheusText).
+        host: Address to listen on (all addresses by default).
+    Returns:
+        The HTTP server (call its shutdown() to stop it).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheusText(stats()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,77 @@
+"""Queue-backed logging handler for messages of the tournaments module.
+
+Records are put on a queue by QueueHandler (which never blocks the calling
+thread on I/O) and written to the console by QueueListener running in a
+background thread. Both come from logging.handlers where available (Python
+3.2+), minimal equivalents are provided for Python 2.
+"""
+
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    class QueueHandler(logging.Handler):
+        """Handler putting records on a queue."""
+
+        def __init__(self, queue):
+            logging.Handler.__init__(self)
+            self.queue = queue
+
+        def prepare(self, record):
+            # format the message now, as arguments might change before the
+            # record is handled by the listener
+            self.format(record)
+            record.msg = record.message
+            record.args = None
+            record.exc_info = None
+            return record
+
+        def emit(self, record):
+            try:
+                self.queue.put_nowait(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        """Thread passing records from a queue to handlers."""
+
+        _sentinel = None
+
+        def __init__(self, queue, *handlers):
+            self.queue = queue
+            self.handlers = handlers
+            self._thread = None
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor)
+            self._thread.daemon = True
+            self._thread.start()
+
+        def handle(self, record):
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+        def _monitor(self):
+            while True:
+                record = self.queue.get()
+                if record is self._sentinel:
+                    break
+                self.handle(record)
+
+        def stop(self):
+            self.queue.put_nowait(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+
+def s_newQueue():
+    """Return an unbounded queue for QueueHandler and QueueListener."""
+    return queue.Queue(-1)
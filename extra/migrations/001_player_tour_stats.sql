@@ -0,0 +1,174 @@
+/* Migration: keep standings in table player_tour_stats maintained by triggers
+   instead of computing them in view v_tourStandings on every read. */
+
+BEGIN;
+
+-- statistics of each registered player within the tournament (kept current by triggers defined below)
+CREATE TABLE player_tour_stats (
+    tour_id int NOT NULL,
+    player_id int NOT NULL,
+    matches int NOT NULL DEFAULT 0,
+    wins int NOT NULL DEFAULT 0,
+    draws int NOT NULL DEFAULT 0,
+    byes int NOT NULL DEFAULT 0,
+    -- 3 points for a win (including a bye), 1 point for a draw
+    points int GENERATED ALWAYS AS (3 * wins + draws) STORED,
+    -- opponent match wins: sum of wins of all (distinct) opponents
+    omw int NOT NULL DEFAULT 0,
+    PRIMARY KEY (tour_id, player_id),
+    FOREIGN KEY (tour_id, player_id) REFERENCES registrations(tour_id, player_id) ON DELETE CASCADE
+);
+
+-- standings of a tournament are read in this order
+CREATE INDEX player_tour_stats_standings_idx ON player_tour_stats (tour_id, wins DESC, draws DESC, omw DESC);
+
+-- function recomputing statistics of all players of a given tournament from scratch (used when matches get deleted and to fill player_tour_stats of existing tournaments)
+CREATE OR REPLACE FUNCTION refresh_player_tour_stats(tour_id int)
+    RETURNS void
+    AS
+    $body$
+        WITH games AS (
+            -- each match once for each of its players (byes only once)
+            SELECT pl1_id AS player_id, pl2_id AS opponent_id, winner_id, pl1_id = pl2_id AS bye
+            FROM v_matches
+            WHERE tour_id = $1
+            UNION ALL
+            SELECT pl2_id, pl1_id, winner_id, false
+            FROM v_matches
+            WHERE tour_id = $1 AND pl1_id != pl2_id
+        ), totals AS (
+            SELECT player_id,
+                   count(*) AS matches,
+                   count(*) FILTER (WHERE winner_id = player_id) AS wins,
+                   count(*) FILTER (WHERE winner_id IS NULL) AS draws,
+                   count(*) FILTER (WHERE bye) AS byes
+            FROM games
+            GROUP BY player_id
+        ), omw AS (
+            -- sum of wins of distinct opponents (byes excluded)
+            SELECT o.player_id, sum(t.wins) AS omw
+            FROM (SELECT DISTINCT player_id, opponent_id FROM games WHERE NOT bye) AS o
+            JOIN totals AS t ON t.player_id = o.opponent_id
+            GROUP BY o.player_id
+        )
+        UPDATE player_tour_stats AS s
+        SET matches = coalesce(t.matches, 0),
+            wins = coalesce(t.wins, 0),
+            draws = coalesce(t.draws, 0),
+            byes = coalesce(t.byes, 0),
+            omw = coalesce(o.omw, 0)
+        FROM player_tour_stats AS x
+        LEFT JOIN totals AS t ON t.player_id = x.player_id
+        LEFT JOIN omw AS o ON o.player_id = x.player_id
+        WHERE x.tour_id = $1 AND s.tour_id = x.tour_id AND s.player_id = x.player_id;
+    $body$
+    language sql;
+
+-- newly registered players start with empty statistics
+CREATE OR REPLACE FUNCTION t_registrations_stats()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        INSERT INTO player_tour_stats (tour_id, player_id)
+        SELECT tour_id, player_id FROM new_rows;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER registrations_stats AFTER INSERT ON registrations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_registrations_stats();
+
+-- each recorded match updates statistics of its players and omw of the opponents of its winner (only matches recorded earlier, i.e. with lower id, are taken into account as rows inserted by one statement are processed one by one)
+CREATE OR REPLACE FUNCTION t_matchesRaw_stats()
+    RETURNS trigger
+    AS
+    $body$
+    DECLARE
+        winner int := CASE WHEN NEW.pl1_score > NEW.pl2_score THEN NEW.pl1_id
+                           WHEN NEW.pl1_score < NEW.pl2_score THEN NEW.pl2_id
+                           WHEN NEW.pl1_id = NEW.pl2_id THEN NEW.pl1_id -- bye case
+                      END;
+    BEGIN
+        -- players meeting for the first time add each other's wins to their omw
+        IF NEW.pl1_id != NEW.pl2_id AND NOT EXISTS (
+            SELECT 1
+            FROM matchesRaw
+            WHERE tour_id = NEW.tour_id AND id < NEW.id
+              AND ((pl1_id = NEW.pl1_id AND pl2_id = NEW.pl2_id) OR (pl1_id = NEW.pl2_id AND pl2_id = NEW.pl1_id))
+        ) THEN
+            UPDATE player_tour_stats AS s
+            SET omw = s.omw + o.wins
+            FROM player_tour_stats AS o
+            WHERE s.tour_id = NEW.tour_id AND o.tour_id = NEW.tour_id
+              AND ((s.player_id = NEW.pl1_id AND o.player_id = NEW.pl2_id) OR (s.player_id = NEW.pl2_id AND o.player_id = NEW.pl1_id));
+        END IF;
+
+        UPDATE player_tour_stats
+        SET matches = matches + 1,
+            wins = wins + (player_id IS NOT DISTINCT FROM winner)::int,
+            draws = draws + (winner IS NULL)::int,
+            byes = byes + (NEW.pl1_id = NEW.pl2_id)::int
+        WHERE tour_id = NEW.tour_id AND player_id IN (NEW.pl1_id, NEW.pl2_id);
+
+        -- a win adds to omw of every (distinct) opponent of the winner
+        IF winner IS NOT NULL THEN
+            UPDATE player_tour_stats
+            SET omw = omw + 1
+            WHERE tour_id = NEW.tour_id AND player_id IN (
+                SELECT CASE WHEN pl1_id = winner THEN pl2_id ELSE pl1_id END
+                FROM matchesRaw
+                WHERE tour_id = NEW.tour_id AND id <= NEW.id AND pl1_id != pl2_id
+                  AND (pl1_id = winner OR pl2_id = winner)
+            );
+        END IF;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER matchesRaw_stats AFTER INSERT ON matchesRaw
+    FOR EACH ROW EXECUTE PROCEDURE t_matchesRaw_stats();
+
+-- deleted matches (admins only) are not subtracted, statistics of the affected tournaments get recomputed instead
+CREATE OR REPLACE FUNCTION t_matchesRaw_refresh_stats()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        PERFORM refresh_player_tour_stats(t.tour_id)
+        FROM (SELECT DISTINCT tour_id FROM old_rows) AS t;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER matchesRaw_refresh_stats AFTER DELETE ON matchesRaw
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_matchesRaw_refresh_stats();
+
+-- fill statistics of existing registrations
+ALTER TABLE registrations DISABLE TRIGGER registrations_stats;
+INSERT INTO player_tour_stats (tour_id, player_id)
+SELECT tour_id, player_id FROM registrations;
+ALTER TABLE registrations ENABLE TRIGGER registrations_stats;
+SELECT refresh_player_tour_stats(id) FROM tournaments;
+
+DROP VIEW v_tourStandings;
+CREATE VIEW v_tourStandings AS
+    SELECT s.tour_id,
+           s.player_id,
+           -- name matched from players table
+           p.name,
+           s.matches,
+           s.wins,
+           s.draws,
+           s.byes,
+           s.omw
+    FROM player_tour_stats AS s
+    JOIN players AS p ON p.id = s.player_id
+    ORDER BY s.tour_id, s.wins DESC, s.draws DESC, s.omw DESC;
+
+COMMIT;
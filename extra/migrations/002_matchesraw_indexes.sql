@@ -0,0 +1,30 @@
+/* Migration: index matchesRaw for per-tournament and per-player lookups.
+
+   Indexes are built concurrently so that matches can still be reported while
+   the migration runs (which is why the script does not use a transaction). */
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matchesRaw_tour_pl1_idx ON matchesRaw (tour_id, pl1_id) INCLUDE (pl2_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matchesRaw_tour_pl2_idx ON matchesRaw (tour_id, pl2_id) INCLUDE (pl1_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matchesRaw_tour_winner_idx ON matchesRaw (
+    tour_id,
+    (CASE WHEN pl1_score > pl2_score THEN pl1_id
+          WHEN pl1_score < pl2_score THEN pl2_id
+          WHEN pl1_id = pl2_id THEN pl1_id
+     END)
+);
+
+-- function for creating a view of opponents of a given player in a given tournament
+CREATE OR REPLACE FUNCTION opponents(tour_id int, player_id int)
+    RETURNS table (opponenets int)
+    AS
+    $body$
+        SELECT CASE WHEN pl1_id = $2 THEN pl2_id
+                    WHEN pl2_id = $2 THEN pl1_id
+               END
+        FROM v_matches
+        WHERE tour_id = $1 AND pl1_id != pl2_id AND (pl1_id = $2 OR pl2_id = $2)
+    $body$
+    -- stable (read-only) so that the function can be inlined into the calling query and use indexes of matchesRaw
+    language sql STABLE;
+
+ANALYZE matchesRaw;
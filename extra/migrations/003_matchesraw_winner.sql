@@ -0,0 +1,111 @@
+/* Migration: store winner_id, is_draw and is_bye in matchesRaw (computed at
+   insert time) instead of computing the winner in v_matches on every read. */
+
+BEGIN;
+
+ALTER TABLE matchesRaw
+    ADD COLUMN winner_id int GENERATED ALWAYS AS (
+        CASE WHEN pl1_score > pl2_score THEN pl1_id
+             WHEN pl1_score < pl2_score THEN pl2_id
+             WHEN pl1_id = pl2_id THEN pl1_id -- bye case
+        END
+    ) STORED,
+    ADD COLUMN is_draw boolean GENERATED ALWAYS AS (pl1_score = pl2_score AND pl1_id != pl2_id) STORED,
+    ADD COLUMN is_bye boolean GENERATED ALWAYS AS (pl1_id = pl2_id) STORED;
+
+DROP INDEX IF EXISTS matchesRaw_tour_winner_idx;
+CREATE INDEX matchesRaw_tour_winner_idx ON matchesRaw (tour_id, winner_id);
+
+-- matches with their winner (kept for compatibility, winner_id is now stored in matchesRaw)
+CREATE OR REPLACE VIEW v_matches AS
+    SELECT id, tour_id, pl1_id, pl1_score, pl2_id, pl2_score, winner_id
+    FROM matchesRaw;
+
+-- function recomputing statistics of all players of a given tournament from scratch (used when matches get deleted and to fill player_tour_stats of existing tournaments)
+CREATE OR REPLACE FUNCTION refresh_player_tour_stats(tour_id int)
+    RETURNS void
+    AS
+    $body$
+        WITH games AS (
+            -- each match once for each of its players (byes only once)
+            SELECT pl1_id AS player_id, pl2_id AS opponent_id, winner_id, is_draw, is_bye
+            FROM matchesRaw
+            WHERE tour_id = $1
+            UNION ALL
+            SELECT pl2_id, pl1_id, winner_id, is_draw, is_bye
+            FROM matchesRaw
+            WHERE tour_id = $1 AND NOT is_bye
+        ), totals AS (
+            SELECT player_id,
+                   count(*) AS matches,
+                   count(*) FILTER (WHERE winner_id = player_id) AS wins,
+                   count(*) FILTER (WHERE is_draw) AS draws,
+                   count(*) FILTER (WHERE is_bye) AS byes
+            FROM games
+            GROUP BY player_id
+        ), omw AS (
+            -- sum of wins of distinct opponents (byes excluded)
+            SELECT o.player_id, sum(t.wins) AS omw
+            FROM (SELECT DISTINCT player_id, opponent_id FROM games WHERE NOT is_bye) AS o
+            JOIN totals AS t ON t.player_id = o.opponent_id
+            GROUP BY o.player_id
+        )
+        UPDATE player_tour_stats AS s
+        SET matches = coalesce(t.matches, 0),
+            wins = coalesce(t.wins, 0),
+            draws = coalesce(t.draws, 0),
+            byes = coalesce(t.byes, 0),
+            omw = coalesce(o.omw, 0)
+        FROM player_tour_stats AS x
+        LEFT JOIN totals AS t ON t.player_id = x.player_id
+        LEFT JOIN omw AS o ON o.player_id = x.player_id
+        WHERE x.tour_id = $1 AND s.tour_id = x.tour_id AND s.player_id = x.player_id;
+    $body$
+    language sql;
+
+-- each recorded match updates statistics of its players and omw of the opponents of its winner (only matches recorded earlier, i.e. with lower id, are taken into account as rows inserted by one statement are processed one by one)
+CREATE OR REPLACE FUNCTION t_matchesRaw_stats()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        -- players meeting for the first time add each other's wins to their omw
+        IF NOT NEW.is_bye AND NOT EXISTS (
+            SELECT 1
+            FROM matchesRaw
+            WHERE tour_id = NEW.tour_id AND id < NEW.id
+              AND ((pl1_id = NEW.pl1_id AND pl2_id = NEW.pl2_id) OR (pl1_id = NEW.pl2_id AND pl2_id = NEW.pl1_id))
+        ) THEN
+            UPDATE player_tour_stats AS s
+            SET omw = s.omw + o.wins
+            FROM player_tour_stats AS o
+            WHERE s.tour_id = NEW.tour_id AND o.tour_id = NEW.tour_id
+              AND ((s.player_id = NEW.pl1_id AND o.player_id = NEW.pl2_id) OR (s.player_id = NEW.pl2_id AND o.player_id = NEW.pl1_id));
+        END IF;
+
+        UPDATE player_tour_stats
+        SET matches = matches + 1,
+            wins = wins + (player_id IS NOT DISTINCT FROM NEW.winner_id)::int,
+            draws = draws + NEW.is_draw::int,
+            byes = byes + NEW.is_bye::int
+        WHERE tour_id = NEW.tour_id AND player_id IN (NEW.pl1_id, NEW.pl2_id);
+
+        -- a win adds to omw of every (distinct) opponent of the winner
+        IF NEW.winner_id IS NOT NULL THEN
+            UPDATE player_tour_stats
+            SET omw = omw + 1
+            WHERE tour_id = NEW.tour_id AND player_id IN (
+                SELECT CASE WHEN pl1_id = NEW.winner_id THEN pl2_id ELSE pl1_id END
+                FROM matchesRaw
+                WHERE tour_id = NEW.tour_id AND id <= NEW.id AND NOT is_bye
+                  AND (pl1_id = NEW.winner_id OR pl2_id = NEW.winner_id)
+            );
+        END IF;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+COMMIT;
+
+ANALYZE matchesRaw;
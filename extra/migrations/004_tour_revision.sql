@@ -0,0 +1,43 @@
+/* Migration: add tournaments.revision, bumped by triggers whenever
+   registrations or matches of a tournament change, so that cached standings
+   and pairings can be validated by a primary key lookup. */
+
+BEGIN;
+
+ALTER TABLE tournaments ADD COLUMN revision int NOT NULL DEFAULT 0;
+
+-- each statement changing registrations or matches bumps revision of the affected tournaments (once per statement)
+CREATE OR REPLACE FUNCTION t_bump_tour_revision()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            UPDATE tournaments SET revision = revision + 1
+            WHERE id IN (SELECT tour_id FROM old_rows);
+        ELSE
+            UPDATE tournaments SET revision = revision + 1
+            WHERE id IN (SELECT tour_id FROM new_rows);
+        END IF;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER registrations_revision_ins AFTER INSERT ON registrations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER registrations_revision_del AFTER DELETE ON registrations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER matchesRaw_revision_ins AFTER INSERT ON matchesRaw
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER matchesRaw_revision_del AFTER DELETE ON matchesRaw
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+COMMIT;
@@ -0,0 +1,14 @@
+/* Migration: let bulk loads (see transfer.py) skip incremental maintenance of
+   player_tour_stats; they set tournaments.bulk_load to 'on' for their
+   transaction and recompute statistics of the loaded tournaments afterwards. */
+
+BEGIN;
+
+DROP TRIGGER matchesRaw_stats ON matchesRaw;
+
+CREATE TRIGGER matchesRaw_stats AFTER INSERT ON matchesRaw
+    FOR EACH ROW
+    WHEN (current_setting('tournaments.bulk_load', true) IS DISTINCT FROM 'on')
+    EXECUTE PROCEDURE t_matchesRaw_stats();
+
+COMMIT;
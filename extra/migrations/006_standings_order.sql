@@ -0,0 +1,23 @@
+/* Migration: make the order of standings total (ties broken by player_id),
+   so that standings can be paged by keyset (see standingsPage). */
+
+BEGIN;
+
+DROP INDEX player_tour_stats_standings_idx;
+CREATE INDEX player_tour_stats_standings_idx ON player_tour_stats (tour_id, wins DESC, draws DESC, omw DESC, player_id DESC);
+
+CREATE OR REPLACE VIEW v_tourStandings AS
+    SELECT s.tour_id,
+           s.player_id,
+           -- name matched from players table
+           p.name,
+           s.matches,
+           s.wins,
+           s.draws,
+           s.byes,
+           s.omw
+    FROM player_tour_stats AS s
+    JOIN players AS p ON p.id = s.player_id
+    ORDER BY s.tour_id, s.wins DESC, s.draws DESC, s.omw DESC, s.player_id DESC;
+
+COMMIT;
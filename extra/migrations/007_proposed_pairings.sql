@@ -0,0 +1,19 @@
+/* Migration: add table of pairings of the next round proposed for all
+   ongoing tournaments at once (see pairAllOngoing). */
+
+BEGIN;
+
+CREATE TABLE proposed_pairings (
+    tour_id int NOT NULL,
+    -- order of pairings as returned by swissPairings (a bye, if any, first)
+    position int NOT NULL,
+    revision int NOT NULL,
+    -- equal ids for a bye
+    pl1_id int NOT NULL,
+    pl2_id int NOT NULL,
+    PRIMARY KEY (tour_id, position),
+    FOREIGN KEY (tour_id, pl1_id) REFERENCES registrations(tour_id, player_id) ON DELETE CASCADE,
+    FOREIGN KEY (tour_id, pl2_id) REFERENCES registrations(tour_id, player_id) ON DELETE CASCADE
+);
+
+COMMIT;
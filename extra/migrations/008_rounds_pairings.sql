@@ -0,0 +1,34 @@
+/* Migration: add persisted rounds and their pairings (see startRound and
+   getPairings) and let matches reference the pairing they were played
+   for. */
+
+BEGIN;
+
+CREATE TABLE rounds (
+    tour_id int NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
+    round int NOT NULL,
+    -- revision of the tournament the pairings of the round were computed from
+    revision int NOT NULL,
+    started timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (tour_id, round)
+);
+
+CREATE TABLE pairings (
+    id serial PRIMARY KEY,
+    tour_id int NOT NULL,
+    round int NOT NULL,
+    position int NOT NULL,
+    -- equal ids for a bye
+    pl1_id int NOT NULL,
+    pl2_id int NOT NULL,
+    -- pairings of a round are read by this key
+    UNIQUE (tour_id, round, position),
+    FOREIGN KEY (tour_id, round) REFERENCES rounds (tour_id, round) ON DELETE CASCADE,
+    FOREIGN KEY (tour_id, pl1_id) REFERENCES registrations (tour_id, player_id) ON DELETE CASCADE,
+    FOREIGN KEY (tour_id, pl2_id) REFERENCES registrations (tour_id, player_id) ON DELETE CASCADE
+);
+
+ALTER TABLE matchesRaw ADD COLUMN pairing_id int REFERENCES pairings (id) ON DELETE CASCADE;
+CREATE INDEX matchesRaw_pairing_idx ON matchesRaw (pairing_id) WHERE pairing_id IS NOT NULL;
+
+COMMIT;
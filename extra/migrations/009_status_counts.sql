@@ -0,0 +1,99 @@
+/* Migration: keep number of tournaments and players by status in counter
+   rows maintained by statement-level triggers, so that countTours and
+   countPlayers no longer aggregate whole tables. */
+
+BEGIN;
+
+-- no changes of statuses while the counters are filled
+LOCK TABLE tournaments, players IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE status_counts (
+    table_name text NOT NULL,
+    status text NOT NULL,
+    count bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, status)
+);
+
+INSERT INTO status_counts (table_name, status, count)
+    SELECT 'tournaments', e.status::text, count(t.id)
+    FROM unnest(enum_range(NULL::tourStatus)) AS e (status)
+    LEFT JOIN tournaments AS t ON t.status = e.status
+    GROUP BY e.status
+    UNION ALL
+    SELECT 'players', e.status::text, count(p.id)
+    FROM unnest(enum_range(NULL::playerStatus)) AS e (status)
+    LEFT JOIN players AS p ON p.status = e.status
+    GROUP BY e.status;
+
+-- status is text now (the views are read by status::text only)
+DROP VIEW v_toursCountByStatus;
+DROP VIEW v_playersCountByStatus;
+
+CREATE VIEW v_toursCountByStatus AS
+    SELECT status, count
+    FROM status_counts
+    WHERE table_name = 'tournaments';
+
+CREATE VIEW v_playersCountByStatus AS
+    SELECT status, count
+    FROM status_counts
+    WHERE table_name = 'players';
+
+CREATE FUNCTION t_status_counts() RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO status_counts AS s (table_name, status, count)
+            SELECT TG_TABLE_NAME, status::text, count(*)
+            FROM new_rows
+            GROUP BY status ORDER BY status
+            ON CONFLICT (table_name, status)
+            DO UPDATE SET count = s.count + EXCLUDED.count;
+        ELSIF TG_OP = 'DELETE' THEN
+            INSERT INTO status_counts AS s (table_name, status, count)
+            SELECT TG_TABLE_NAME, status::text, -count(*)
+            FROM old_rows
+            GROUP BY status ORDER BY status
+            ON CONFLICT (table_name, status)
+            DO UPDATE SET count = s.count + EXCLUDED.count;
+        ELSE
+            INSERT INTO status_counts AS s (table_name, status, count)
+            SELECT TG_TABLE_NAME, status::text, sum(delta)
+            FROM (SELECT status, 1 AS delta FROM new_rows
+                  UNION ALL
+                  SELECT status, -1 FROM old_rows) AS d
+            GROUP BY status HAVING sum(delta) <> 0 ORDER BY status
+            ON CONFLICT (table_name, status)
+            DO UPDATE SET count = s.count + EXCLUDED.count;
+        END IF;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER tournaments_status_counts_ins AFTER INSERT ON tournaments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER tournaments_status_counts_upd AFTER UPDATE ON tournaments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER tournaments_status_counts_del AFTER DELETE ON tournaments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER players_status_counts_ins AFTER INSERT ON players
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER players_status_counts_upd AFTER UPDATE ON players
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER players_status_counts_del AFTER DELETE ON players
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+COMMIT;
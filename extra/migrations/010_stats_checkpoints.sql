@@ -0,0 +1,172 @@
+/* Migration: checkpoints of player_tour_stats (snapshot of the statistics
+   of a tournament as of its last match) from which the statistics are
+   rebuilt by replaying only the later matches (see checkpointStandings,
+   rebuildStandings and auditStandings). The body of the trigger applying a
+   match moves to apply_match_stats, which is used for the replay too. */
+
+BEGIN;
+
+-- checkpoint of statistics of a tournament: snapshot of its player_tour_stats as of its match last_match_id (all matches with lower or equal ids applied, none with higher ids); statistics are rebuilt from the snapshot by replaying only the later matches
+CREATE TABLE stats_checkpoints (
+    tour_id int PRIMARY KEY REFERENCES tournaments (id) ON DELETE CASCADE,
+    last_match_id int NOT NULL,
+    taken timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE player_tour_stats_snapshots (
+    tour_id int NOT NULL REFERENCES stats_checkpoints (tour_id) ON DELETE CASCADE,
+    player_id int NOT NULL,
+    matches int NOT NULL,
+    wins int NOT NULL,
+    draws int NOT NULL,
+    byes int NOT NULL,
+    omw int NOT NULL,
+    PRIMARY KEY (tour_id, player_id)
+);
+
+-- function replacing the checkpoint of a given tournament by its current statistics, returns id of the last match applied to them; no matches can be recorded meanwhile (the share lock waits for all transactions recording matches, so no match with a lower id can be committed later)
+CREATE OR REPLACE FUNCTION checkpoint_player_tour_stats(tour_id int)
+    RETURNS int
+    AS
+    $body$
+    DECLARE
+        last_id int;
+    BEGIN
+        LOCK TABLE matchesRaw IN SHARE MODE;
+        SELECT coalesce(max(id), 0) INTO last_id
+        FROM matchesRaw
+        WHERE matchesRaw.tour_id = $1;
+
+        DELETE FROM stats_checkpoints AS k WHERE k.tour_id = $1;
+        INSERT INTO stats_checkpoints (tour_id, last_match_id)
+        VALUES ($1, last_id);
+        INSERT INTO player_tour_stats_snapshots
+        SELECT s.tour_id, s.player_id, s.matches, s.wins, s.draws, s.byes, s.omw
+        FROM player_tour_stats AS s
+        WHERE s.tour_id = $1;
+        RETURN last_id;
+    END;
+    $body$
+    language plpgsql;
+
+-- function rebuilding statistics of a given tournament from its checkpoint (or from scratch if there is none) and replaying the matches recorded after it, returns number of matches replayed
+CREATE OR REPLACE FUNCTION rebuild_player_tour_stats(tour_id int)
+    RETURNS int
+    AS
+    $body$
+    DECLARE
+        last_id int;
+        m matchesRaw;
+        replayed int := 0;
+    BEGIN
+        LOCK TABLE matchesRaw IN SHARE MODE;
+        SELECT k.last_match_id INTO last_id
+        FROM stats_checkpoints AS k
+        WHERE k.tour_id = $1;
+
+        IF last_id IS NULL THEN
+            PERFORM refresh_player_tour_stats($1);
+            SELECT count(*) INTO replayed
+            FROM matchesRaw
+            WHERE matchesRaw.tour_id = $1;
+        ELSE
+            -- players registered after the checkpoint start with empty statistics
+            UPDATE player_tour_stats AS s
+            SET matches = coalesce(x.matches, 0),
+                wins = coalesce(x.wins, 0),
+                draws = coalesce(x.draws, 0),
+                byes = coalesce(x.byes, 0),
+                omw = coalesce(x.omw, 0)
+            FROM player_tour_stats AS p
+            LEFT JOIN player_tour_stats_snapshots AS x
+                ON x.tour_id = p.tour_id AND x.player_id = p.player_id
+            WHERE p.tour_id = $1 AND s.tour_id = p.tour_id AND s.player_id = p.player_id;
+
+            FOR m IN
+                SELECT * FROM matchesRaw
+                WHERE matchesRaw.tour_id = $1 AND id > last_id
+                ORDER BY id
+            LOOP
+                PERFORM apply_match_stats(m);
+                replayed := replayed + 1;
+            END LOOP;
+        END IF;
+
+        -- cached standings and proposed pairings are no longer valid
+        UPDATE tournaments SET revision = revision + 1 WHERE id = $1;
+        RETURN replayed;
+    END;
+    $body$
+    language plpgsql;
+
+-- applies a recorded match to statistics of its players and omw of the opponents of its winner (only matches recorded earlier, i.e. with lower id, are taken into account, so matches are applied in order of their ids; used by the trigger below and to replay matches after a checkpoint)
+CREATE OR REPLACE FUNCTION apply_match_stats(m matchesRaw)
+    RETURNS void
+    AS
+    $body$
+    BEGIN
+        -- players meeting for the first time add each other's wins to their omw
+        IF NOT m.is_bye AND NOT EXISTS (
+            SELECT 1
+            FROM matchesRaw
+            WHERE tour_id = m.tour_id AND id < m.id
+              AND ((pl1_id = m.pl1_id AND pl2_id = m.pl2_id) OR (pl1_id = m.pl2_id AND pl2_id = m.pl1_id))
+        ) THEN
+            UPDATE player_tour_stats AS s
+            SET omw = s.omw + o.wins
+            FROM player_tour_stats AS o
+            WHERE s.tour_id = m.tour_id AND o.tour_id = m.tour_id
+              AND ((s.player_id = m.pl1_id AND o.player_id = m.pl2_id) OR (s.player_id = m.pl2_id AND o.player_id = m.pl1_id));
+        END IF;
+
+        UPDATE player_tour_stats
+        SET matches = matches + 1,
+            wins = wins + (player_id IS NOT DISTINCT FROM m.winner_id)::int,
+            draws = draws + m.is_draw::int,
+            byes = byes + m.is_bye::int
+        WHERE tour_id = m.tour_id AND player_id IN (m.pl1_id, m.pl2_id);
+
+        -- a win adds to omw of every (distinct) opponent of the winner
+        IF m.winner_id IS NOT NULL THEN
+            UPDATE player_tour_stats
+            SET omw = omw + 1
+            WHERE tour_id = m.tour_id AND player_id IN (
+                SELECT CASE WHEN pl1_id = m.winner_id THEN pl2_id ELSE pl1_id END
+                FROM matchesRaw
+                WHERE tour_id = m.tour_id AND id <= m.id AND NOT is_bye
+                  AND (pl1_id = m.winner_id OR pl2_id = m.winner_id)
+            );
+        END IF;
+    END;
+    $body$
+    language plpgsql;
+
+-- each recorded match updates the statistics (rows inserted by one statement are processed one by one)
+CREATE OR REPLACE FUNCTION t_matchesRaw_stats()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        PERFORM apply_match_stats(NEW);
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+-- deleted matches (admins only) are not subtracted, statistics of the affected tournaments get recomputed instead
+CREATE OR REPLACE FUNCTION t_matchesRaw_refresh_stats()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        PERFORM refresh_player_tour_stats(t.tour_id)
+        FROM (SELECT DISTINCT tour_id FROM old_rows) AS t;
+        -- checkpoints no longer match the remaining matches
+        DELETE FROM stats_checkpoints
+        WHERE tour_id IN (SELECT tour_id FROM old_rows);
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+COMMIT;
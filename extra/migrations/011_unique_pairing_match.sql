@@ -0,0 +1,14 @@
+/* Migration: record at most one match of each pairing (results submitted
+   again for the same pairing are not recorded, see reportMatch). Fails if
+   some pairing already has more than one match; keep one of them, e.g.:
+
+   DELETE FROM matchesRaw AS m
+   USING matchesRaw AS f
+   WHERE f.pairing_id = m.pairing_id AND f.id < m.id; */
+
+BEGIN;
+
+DROP INDEX matchesRaw_pairing_idx;
+CREATE UNIQUE INDEX matchesRaw_pairing_idx ON matchesRaw (pairing_id) WHERE pairing_id IS NOT NULL;
+
+COMMIT;
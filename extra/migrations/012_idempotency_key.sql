@@ -0,0 +1,9 @@
+/* Migration: let clients report matches with an idempotency key, so that
+   retried reports are recorded once (see reportMatch and reportMatches). */
+
+BEGIN;
+
+ALTER TABLE matchesRaw ADD COLUMN idempotency_key text;
+CREATE UNIQUE INDEX matchesRaw_idempotency_key_idx ON matchesRaw (tour_id, idempotency_key) WHERE idempotency_key IS NOT NULL;
+
+COMMIT;
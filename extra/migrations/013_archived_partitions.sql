@@ -0,0 +1,249 @@
+/* Migration: partition registrations and matchesRaw by the archived flag of
+   their tournament (see archiveTour), so that queries of live tournaments
+   read only the live partitions. Both tables are recreated as partitioned
+   tables (keeping ids and their sequences) and their rows copied; the tables
+   referencing registrations get the flag and foreign keys following it.
+   Requires PostgreSQL 15+ (foreign keys following rows moved between
+   partitions). */
+
+BEGIN;
+
+ALTER TABLE tournaments ADD COLUMN archived boolean NOT NULL DEFAULT false CHECK (NOT archived OR status = 'closed');
+
+ALTER TABLE pairings
+    DROP CONSTRAINT pairings_tour_id_pl1_id_fkey,
+    DROP CONSTRAINT pairings_tour_id_pl2_id_fkey;
+ALTER TABLE player_tour_stats
+    DROP CONSTRAINT player_tour_stats_tour_id_player_id_fkey;
+ALTER TABLE proposed_pairings
+    DROP CONSTRAINT proposed_pairings_tour_id_pl1_id_fkey,
+    DROP CONSTRAINT proposed_pairings_tour_id_pl2_id_fkey;
+
+-- depend on the row type of matchesRaw (recreated below)
+DROP VIEW v_matches;
+DROP FUNCTION apply_match_stats(matchesRaw);
+
+-- the old tables give up the names of their constraints to the new ones
+ALTER TABLE registrations RENAME TO registrations_old;
+ALTER TABLE registrations_old
+    DROP CONSTRAINT registrations_pkey,
+    DROP CONSTRAINT registrations_tour_id_fkey,
+    DROP CONSTRAINT registrations_player_id_fkey;
+ALTER TABLE matchesRaw RENAME TO matchesRaw_old;
+ALTER TABLE matchesRaw_old
+    DROP CONSTRAINT matchesraw_pkey,
+    DROP CONSTRAINT matchesraw_pairing_id_fkey;
+ALTER SEQUENCE registrations_id_seq OWNED BY NONE;
+ALTER SEQUENCE matchesRaw_id_seq OWNED BY NONE;
+
+-- Registrations and matches are partitioned by the archived flag of their
+-- tournament, so that queries of live tournaments (with NOT archived) read
+-- only the live partitions. Other tables referencing registrations carry the
+-- flag too and follow it by ON UPDATE CASCADE when a tournament gets
+-- archived.
+CREATE TABLE registrations (
+    id int NOT NULL DEFAULT nextval('registrations_id_seq'),
+    -- ON DELETE CASCADE is set to simplify testing since deleting is
+    -- restricted to admins (for testing only)
+    tour_id int NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
+    player_id int NOT NULL REFERENCES players (id) ON DELETE CASCADE,
+    archived boolean NOT NULL DEFAULT false,
+    -- each player can be registered only once for given tournament
+    PRIMARY KEY (tour_id, player_id, archived)
+) PARTITION BY LIST (archived);
+
+CREATE TABLE registrations_live PARTITION OF registrations FOR VALUES IN (false);
+CREATE TABLE registrations_archived PARTITION OF registrations FOR VALUES IN (true);
+
+CREATE TABLE matchesRaw (
+    id int NOT NULL DEFAULT nextval('matchesraw_id_seq'),
+    tour_id int NOT NULL,
+    pl1_id int NOT NULL,
+    pl1_score int NOT NULL,
+    pl2_id int NOT NULL,
+    pl2_score int NOT NULL,
+    -- winner: id of player with higher score or id of player with assigned bye or empty (null) in case of a draw
+    winner_id int GENERATED ALWAYS AS (
+        CASE WHEN pl1_score > pl2_score THEN pl1_id
+             WHEN pl1_score < pl2_score THEN pl2_id
+             WHEN pl1_id = pl2_id THEN pl1_id -- bye case
+        END
+    ) STORED,
+    is_draw boolean GENERATED ALWAYS AS (pl1_score = pl2_score AND pl1_id != pl2_id) STORED,
+    is_bye boolean GENERATED ALWAYS AS (pl1_id = pl2_id) STORED,
+    -- pairing the match was played for (if reported with one)
+    pairing_id int REFERENCES pairings (id) ON DELETE CASCADE,
+    -- key chosen by the client reporting the match (if any), unique within the tournament so that retried reports are recorded once
+    idempotency_key text,
+    archived boolean NOT NULL DEFAULT false,
+    PRIMARY KEY (id, archived)
+) PARTITION BY LIST (archived);
+
+-- Players of matches are checked against the registrations partition of the
+-- same flag: a check against the partitioned table costs several times more,
+-- which counts for the table written most. Matches are therefore moved by
+-- archiveTour before the registrations they reference (checked at commit).
+-- ON DELETE CASCADE is set to simplify testing since deleting is restricted
+-- to admins (for testing only)
+CREATE TABLE matchesRaw_live PARTITION OF matchesRaw (
+    FOREIGN KEY (tour_id, pl1_id, archived) REFERENCES registrations_live (tour_id, player_id, archived) ON DELETE CASCADE,
+    FOREIGN KEY (tour_id, pl2_id, archived) REFERENCES registrations_live (tour_id, player_id, archived) ON DELETE CASCADE
+) FOR VALUES IN (false);
+CREATE TABLE matchesRaw_archived PARTITION OF matchesRaw (
+    FOREIGN KEY (tour_id, pl1_id, archived) REFERENCES registrations_archived (tour_id, player_id, archived) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    FOREIGN KEY (tour_id, pl2_id, archived) REFERENCES registrations_archived (tour_id, player_id, archived) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED
+) FOR VALUES IN (true);
+
+-- all tournaments are live so far; triggers of the old tables are dropped
+-- with them (statistics and revisions stay as they are)
+INSERT INTO registrations (id, tour_id, player_id)
+    SELECT id, tour_id, player_id FROM registrations_old;
+INSERT INTO matchesRaw (id, tour_id, pl1_id, pl1_score, pl2_id, pl2_score, pairing_id, idempotency_key)
+    SELECT id, tour_id, pl1_id, pl1_score, pl2_id, pl2_score, pairing_id, idempotency_key FROM matchesRaw_old;
+DROP TABLE matchesRaw_old;
+DROP TABLE registrations_old;
+ALTER SEQUENCE registrations_id_seq OWNED BY registrations.id;
+ALTER SEQUENCE matchesRaw_id_seq OWNED BY matchesRaw.id;
+
+-- matches of a player within a tournament (as the first or the second player); also support the foreign keys
+CREATE INDEX matchesRaw_tour_pl1_idx ON matchesRaw (tour_id, pl1_id) INCLUDE (pl2_id, id);
+CREATE INDEX matchesRaw_tour_pl2_idx ON matchesRaw (tour_id, pl2_id) INCLUDE (pl1_id, id);
+-- wins of a player within a tournament
+CREATE INDEX matchesRaw_tour_winner_idx ON matchesRaw (tour_id, winner_id);
+-- the match of a pairing (at most one, so that a result submitted again is not recorded twice; also supports the foreign key)
+CREATE UNIQUE INDEX matchesRaw_pairing_idx ON matchesRaw (pairing_id, archived) WHERE pairing_id IS NOT NULL;
+-- the match reported with an idempotency key
+CREATE UNIQUE INDEX matchesRaw_idempotency_key_idx ON matchesRaw (tour_id, idempotency_key, archived) WHERE idempotency_key IS NOT NULL;
+
+ALTER TABLE pairings
+    ADD COLUMN archived boolean NOT NULL DEFAULT false,
+    ADD FOREIGN KEY (tour_id, pl1_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE,
+    ADD FOREIGN KEY (tour_id, pl2_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE;
+ALTER TABLE player_tour_stats
+    ADD COLUMN archived boolean NOT NULL DEFAULT false,
+    ADD FOREIGN KEY (tour_id, player_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE;
+ALTER TABLE proposed_pairings
+    ADD COLUMN archived boolean NOT NULL DEFAULT false,
+    ADD FOREIGN KEY (tour_id, pl1_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE,
+    ADD FOREIGN KEY (tour_id, pl2_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE;
+
+-- matches with their winner (kept for compatibility, winner_id is now stored in matchesRaw)
+CREATE VIEW v_matches AS
+    SELECT id, tour_id, pl1_id, pl1_score, pl2_id, pl2_score, winner_id
+    FROM matchesRaw;
+
+-- function recomputing statistics of all players of a given tournament from scratch (used when matches get deleted and to fill player_tour_stats of existing tournaments)
+CREATE OR REPLACE FUNCTION refresh_player_tour_stats(tour_id int)
+    RETURNS void
+    AS
+    $body$
+        WITH games AS (
+            -- each match once for each of its players (byes only once)
+            SELECT pl1_id AS player_id, pl2_id AS opponent_id, winner_id, is_draw, is_bye
+            FROM matchesRaw
+            WHERE tour_id = $1 AND archived = (SELECT archived FROM tournaments WHERE id = $1)
+            UNION ALL
+            SELECT pl2_id, pl1_id, winner_id, is_draw, is_bye
+            FROM matchesRaw
+            WHERE tour_id = $1 AND archived = (SELECT archived FROM tournaments WHERE id = $1) AND NOT is_bye
+        ), totals AS (
+            SELECT player_id,
+                   count(*) AS matches,
+                   count(*) FILTER (WHERE winner_id = player_id) AS wins,
+                   count(*) FILTER (WHERE is_draw) AS draws,
+                   count(*) FILTER (WHERE is_bye) AS byes
+            FROM games
+            GROUP BY player_id
+        ), omw AS (
+            -- sum of wins of distinct opponents (byes excluded)
+            SELECT o.player_id, sum(t.wins) AS omw
+            FROM (SELECT DISTINCT player_id, opponent_id FROM games WHERE NOT is_bye) AS o
+            JOIN totals AS t ON t.player_id = o.opponent_id
+            GROUP BY o.player_id
+        )
+        UPDATE player_tour_stats AS s
+        SET matches = coalesce(t.matches, 0),
+            wins = coalesce(t.wins, 0),
+            draws = coalesce(t.draws, 0),
+            byes = coalesce(t.byes, 0),
+            omw = coalesce(o.omw, 0)
+        FROM player_tour_stats AS x
+        LEFT JOIN totals AS t ON t.player_id = x.player_id
+        LEFT JOIN omw AS o ON o.player_id = x.player_id
+        WHERE x.tour_id = $1 AND s.tour_id = x.tour_id AND s.player_id = x.player_id;
+    $body$
+    language sql;
+
+-- applies a recorded match to statistics of its players and omw of the opponents of its winner (only matches recorded earlier, i.e. with lower id, are taken into account, so matches are applied in order of their ids; used by the trigger below and to replay matches after a checkpoint)
+CREATE OR REPLACE FUNCTION apply_match_stats(m matchesRaw)
+    RETURNS void
+    AS
+    $body$
+    BEGIN
+        -- players meeting for the first time add each other's wins to their omw
+        IF NOT m.is_bye AND NOT EXISTS (
+            SELECT 1
+            FROM matchesRaw
+            WHERE tour_id = m.tour_id AND archived = m.archived AND id < m.id
+              AND ((pl1_id = m.pl1_id AND pl2_id = m.pl2_id) OR (pl1_id = m.pl2_id AND pl2_id = m.pl1_id))
+        ) THEN
+            UPDATE player_tour_stats AS s
+            SET omw = s.omw + o.wins
+            FROM player_tour_stats AS o
+            WHERE s.tour_id = m.tour_id AND o.tour_id = m.tour_id
+              AND ((s.player_id = m.pl1_id AND o.player_id = m.pl2_id) OR (s.player_id = m.pl2_id AND o.player_id = m.pl1_id));
+        END IF;
+
+        UPDATE player_tour_stats
+        SET matches = matches + 1,
+            wins = wins + (player_id IS NOT DISTINCT FROM m.winner_id)::int,
+            draws = draws + m.is_draw::int,
+            byes = byes + m.is_bye::int
+        WHERE tour_id = m.tour_id AND player_id IN (m.pl1_id, m.pl2_id);
+
+        -- a win adds to omw of every (distinct) opponent of the winner
+        IF m.winner_id IS NOT NULL THEN
+            UPDATE player_tour_stats
+            SET omw = omw + 1
+            WHERE tour_id = m.tour_id AND player_id IN (
+                SELECT CASE WHEN pl1_id = m.winner_id THEN pl2_id ELSE pl1_id END
+                FROM matchesRaw
+                WHERE tour_id = m.tour_id AND archived = m.archived AND id <= m.id AND NOT is_bye
+                  AND (pl1_id = m.winner_id OR pl2_id = m.winner_id)
+            );
+        END IF;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER registrations_stats AFTER INSERT ON registrations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_registrations_stats();
+
+-- skipped by bulk loads (see transfer.py), which set tournaments.bulk_load to 'on' for their transaction and recompute statistics of the loaded tournaments at once afterwards, and for matches moved to the archived partition (see archiveTour; moving rows between partitions inserts them)
+CREATE TRIGGER matchesRaw_stats AFTER INSERT ON matchesRaw
+    FOR EACH ROW
+    WHEN (NOT NEW.archived AND current_setting('tournaments.bulk_load', true) IS DISTINCT FROM 'on')
+    EXECUTE PROCEDURE t_matchesRaw_stats();
+
+CREATE TRIGGER matchesRaw_refresh_stats AFTER DELETE ON matchesRaw
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_matchesRaw_refresh_stats();
+
+CREATE TRIGGER registrations_revision_ins AFTER INSERT ON registrations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER registrations_revision_del AFTER DELETE ON registrations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER matchesRaw_revision_ins AFTER INSERT ON matchesRaw
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER matchesRaw_revision_del AFTER DELETE ON matchesRaw
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+COMMIT;
@@ -0,0 +1,11 @@
+/* Migration: pairings can be abandoned (see abandonPairing), so that the
+   next round can be started although a game of the current one will not be
+   played (startRound starts it once each pairing has its match recorded or
+   is abandoned). */
+
+BEGIN;
+
+-- set by abandonPairing for a game which will not be played; the next round is started once each pairing of the current one has its match recorded or is abandoned
+ALTER TABLE pairings ADD COLUMN abandoned boolean NOT NULL DEFAULT false;
+
+COMMIT;
@@ -0,0 +1,83 @@
+/* Migration: checkpoints and rebuilds of statistics lock only the row of
+   their tournament instead of the whole matchesRaw table, so that matches of
+   other tournaments are recorded meanwhile (see checkpointStandings and
+   rebuildStandings). */
+
+BEGIN;
+
+-- function replacing the checkpoint of a given tournament by its current statistics, returns id of the last match applied to them; no matches of the tournament can be recorded meanwhile (its row is locked by each transaction recording its matches before it inserts them, so the lock waits for all of them and no match with a lower id can be committed later; matches of other tournaments are recorded as usual)
+CREATE OR REPLACE FUNCTION checkpoint_player_tour_stats(tour_id int)
+    RETURNS int
+    AS
+    $body$
+    DECLARE
+        last_id int;
+    BEGIN
+        PERFORM 1 FROM tournaments AS t WHERE t.id = $1 FOR UPDATE;
+        SELECT coalesce(max(id), 0) INTO last_id
+        FROM matchesRaw
+        WHERE matchesRaw.tour_id = $1;
+
+        DELETE FROM stats_checkpoints AS k WHERE k.tour_id = $1;
+        INSERT INTO stats_checkpoints (tour_id, last_match_id)
+        VALUES ($1, last_id);
+        INSERT INTO player_tour_stats_snapshots
+        SELECT s.tour_id, s.player_id, s.matches, s.wins, s.draws, s.byes, s.omw
+        FROM player_tour_stats AS s
+        WHERE s.tour_id = $1;
+        RETURN last_id;
+    END;
+    $body$
+    language plpgsql;
+
+-- function rebuilding statistics of a given tournament from its checkpoint (or from scratch if there is none) and replaying the matches recorded after it, returns number of matches replayed (locks the tournament the same way)
+CREATE OR REPLACE FUNCTION rebuild_player_tour_stats(tour_id int)
+    RETURNS int
+    AS
+    $body$
+    DECLARE
+        last_id int;
+        m matchesRaw;
+        replayed int := 0;
+    BEGIN
+        PERFORM 1 FROM tournaments AS t WHERE t.id = $1 FOR UPDATE;
+        SELECT k.last_match_id INTO last_id
+        FROM stats_checkpoints AS k
+        WHERE k.tour_id = $1;
+
+        IF last_id IS NULL THEN
+            PERFORM refresh_player_tour_stats($1);
+            SELECT count(*) INTO replayed
+            FROM matchesRaw
+            WHERE matchesRaw.tour_id = $1;
+        ELSE
+            -- players registered after the checkpoint start with empty statistics
+            UPDATE player_tour_stats AS s
+            SET matches = coalesce(x.matches, 0),
+                wins = coalesce(x.wins, 0),
+                draws = coalesce(x.draws, 0),
+                byes = coalesce(x.byes, 0),
+                omw = coalesce(x.omw, 0)
+            FROM player_tour_stats AS p
+            LEFT JOIN player_tour_stats_snapshots AS x
+                ON x.tour_id = p.tour_id AND x.player_id = p.player_id
+            WHERE p.tour_id = $1 AND s.tour_id = p.tour_id AND s.player_id = p.player_id;
+
+            FOR m IN
+                SELECT * FROM matchesRaw
+                WHERE matchesRaw.tour_id = $1 AND id > last_id
+                ORDER BY id
+            LOOP
+                PERFORM apply_match_stats(m);
+                replayed := replayed + 1;
+            END LOOP;
+        END IF;
+
+        -- cached standings and proposed pairings are no longer valid
+        UPDATE tournaments SET revision = revision + 1 WHERE id = $1;
+        RETURN replayed;
+    END;
+    $body$
+    language plpgsql;
+
+COMMIT;
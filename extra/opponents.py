@@ -0,0 +1,126 @@
+"""Index of opponents (who has played whom) within one tournament."""
+
+import threading
+from array import array
+
+
+class OpponentIndex(object):
+    """Opponents and wins of each player of one tournament, held in memory.
+
+    Players are mapped to consecutive integers (slots) in order in which they
+    appear in matches. Opponents of each player are kept in a set of slots,
+    so that both have_met() and opponents() take O(degree) time at most, and
+    all matches are kept in compact arrays of slots for bulk computations
+    (see tiebreaks.py).
+
+    The index is built from matches fetched from table matchesRaw and kept
+    current by adding each newly recorded match (see addMatch and
+    addMatches).
+
+    Attributes:
+        tour_id: ID number of tournament as integer.
+        lock: Lock to be held while the index is being read or updated by
+              more threads.
+        last_match_id: Highest ID of match fetched from the database.
+        ids: List of player IDs by slot.
+        pl1, pl2, winner: Arrays of slots of the first player, the second
+                          player and the winner (-1 for a draw) of each
+                          match (byes included).
+    """
+
+    def __init__(self, tour_id):
+        self.tour_id = tour_id
+        self.lock = threading.RLock()
+        self.last_match_id = 0
+        self.ids = []
+        self.pl1 = array('i')
+        self.pl2 = array('i')
+        self.winner = array('i')
+        self._slots = {}
+        self._opponents = []
+        self._wins = []
+        # matches added with id above last_match_id (recorded by this
+        # process, but not fetched yet)
+        self._added = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def slot(self, player_id):
+        """Return slot of given player (a new one for an unknown player)."""
+        s = self._slots.get(player_id)
+        if s is None:
+            s = self._slots[player_id] = len(self.ids)
+            self.ids.append(player_id)
+            self._opponents.append(set())
+            self._wins.append(0)
+        return s
+
+    def addMatch(self, match_id, pl1_id, pl2_id, winner_id):
+        """Add a recorded match to the index (unless already added).
+
+        Args:
+            match_id: ID of the match in table matchesRaw.
+            pl1_id: ID number of the first player.
+            pl2_id: ID number of the second player (same as pl1_id for bye).
+            winner_id: ID number of winner (None in case of a draw).
+        """
+        if match_id <= self.last_match_id or match_id in self._added:
+            return
+        self._added.add(match_id)
+        (a, b) = (self.slot(pl1_id), self.slot(pl2_id))
+        self.pl1.append(a)
+        self.pl2.append(b)
+        if winner_id is None:
+            self.winner.append(-1)
+        else:
+            self.winner.append(self.slot(winner_id))
+            self._wins[self._slots[winner_id]] += 1
+        if a != b:
+            self._opponents[a].add(b)
+            self._opponents[b].add(a)
+
+    def addMatches(self, rows):
+        """Add matches fetched from the database.
+
+        Args:
+            rows: List of tuples (match_id, pl1_id, pl2_id, winner_id) of all
+                  matches of the tournament with ID above last_match_id, in
+                  order of match_id.
+        """
+        for row in rows:
+            self.addMatch(*row)
+        if rows:
+            self.last_match_id = max(self.last_match_id, rows[-1][0])
+            self._added = set(i for i in self._added
+                              if i > self.last_match_id)
+
+    def have_met(self, a, b):
+        """Return True if players a and b (IDs) have played each other."""
+        sa, sb = self._slots.get(a), self._slots.get(b)
+        if sa is None or sb is None:
+            return False
+        return sb in self._opponents[sa]
+
+    def opponents(self, a):
+        """Return list of IDs of (distinct) opponents of player a."""
+        sa = self._slots.get(a)
+        if sa is None:
+            return []
+        return [self.ids[s] for s in self._opponents[sa]]
+
+    def wins(self, a):
+        """Return number of wins (byes included) of player a."""
+        sa = self._slots.get(a)
+        return 0 if sa is None else self._wins[sa]
+
+    def omw(self, a):
+        """Return opponent match wins of player a.
+
+        OMW is the sum of wins of all distinct opponents of the player (the
+        same value as omw in v_tourStandings).
+        """
+        sa = self._slots.get(a)
+        if sa is None:
+            return 0
+        return sum(self._wins[s] for s in self._opponents[sa])
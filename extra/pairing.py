@@ -0,0 +1,246 @@
+"""Pair players for the next round of a Swiss system tournament.
+
+The pairing engine works on compact in-memory structures built once per round
+from the standings and the index of opponents of the tournament (players are
+referred to by their position in the standings, opponents are kept in sets of
+positions) and needs no database access.
+
+Players are paired from the top of the standings within their score group,
+each with the nearest player he or she has not met yet (a player who can not
+be paired within the group floats down to the next one). The search
+backtracks when it runs into a rematch, but only for a bounded number of
+steps. Cases which the search can not solve are handed over to a weighted
+matching (see matching.py) of the lowest-ranked players.
+"""
+
+from matching import maxWeightMatching
+
+
+# number of search steps (tried pairs) allowed per player
+SEARCH_STEPS = 20
+# number of nearest opponents tried for each player by the search
+SEARCH_CANDIDATES = 6
+# number of lowest-ranked players with a bye left who are tried for a bye
+BYE_CANDIDATES = 3
+# number of lowest-ranked players paired by the weighted matching when the
+# search fails (doubled while needed, up to FALLBACK_LIMIT)
+FALLBACK_SIZE = 16
+FALLBACK_LIMIT = 128
+
+
+def pairPlayers(players, index):
+    """Pair players for the next round avoiding rematches where possible.
+
+    Args:
+        players: List of tuples (player_id, score, byes) of all players to be
+                 paired in order of standings (best player first).
+        index: OpponentIndex of the tournament (see opponents.py).
+    Returns:
+        A tuple (pairs, bye):
+            pairs: list of tuples (player1_id, player2_id), the best pairs
+                   first (player1 being the one better placed in standings).
+            bye: ID of player who gets a bye (None for even number of
+                 players).
+    """
+    rank = dict((p[0], i) for (i, p) in enumerate(players))
+    # opponents of each player as positions in standings
+    opponents = [set(rank[o] for o in index.opponents(p[0]) if o in rank)
+                 for p in players]
+    scores = [p[1] for p in players]
+    # score groups from the top, standings order is kept within each group
+    order = sorted(range(len(players)), key=lambda i: -scores[i])
+
+    bye = None
+    if len(order) % 2 != 0:
+        # lowest-ranked players who have not had a bye yet (anyone if all
+        # players had one)
+        candidates = [i for i in reversed(order) if players[i][2] == 0]
+        candidates = candidates or list(reversed(order))
+        for i in candidates[:BYE_CANDIDATES]:
+            pairs = s_search([j for j in order if j != i], opponents)
+            if pairs is not None:
+                bye = i
+                break
+        if bye is None:
+            bye = candidates[0]
+            pairs = s_fallback([j for j in order if j != bye], opponents,
+                               scores)
+    else:
+        pairs = s_search(order, opponents)
+        if pairs is None:
+            pairs = s_fallback(order, opponents, scores)
+
+    pairs = sorted((min(a, b), max(a, b)) for (a, b) in pairs)
+    return ([(players[a][0], players[b][0]) for (a, b) in pairs],
+            None if bye is None else players[bye][0])
+
+
+def s_search(order, opponents, steps=None):
+    """Pair players in given order without rematches by bounded search.
+
+    Unpaired players are kept in a doubly linked list, so that pairing two
+    players and undoing it (when backtracking) takes constant time.
+
+    Args:
+        order: List of positions of players (even number of them) in order in
+               which they are to be paired.
+        opponents: List of sets of positions of opponents of each player.
+        steps: Maximum number of tried pairs (SEARCH_STEPS per player by
+               default).
+    Returns:
+        A list of tuples (position1, position2) of paired players or None if
+        no pairing without rematches was found within the given steps.
+    """
+    if steps is None:
+        steps = SEARCH_STEPS * len(order) + 100
+    # linked list of unpaired players; 'end' is the sentinel
+    end = -1
+    nxt = {end: order[0] if order else end}
+    prv = {end: order[-1] if order else end}
+    for (k, i) in enumerate(order):
+        prv[i] = order[k - 1] if k > 0 else end
+        nxt[i] = order[k + 1] if k + 1 < len(order) else end
+
+    def unlink(i):
+        nxt[prv[i]] = nxt[i]
+        prv[nxt[i]] = prv[i]
+
+    def relink(i):
+        nxt[prv[i]] = i
+        prv[nxt[i]] = i
+
+    # each frame: [player, candidate opponents, index of current opponent]
+    frames = []
+    advance = True
+    while True:
+        if advance:
+            # pair the best unpaired player
+            p = nxt[end]
+            if p == end:
+                return [(f[0], f[1][f[2]]) for f in frames]
+            candidates = []
+            q = nxt[p]
+            while q != end and len(candidates) < SEARCH_CANDIDATES:
+                if q not in opponents[p]:
+                    candidates.append(q)
+                q = nxt[q]
+            frames.append([p, candidates, -1])
+        frame = frames[-1]
+        (p, candidates, k) = frame
+        if k >= 0:
+            # undo current pair before trying the next candidate
+            relink(candidates[k])
+            relink(p)
+        if k + 1 < len(candidates):
+            steps -= 1
+            if steps < 0:
+                return None
+            frame[2] = k + 1
+            unlink(p)
+            unlink(candidates[k + 1])
+            advance = True
+        else:
+            # no candidate left, try next candidate of the previous player
+            frames.pop()
+            if not frames:
+                return None
+            advance = False
+
+
+def s_weighted(order, opponents, scores):
+    """Pair players in given order by a maximum weight matching.
+
+    Every two players can be paired, but a rematch costs more than any other
+    pairing, then difference of scores is penalized and finally distance of
+    players in the given order.
+
+    Args:
+        order: List of positions of players (even number of them).
+        opponents: List of sets of positions of opponents of each player.
+        scores: List of scores of players.
+    Returns:
+        A tuple (pairs, rematches) of list of tuples (position1, position2)
+        of paired players and number of rematches among them.
+    """
+    n = len(order)
+    score_cost = n
+    max_diff = max(scores[i] for i in order) - min(scores[i] for i in order)
+    rematch_cost = 1 + (n // 2) * (score_cost * max_diff ** 2 + n)
+    max_cost = rematch_cost + score_cost * max_diff ** 2 + n
+
+    edges = []
+    for a in range(n):
+        for b in range(a + 1, n):
+            (i, j) = (order[a], order[b])
+            cost = score_cost * (scores[i] - scores[j]) ** 2 + (b - a)
+            if j in opponents[i]:
+                cost += rematch_cost
+            edges.append((a, b, int(max_cost - cost)))
+    mate = maxWeightMatching(edges, maxcardinality=True)
+
+    pairs = [(order[a], order[b]) for (a, b) in enumerate(mate) if a < b]
+    rematches = sum(1 for (i, j) in pairs if j in opponents[i])
+    return pairs, rematches
+
+
+def s_fallback(order, opponents, scores):
+    """Pair players whom the bounded search failed to pair.
+
+    The lowest-ranked players are paired by the weighted matching and the
+    rest by the search. The number of players paired by the weighted
+    matching grows until there are no rematches (or all players are paired
+    by it, or FALLBACK_LIMIT is reached, in which case rematches are
+    accepted).
+
+    Args:
+        order: List of positions of players (even number of them).
+        opponents: List of sets of positions of opponents of each player.
+        scores: List of scores of players.
+    Returns:
+        A list of tuples (position1, position2) of paired players.
+    """
+    size = FALLBACK_SIZE
+    while True:
+        size = min(size, len(order))
+        split = len(order) - size
+        head = s_search(order[:split], opponents)
+        (tail, rematches) = s_weighted(order[split:], opponents, scores)
+        if head is not None and rematches == 0:
+            return head + tail
+        if size == len(order) or size >= FALLBACK_LIMIT:
+            break
+        size *= 2
+
+    if head is None:
+        # pair the rest as it comes, accepting rematches
+        head = s_search(order[:split], [set() for s in opponents])
+    return head + tail
+
+
+class OpponentSets(object):
+    """Opponents of players held in plain sets.
+
+    A picklable stand-in for OpponentIndex (of which pairPlayers uses only
+    opponents()), so that tournaments can be paired in other processes.
+    """
+
+    def __init__(self, opponents):
+        self._opponents = opponents
+
+    def opponents(self, a):
+        """Return IDs of (distinct) opponents of player a."""
+        return self._opponents.get(a, ())
+
+
+def pairJob(job):
+    """Pair one tournament (to be run by a process pool).
+
+    Args:
+        job: A tuple (tour_id, players, opponents) of ID of the tournament,
+             its players as expected by pairPlayers and a dictionary mapping
+             ID of each player to a set of IDs of his or her opponents.
+    Returns:
+        A tuple (tour_id, (pairs, bye)) with the result of pairPlayers.
+    """
+    (tour_id, players, opponents) = job
+    return (tour_id, pairPlayers(players, OpponentSets(opponents)))
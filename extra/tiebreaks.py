@@ -0,0 +1,137 @@
+"""Tiebreaks of players of a Swiss system tournament computed with NumPy.
+
+All tiebreaks are computed at once from the arrays of matches held by the
+index of opponents of the tournament (see opponents.py), which is built by a
+single fetch of matchesRaw. Matches are turned into a list of (player,
+opponent, result) entries - a sparse matrix of results - and each tiebreak is
+a vectorized sum over it, so the cost grows with the number of matches only.
+
+Points are counted as in standings: 3 for a win (a bye included) and 1 for a
+draw.
+"""
+
+import numpy as np
+
+
+# tiebreaks that can be computed (in the default order of precedence):
+#   omw: opponent match wins - sum of wins of distinct opponents (the same
+#        value as omw in v_tourStandings)
+#   buchholz: sum of points of opponents of all matches played (byes have no
+#             opponent and add nothing)
+#   median_buchholz: buchholz without the best and the worst opponent (for
+#                    players with at least three matches against opponents)
+#   sonneborn_berger: sum of points of beaten opponents and half of points
+#                     of opponents the player drew with
+#   omw_pct: opponents' match-win percentage - average of match-win
+#            percentages (points / 3 * matches, at least 1/3) of distinct
+#            opponents
+TIEBREAKS = ('omw', 'buchholz', 'median_buchholz', 'sonneborn_berger',
+             'omw_pct')
+
+
+def computeTiebreaks(index, player_ids, tiebreaks=TIEBREAKS):
+    """Compute tiebreaks of given players.
+
+    Args:
+        index: OpponentIndex of the tournament (see opponents.py).
+        player_ids: List of ID numbers of players as integers (players
+                    without matches get zero for each tiebreak).
+        tiebreaks: List of names of tiebreaks (see TIEBREAKS).
+    Returns:
+        A dictionary mapping ID of each player to a tuple of values of the
+        requested tiebreaks (in the requested order).
+    """
+    invalid = [t for t in tiebreaks if t not in TIEBREAKS]
+    if invalid:
+        raise ValueError("Invalid tiebreak/s: {0}".format(invalid))
+
+    with index.lock:
+        n = len(index)
+        slots = dict((i, s) for (s, i) in enumerate(index.ids))
+        (pl1, pl2, winner) = [s_toArray(a) for a in
+                              (index.pl1, index.pl2, index.winner)]
+    values = s_compute(n, pl1, pl2, winner)
+
+    res = {}
+    zero = tuple(0 for t in tiebreaks)
+    for i in player_ids:
+        s = slots.get(i)
+        if s is None:
+            res[i] = zero
+        else:
+            res[i] = tuple(values[t][s].item() for t in tiebreaks)
+    return res
+
+
+def s_toArray(a):
+    """Return a NumPy copy of an array('i') of the index of opponents."""
+    if not len(a):
+        return np.zeros(0, dtype=np.intc)
+    return np.frombuffer(a, dtype=np.intc).copy()
+
+
+def s_compute(n, pl1, pl2, winner):
+    """Compute all tiebreaks of all players of the index of opponents.
+
+    Args:
+        n: Number of players (slots) in the index.
+        pl1, pl2, winner: NumPy arrays of slots of the first player, the
+                          second player and the winner (-1 for a draw) of
+                          each match.
+    Returns:
+        A dictionary mapping name of each tiebreak to NumPy array of its
+        values by slot.
+    """
+    bye = pl1 == pl2
+    wins = np.bincount(winner[winner >= 0], minlength=n)
+    drawn = (winner == -1) & ~bye
+    draws = (np.bincount(pl1[drawn], minlength=n) +
+             np.bincount(pl2[drawn], minlength=n))
+    matches = (np.bincount(pl1, minlength=n) +
+               np.bincount(pl2[~bye], minlength=n))
+    points = 3 * wins + draws
+
+    # sparse matrix of results: one entry for each player of each match
+    # played against an opponent
+    (a, b, w) = (pl1[~bye], pl2[~bye], winner[~bye])
+    player = np.concatenate((a, b))
+    opponent = np.concatenate((b, a))
+    result = np.concatenate((np.where(w == a, 1.0, 0.0),
+                             np.where(w == b, 1.0, 0.0)))
+    result[np.concatenate((w, w)) == -1] = 0.5
+    opp_points = points[opponent]
+    games = np.bincount(player, minlength=n)
+
+    buchholz = np.bincount(player, weights=opp_points, minlength=n)
+    sonneborn_berger = np.bincount(player, weights=opp_points * result,
+                                   minlength=n)
+
+    # points of opponents sorted by player (and points), so that the worst
+    # and the best opponent of each player are the first and the last entry
+    # of the player's run
+    order = np.lexsort((opp_points, player))
+    sorted_points = opp_points[order]
+    ends = np.cumsum(games)
+    starts = ends - games
+    cut = np.zeros(n)
+    many = games >= 3
+    cut[many] = (sorted_points[starts[many]] +
+                 sorted_points[ends[many] - 1])
+    median_buchholz = buchholz - cut
+
+    # distinct opponents (rematches are counted once)
+    pairs = np.unique(player.astype(np.int64) * max(n, 1) + opponent)
+    (player, opponent) = (pairs // max(n, 1), pairs % max(n, 1))
+    distinct = np.bincount(player, minlength=n)
+    omw = np.bincount(player, weights=wins[opponent], minlength=n)
+    mwp = np.maximum(points / (3.0 * np.maximum(matches, 1)), 1.0 / 3)
+    omw_pct = np.bincount(player, weights=mwp[opponent], minlength=n)
+    omw_pct = omw_pct / np.maximum(distinct, 1)
+
+    return {
+        'omw': omw.astype(np.int64),
+        'buchholz': buchholz.astype(np.int64),
+        'median_buchholz': median_buchholz.astype(np.int64),
+        'sonneborn_berger': sonneborn_berger,
+        'omw_pct': omw_pct,
+    }
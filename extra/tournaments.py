@@ -1,18 +1,499 @@
 """Manage a database of tournaments using the Swiss system of organization."""
 
+import itertools
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
 import psycopg2
-import random
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 
+import instrumentation
+from cache import ResultCache
+from instrumentation import InstrumentedCursor, instrumented
+from logqueue import QueueHandler, QueueListener, s_newQueue
+from opponents import OpponentIndex
+from pairing import pairJob, pairPlayers
 
-# SUPPORTING FUNCTIONS
 
+# RESULTS
+
+# outcome of an operation for one item (e.g. a player being registered):
+#   id: ID number of the item
+#   status: what happened to the item as string (e.g. 'registered') or the
+#           reason why it was rejected (e.g. 'invalid')
+ItemStatus = namedtuple('ItemStatus', 'id status')
+# outcome of one reported match (see reportMatches)
+MatchStatus = namedtuple('MatchStatus', 'player1_id player2_id status')
+# pairing of a started round (see startRound and getPairings):
+#   id: ID number of the pairing (to be passed to reportMatch)
+#   round: number of the round (rounds of a tournament are numbered from 1)
+#   player1_id, player1_name, player2_id, player2_name: the paired players
+#                                                       (the same for a bye)
+Pairing = namedtuple('Pairing', 'id round player1_id player1_name '
+                                'player2_id player2_name')
+
+
+# LOGGING
+
+# Messages (confirmations at INFO level, rejections at WARNING level) are
+# logged by this logger. Nothing is printed unless setVerbose() is called or
+# the application configures logging itself.
+logger = logging.getLogger('tournaments')
+logger.addHandler(logging.NullHandler())
+
+_log_lock = threading.Lock()
+# handler and listener writing messages to console (while verbose)
+_log_handler = None
+_log_listener = None
+
+
+def setVerbose(verbose=True):
+    """Print messages of this module to console (or stop printing them).
+
+    Messages are passed to a background thread through a queue, so that the
+    functions of this module never wait for the console.
+
+    Args:
+        verbose: True to print messages, False to stop printing them.
+    """
+    global _log_handler, _log_listener
+    with _log_lock:
+        if _log_handler is not None:
+            logger.removeHandler(_log_handler)
+            _log_listener.stop()
+            (_log_handler, _log_listener) = (None, None)
+            logger.setLevel(logging.NOTSET)
+        if verbose:
+            console = logging.StreamHandler(sys.stdout)
+            console.setFormatter(logging.Formatter('%(message)s'))
+            q = s_newQueue()
+            _log_handler = QueueHandler(q)
+            _log_listener = QueueListener(q, console)
+            _log_listener.start()
+            logger.addHandler(_log_handler)
+            logger.setLevel(logging.INFO)
+
+
+# CONNECTION POOL
+
+# Settings of the connection pool shared by all functions of this module.
+# Use s_configurePool() to change them (the DSN can also be provided by the
+# TOURNAMENTS_DSN environment variable).
+POOL_SETTINGS = {
+    'dsn': os.environ.get('TOURNAMENTS_DSN', 'dbname=tournaments'),
+    'minconn': 1,
+    'maxconn': 10,
+    # connections idle for longer than check_after seconds are health-checked
+    # (with 'SELECT 1') before being handed out again
+    'check_after': 30,
+}
+
+_pool = None
+# limits the number of connections handed out at once; threads wait for a
+# free connection instead of getting PoolError from an exhausted pool
+_pool_slots = None
+_pool_lock = threading.Lock()
+# time when each pooled connection was last returned to the pool
+_last_used = {}
+# connection currently held by the running thread (shared by nested calls)
+_local = threading.local()
+
+
+def s_configurePool(**settings):
+    """Change settings of the connection pool.
+
+    The current pool (if any) is closed and a new one is created with the new
+    settings upon the next s_connect().
+
+    Args:
+        **settings: Any of dsn, minconn, maxconn and check_after as
+                    key=value (example: dsn='dbname=tournaments_test').
+    """
+    invalid = [k for k in settings if k not in POOL_SETTINGS]
+    if invalid:
+        raise ValueError("Invalid pool setting/s: {0}".format(invalid))
+    s_closePool()
+    POOL_SETTINGS.update(settings)
+
+
+def s_closePool():
+    """Close all connections of the connection pool."""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _pool_slots = None
+        _last_used.clear()
+
+
+def s_getPool():
+    """Return the connection pool (created upon first use).
+
+    Returns:
+        A tuple (pool, slots) of the psycopg2 connection pool and the
+        semaphore limiting the number of connections handed out at once.
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            # queries of all connections are recorded (see
+            # instrumentation.py)
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                POOL_SETTINGS['minconn'], POOL_SETTINGS['maxconn'],
+                POOL_SETTINGS['dsn'], cursor_factory=InstrumentedCursor)
+            _pool_slots = threading.BoundedSemaphore(POOL_SETTINGS['maxconn'])
+        return _pool, _pool_slots
+
+
+def s_isHealthy(db):
+    """Check if pooled connection can be handed out.
+
+    Connections which were idle for less than 'check_after' seconds are
+    trusted without a round trip to the database.
+
+    Args:
+        db: Database connection taken from the pool.
+    Returns:
+        boolean: True if connection is usable, False otherwise.
+    """
+    if db.closed:
+        return False
+    idle = time.time() - _last_used.get(id(db), time.time())
+    if idle < POOL_SETTINGS['check_after']:
+        return True
+    try:
+        c = db.cursor()
+        c.execute("SELECT 1")
+        c.close()
+        db.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+
+@contextmanager
+def s_connect(shared=True):
+    """Lend a pooled connection to the PostgreSQL 'tournaments' database.
+
+    To be used as a context manager. When the block ends the transaction is
+    committed (or rolled back in case of an exception) and the connection is
+    returned to the pool. Nested calls within one thread reuse the connection
+    and the transaction of the outermost call, so that one logical operation
+    uses only one connection.
+
+    Args:
+        shared: (optional) False to lend a connection of its own, which
+                neither joins the transaction of an outer call nor is
+                reused by calls made while the block is suspended (e.g. by
+                a generator reading a server-side cursor).
+    Yields a database connection.
+    """
+    db = getattr(_local, 'db', None) if shared else None
+    if db is not None:
+        _local.depth += 1
+        try:
+            yield db
+        finally:
+            _local.depth -= 1
+        return
+
+    pool, slots = s_getPool()
+    start = timer()
+    slots.acquire()
+    try:
+        db = pool.getconn()
+        if not s_isHealthy(db):
+            _last_used.pop(id(db), None)
+            pool.putconn(db, close=True)
+            db = pool.getconn()
+        if instrumentation.ENABLED:
+            instrumentation.registry.recordAcquire(
+                instrumentation.currentFunction(), timer() - start)
+        if shared:
+            _local.db = db
+            _local.depth = 1
+        broken = False
+        try:
+            yield db
+        except Exception as e:
+            broken = isinstance(e, (psycopg2.OperationalError,
+                                    psycopg2.InterfaceError))
+            if not db.closed:
+                try:
+                    db.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        else:
+            db.commit()
+        finally:
+            if shared:
+                _local.db = None
+            broken = broken or bool(db.closed)
+            if broken:
+                _last_used.pop(id(db), None)
+            else:
+                _last_used[id(db)] = time.time()
+            if pool.closed:
+                db.close()
+            else:
+                pool.putconn(db, close=broken)
+    finally:
+        slots.release()
+
+
+# STATUS CATALOG
+
+# valid values of each status type of the database, read once per process
+# (call s_invalidateStatuses() after a value is added to a type)
+_statuses = {}
+_statuses_lock = threading.Lock()
+
+
+def s_getStatuses(type_name, reload=False):
+    """Return valid values of a status type of the database.
+
+    Values are read from the database upon first use and kept for the
+    lifetime of the process.
+
+    Args:
+        type_name: Name of the enum type ('tourStatus' or 'playerStatus').
+        reload: True to read the values again even if they are known.
+    Returns:
+        A tuple of names of the statuses as strings (in order of the type).
+    """
+    statuses = None if reload else _statuses.get(type_name)
+    if statuses is None:
+        with _statuses_lock:
+            statuses = None if reload else _statuses.get(type_name)
+            if statuses is None:
+                with s_connect() as db:
+                    c = db.cursor()
+                    c.execute("SELECT unnest(enum_range(NULL::{0}))::text"
+                              .format(type_name))
+                    statuses = tuple(s[0] for s in c.fetchall())
+                    c.close()
+                _statuses[type_name] = statuses
+    return statuses
+
+
+def s_invalidateStatuses():
+    """Forget all values of status types (they are read again when used)."""
+    with _statuses_lock:
+        _statuses.clear()
+
+
+# OPPONENT INDEXES
+
+# maximum number of tournaments whose index of opponents is kept in memory
+# (the least recently used ones are dropped first)
+OPPONENT_INDEXES = 64
+
+_opponent_indexes = OrderedDict()
+_opponent_indexes_lock = threading.Lock()
+
+
+def s_loadedOpponentIndex(tour_id):
+    """Return index of opponents of given tournament as held in memory.
+
+    An empty index is created if none is loaded yet; the index is not
+    brought up to date (see s_getOpponentIndex).
+
+    Args:
+        tour_id: ID number of tournament as integer.
+    Returns:
+        OpponentIndex of the tournament (see opponents.py).
+    """
+    with _opponent_indexes_lock:
+        index = _opponent_indexes.pop(tour_id, None)
+        if index is None:
+            index = OpponentIndex(tour_id)
+        _opponent_indexes[tour_id] = index
+        while len(_opponent_indexes) > OPPONENT_INDEXES:
+            _opponent_indexes.popitem(last=False)
+    return index
+
+
+def s_getOpponentIndex(tour_id, shared=True):
+    """Return index of opponents of given tournament.
+
+    The index is built by a single query upon first use. Afterwards only the
+    matches recorded since (by any process) are fetched and added to it.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+        shared: (optional) False to build a new index used by the calling
+                transaction only, e.g. one of a caller which might roll back
+                the matches read (see s_isCacheable).
+    Returns:
+        OpponentIndex of the tournament (see opponents.py).
+    """
+    if shared:
+        index = s_loadedOpponentIndex(tour_id)
+    else:
+        index = OpponentIndex(tour_id)
+    with index.lock:
+        with s_connect() as db:
+            c = db.cursor()
+            # the flag of the tournament limits the scan to one partition
+            c.execute("SELECT id, pl1_id, pl2_id, winner_id FROM matchesRaw "
+                      "WHERE tour_id = %s AND id > %s AND archived = "
+                      "(SELECT archived FROM tournaments WHERE id = %s) "
+                      "ORDER BY id",
+                      (tour_id, index.last_match_id, tour_id))
+            rows = c.fetchall()
+            c.close()
+        index.addMatches(rows)
+    return index
+
+
+def s_addToOpponentIndex(tour_id, rows, committed=True):
+    """Add newly recorded matches to index of opponents (if one is loaded).
+
+    Args:
+        tour_id: ID number of tournament as integer.
+        rows: List of tuples (match_id, pl1_id, pl2_id, winner_id).
+        committed: (optional) False if the matches were recorded within a
+                   transaction of a caller, which might still roll them back
+                   (see s_isCacheable); the index is dropped instead.
+    """
+    if not committed:
+        s_clearOpponentIndexes(tour_id)
+        return
+    index = _opponent_indexes.get(tour_id)
+    if index is not None:
+        with index.lock:
+            for row in rows:
+                index.addMatch(*row)
 
-def s_connect():
-    """Connect to the PostgreSQL 'tournaments' database.
 
-    Returns a database connection.
+def s_clearOpponentIndexes(tour_id=None):
+    """Drop index of opponents of given tournament (all of them if None).
+
+    To be used when matches get deleted (or might get rolled back).
     """
-    return psycopg2.connect("dbname=tournaments")
+    with _opponent_indexes_lock:
+        if tour_id is None:
+            _opponent_indexes.clear()
+        else:
+            _opponent_indexes.pop(tour_id, None)
+
+
+# RESULT CACHE
+
+# Settings of the cache of standings and pairings shared by all threads. Use
+# s_configureCache() to change them.
+CACHE_SETTINGS = {
+    'maxsize': 256,
+    # entries older than ttl seconds are read again even if the tournament
+    # did not change (e.g. to pick up names of players changed by others)
+    'ttl': 30,
+}
+
+_cache = ResultCache(**CACHE_SETTINGS)
+
+
+def s_configureCache(**settings):
+    """Change settings of the cache of standings and pairings.
+
+    The current cache is dropped (together with its statistics).
+
+    Args:
+        **settings: Any of maxsize and ttl as key=value (example: ttl=5).
+    """
+    global _cache
+    invalid = [k for k in settings if k not in CACHE_SETTINGS]
+    if invalid:
+        raise ValueError("Invalid cache setting/s: {0}".format(invalid))
+    CACHE_SETTINGS.update(settings)
+    _cache = ResultCache(**CACHE_SETTINGS)
+
+
+def s_getRevision(tour_id):
+    """Return revision of given tournament (None in case of invalid id).
+
+    Revision is bumped by the database whenever registrations or matches of
+    the tournament change (by any process), so a cached result of the same
+    revision is still valid.
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT revision FROM tournaments WHERE id = %s",
+                  (tour_id,))
+        res = c.fetchone()
+        c.close()
+    return res[0] if res else None
+
+
+def s_isCacheable():
+    """Check if results read by the running call can be cached.
+
+    Only results read by the outermost s_connect() of a thread are cached,
+    as a transaction of a caller might have changed (and later roll back)
+    the data they come from.
+    """
+    return getattr(_local, 'depth', 0) == 1
+
+
+def s_invalidateCache(tour_id=None):
+    """Drop cached results of given tournament (all of them if None)."""
+    _cache.invalidate(tour_id)
+
+
+def cacheStats():
+    """Return statistics of the cache of standings and pairings.
+
+    Returns:
+        A dictionary with counts of hits, misses, evictions, expirations and
+        invalidations and the current size and maxsize of the cache.
+    """
+    return _cache.stats()
+
+
+# STATISTICS
+
+
+def dumpStats():
+    """Return statistics of database access by public functions.
+
+    Returns:
+        A dictionary with keys:
+            functions: dictionary mapping name of each public function to a
+                       dictionary of its calls, errors, seconds (wall time),
+                       acquires and acquire_seconds (time spent waiting for
+                       a pooled connection).
+            queries: dictionary mapping name of each public function to a
+                     dictionary mapping fingerprint of each of its queries to
+                     a dictionary of its calls, rows and seconds.
+            cache: statistics of the cache of standings and pairings (see
+                   cacheStats).
+    """
+    stats = instrumentation.registry.dump()
+    stats['cache'] = cacheStats()
+    return stats
+
+
+def prometheusStats():
+    """Return statistics (see dumpStats) in Prometheus text format."""
+    return instrumentation.prometheusText(dumpStats())
+
+
+def s_resetStats():
+    """Set all counters of statistics of public functions to zero."""
+    instrumentation.registry.reset()
+
+
+# SUPPORTING FUNCTIONS
 
 
 def s_countTP(c_type, *status):
@@ -36,39 +517,64 @@ def s_countTP(c_type, *status):
         'p': {'status': 'playerStatus', 'view': 'v_playersCountByStatus'}
     }
     if c_type not in types:
-        print "Invalid c_type: '{0}'!".format(c_type)
+        logger.warning("Invalid c_type: '%s'!", c_type)
         return None
 
-    db = s_connect()
-    c = db.cursor()
-
-    # List valid statuses from the db
-    c.execute("SELECT "
-              "unnest(enum_range(NULL::{0}))".format(types[c_type]['status']))
-    db_statuses = [s[0] for s in c.fetchall()]
-
-    # If status is provided, each entry is checked against valid choices from
-    # db to ensure valid results as well as to prevent injection (as string
-    # formatting is later used for status).
+    # Statuses are checked against the catalog (read again once in case a
+    # status was added to the type since it was loaded).
+    db_statuses = s_getStatuses(types[c_type]['status'])
     if status:
-        status = [s for s in status]
+        status = list(status)
+        if not set(status) <= set(db_statuses):
+            db_statuses = s_getStatuses(types[c_type]['status'], reload=True)
         for s in status:
             if s not in db_statuses:
-                print "Invalid status: '{0}'!".format(s)
+                logger.warning("Invalid status: '%s'!", s)
                 return None
     # If no status provided, results will reflect all possible choices.
     else:
-        status = db_statuses
+        status = list(db_statuses)
+
+    # Sum up the counters of all selected statuses (one row per status).
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT coalesce(sum(count), 0)::bigint FROM {0} "
+                  "WHERE status = ANY (%s)".format(types[c_type]['view']),
+                  (status,))
+        res = c.fetchone()[0]
+        c.close()
+
+    return res
 
-    # Sum up the count of all selected statuses to get full count of selection.
-    c.execute("SELECT sum(count) FROM {0} WHERE status::text = "
-              "ANY (ARRAY{1})".format(types[c_type]['view'], status))
 
-    res = c.fetchone()[0]
+def s_createTP(table, status, names):
+    """Insert tournaments or players with given names by one statement.
 
-    c.close()
-    db.close()
+    Names are passed as one array and inserted in order of their position
+    in it, so the ids generated by the database (ascending within the
+    statement) correspond to the names in order.
 
+    Args:
+        table: Complete name of db table ('tournaments' or 'players').
+        status: Status of the new records as string.
+        names: List of names of the new records as strings.
+    Returns:
+        A list of IDs of the new records (in order of names).
+    """
+    names = list(names)
+    if not names:
+        return []
+    with s_connect() as db:
+        c = db.cursor()
+        # Table is inserted separately as it needs to be inserted without
+        # quotes and is not provided by user (thus poses no security risk)
+        c.execute("INSERT INTO {0} (name, status) "
+                  "SELECT n.name, %s "
+                  "FROM unnest(%s::text[]) WITH ORDINALITY AS n (name, ord) "
+                  "ORDER BY n.ord "
+                  "RETURNING id".format(table), (status, names))
+        res = sorted(r[0] for r in c.fetchall())
+        c.close()
     return res
 
 
@@ -81,13 +587,12 @@ def s_isValidId(table, r_id):
     Returns:
         boolean: True if id exists in given table, False otherwise.
     """
-    db = s_connect()
-    c = db.cursor()
-    query = "SELECT id FROM {0} WHERE id = %s".format(table)
-    c.execute(query, (r_id,))
-    res = c.fetchone()
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        query = "SELECT id FROM {0} WHERE id = %s".format(table)
+        c.execute(query, (r_id,))
+        res = c.fetchone()
+        c.close()
 
     if res:
         return True
@@ -103,39 +608,49 @@ def s_editTP(table, r_id, **kwargs):
         **kwargs: Either name or status as key='string'
                   (example: name='Dick Somename')
     Returns:
-        Upon success, nothing gets returned, but confirmation statement is
-        printed. In case of invalid id, error statement gets returned.
+        True upon success, None in case of invalid id (or of a new status of
+        an archived tournament).
     """
     name = kwargs.get('name')
     status = kwargs.get('status')
-    # check if provided id is valid
-    if s_isValidId(table, r_id) is False:
-        print "Invalid id '{0}'!".format(r_id)
-        return None
-
-    db = s_connect()
-    c = db.cursor()
 
-    # if name was provided, change it in the provided table
-    if name:
-        # Table is inserted separately as it needs to be inserted without
-        # quotes and is not provided by user (thus poses no security risk)
-        query = "UPDATE {0} SET name = %s WHERE id = %s".format(table)
-        c.execute(query, (name, r_id))
-        print ("Name of {0} id '{1}' changed "
-               "to '{2}'.".format(table[0:-1], r_id, name))
-    # if status was provided, change it in the provided table
-    if status:
-        # Table is inserted separately as it needs to be inserted without
-        # quotes and is not provided by user (thus poses no security risk)
-        query = "UPDATE {0} SET status = %s WHERE id = %s".format(table)
-        c.execute(query, (status, r_id))
-        print ("Status of {0} id '{1}' changed "
-               "to '{2}'.".format(table[0:-1], r_id, status))
+    with s_connect() as db:
+        # check if provided id is valid
+        if s_isValidId(table, r_id) is False:
+            logger.warning("Invalid id '%s'!", r_id)
+            return None
+        # archived tournaments stay closed (see archiveTour)
+        if status and table == 'tournaments' and s_isArchived(r_id):
+            logger.warning("Tournament '%s' is archived!", r_id)
+            return None
 
-    db.commit()
-    c.close()
-    db.close()
+        c = db.cursor()
+
+        # if name was provided, change it in the provided table
+        if name:
+            # Table is inserted separately as it needs to be inserted without
+            # quotes and is not provided by user (thus poses no security risk)
+            query = "UPDATE {0} SET name = %s WHERE id = %s".format(table)
+            c.execute(query, (name, r_id))
+            logger.info("Name of %s id '%s' changed to '%s'.",
+                        table[0:-1], r_id, name)
+        # if status was provided, change it in the provided table
+        if status:
+            # Table is inserted separately as it needs to be inserted without
+            # quotes and is not provided by user (thus poses no security risk)
+            query = "UPDATE {0} SET status = %s WHERE id = %s".format(table)
+            c.execute(query, (status, r_id))
+            logger.info("Status of %s id '%s' changed to '%s'.",
+                        table[0:-1], r_id, status)
+
+        c.close()
+
+    # names of players appear in results cached for any tournament
+    if table == 'tournaments':
+        s_invalidateCache(r_id)
+    elif name:
+        s_invalidateCache()
+    return True
 
 
 def s_getStatusById(table, r_id):
@@ -147,18 +662,37 @@ def s_getStatusById(table, r_id):
     Returns:
         Status of record as string.
     """
-    db = s_connect()
-    c = db.cursor()
-    # Table is inserted separately as it needs to be inserted without
-    # quotes and is not provided by user (thus poses no security risk)
-    query = "SELECT status FROM {0} WHERE id = %s".format(table)
-    c.execute(query, (r_id,))
-    res = c.fetchone()[0]
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        # Table is inserted separately as it needs to be inserted without
+        # quotes and is not provided by user (thus poses no security risk)
+        query = "SELECT status FROM {0} WHERE id = %s".format(table)
+        c.execute(query, (r_id,))
+        res = c.fetchone()[0]
+        c.close()
     return res
 
 
+def s_isArchived(tour_id):
+    """Validate if given tournament is archived.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+    Returns:
+        boolean: True if tournament is archived, False otherwise.
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT archived FROM tournaments WHERE id = %s",
+                  (tour_id,))
+        res = c.fetchone()
+        c.close()
+
+    if res and res[0]:
+        return True
+    return False
+
+
 def s_isRegistered(tour_id, player_id):
     """Validate if given player is registered for given tournament.
 
@@ -168,19 +702,268 @@ def s_isRegistered(tour_id, player_id):
     Returns:
         boolean: True if player is registered, False otherwise.
     """
-    db = s_connect()
-    c = db.cursor()
-    c.execute("SELECT player_id FROM registrations "
-              "WHERE tour_id = %s AND player_id = %s", (tour_id, player_id))
-    res = c.fetchone()
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT player_id FROM registrations "
+                  "WHERE tour_id = %s AND player_id = %s",
+                  (tour_id, player_id))
+        res = c.fetchone()
+        c.close()
 
     if res:
         return True
     return False
 
 
+def s_checkTourPlayers(tour_id, player_ids, active=False, registered=True,
+                       lock=False):
+    """Validate a tournament and players for an operation in one query.
+
+    Status of the tournament is fetched together with the reason for
+    rejecting each of the provided players, so that validation of an
+    operation takes a single round trip regardless of the number of players.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+        player_ids: List of ID numbers of players as integers.
+        active: True if players are required to be 'active'.
+        registered: True if players are required to be registered for the
+                    tournament, False if they are required not to be.
+        lock: True to lock the row of the tournament until the end of the
+              transaction (status then cannot change before the operation
+              is committed and operations of the tournament are serialized).
+    Returns:
+        A tuple (tour_status, rejected):
+            tour_status: status of the tournament as string (None in case of
+                         invalid tour_id).
+            rejected: dictionary mapping ID of each player who failed
+                      validation to the reason as string ('invalid',
+                      'inactive', 'registered' or 'unregistered').
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        # The lock is the one taken by changes of registrations and matches
+        # (bumping revision of the tournament) anyway; taking it first
+        # avoids deadlocks of concurrent operations upgrading a weaker one.
+        c.execute("WITH t AS (SELECT id, status FROM tournaments "
+                  "WHERE id = %(tour_id)s {0}) "
+                  "SELECT t.status, i.id, "
+                  "CASE WHEN p.id IS NULL THEN 'invalid' "
+                  "WHEN %(active)s AND p.status != 'active' THEN 'inactive' "
+                  "WHEN %(registered)s AND r.player_id IS NULL "
+                  "THEN 'unregistered' "
+                  "WHEN NOT %(registered)s AND r.player_id IS NOT NULL "
+                  "THEN 'registered' "
+                  "END "
+                  "FROM (VALUES (%(tour_id)s::int)) AS q (tour_id) "
+                  "LEFT JOIN t ON t.id = q.tour_id "
+                  "LEFT JOIN unnest(%(ids)s::int[]) AS i (id) ON true "
+                  "LEFT JOIN players AS p ON p.id = i.id "
+                  "LEFT JOIN registrations AS r "
+                  "ON r.tour_id = q.tour_id AND r.player_id = i.id "
+                  "AND NOT r.archived".format(
+                      'FOR NO KEY UPDATE' if lock else ''),
+                  {'tour_id': tour_id, 'ids': list(player_ids),
+                   'active': active, 'registered': registered})
+        rows = c.fetchall()
+        c.close()
+
+    tour_status = rows[0][0]
+    rejected = dict((i, reason) for (s, i, reason) in rows
+                    if i is not None and reason is not None)
+    return tour_status, rejected
+
+
+def s_sameResult(result, other):
+    """Return True if two results (p1, s1, p2, s2) are the same match."""
+    return tuple(other) in (tuple(result), tuple(result[2:] + result[:2]))
+
+
+def s_reportedBefore(matches, player1_id, player1_score, player2_id,
+                     player2_score):
+    """Check a result submitted again against the matches recorded for it.
+
+    Args:
+        matches: List of tuples (match_id, pl1_id, pl1_score, pl2_id,
+                 pl2_score) of the match recorded for the same pairing and
+                 of the one recorded with the same idempotency key (once if
+                 it is the same match), in order of match_id.
+        player1_id, player1_score, player2_id, player2_score: The result
+               submitted again (as arguments of reportMatch).
+    Returns:
+        ItemStatus (match_id, 'duplicate') if a single match was found and
+        it has the same result (in any order of players), otherwise None.
+    """
+    if len(matches) > 1:
+        logger.warning("Pairing and idempotency key were reported as "
+                       "different matches (ids %s)!",
+                       ', '.join(str(m[0]) for m in matches))
+        return None
+    match = matches[0]
+    result = (player1_id, player1_score, player2_id, player2_score)
+    if not s_sameResult(match[1:], result):
+        logger.warning("Result was reported differently as match id '%s'!",
+                       match[0])
+        return None
+    logger.info("Match id '%s' already recorded.", match[0])
+    return ItemStatus(match[0], 'duplicate')
+
+
+def s_parseResults(results):
+    """Unpack results of matches as passed to reportMatches.
+
+    Args:
+        results: Iterable of tuples (player1_id, player1_score, player2_id,
+                 player2_score[, idempotency_key[, pairing_id]]).
+    Returns:
+        A list of tuples (p1, s1, p2, s2, key, pairing_id) (key and
+        pairing_id None if not provided, all None for a malformed result).
+    """
+    matches = []
+    for r in results:
+        try:
+            r = tuple(r)
+            (p1, s1, p2, s2, key, pairing_id) = r + (None,) * (6 - len(r))
+        except (TypeError, ValueError):
+            (p1, s1, p2, s2, key, pairing_id) = (None,) * 6
+        matches.append((p1, s1, p2, s2, key, pairing_id))
+    return matches
+
+
+def s_getPairingsOf(c, tour_id, matches):
+    """Read pairings for which results of matches are reported.
+
+    Args:
+        c: Cursor of the reporting transaction.
+        tour_id: ID number of tournament as integer.
+        matches: List of tuples (p1, s1, p2, s2, key, pairing_id) of valid
+                 results (see s_parseResults).
+    Returns:
+        A list of tuples (pairing_id, pl1_id, pl2_id, abandoned, open) of
+        the pairings provided with the results (open False) and the
+        pairings of the round started last still to be played by players of
+        the results (open True), as expected by s_linkPairings.
+    """
+    c.execute("SELECT p.id, p.pl1_id, p.pl2_id, p.abandoned, false "
+              "FROM pairings AS p "
+              "WHERE p.tour_id = %(tour_id)s AND p.id = ANY (%(ids)s::int[]) "
+              "UNION ALL "
+              "SELECT p.id, p.pl1_id, p.pl2_id, p.abandoned, true "
+              "FROM pairings AS p "
+              "WHERE p.tour_id = %(tour_id)s AND p.round = (SELECT max(round) "
+              "FROM rounds WHERE tour_id = %(tour_id)s) "
+              "AND NOT p.abandoned AND p.pl1_id = ANY (%(players)s::int[]) "
+              "AND NOT EXISTS (SELECT 1 FROM matchesRaw AS m "
+              "WHERE m.pairing_id = p.id) "
+              "ORDER BY 1",
+              {'tour_id': tour_id,
+               'ids': list(set(m[5] for m in matches if m[5] is not None)),
+               'players': list(set(m[i] for m in matches for i in (0, 2)))})
+    return c.fetchall()
+
+
+def s_linkPairings(matches, pairings):
+    """Link results of matches to the pairings they were played for.
+
+    A result reported without a pairing is linked to the pairing of the same
+    players within the round started last which has no match recorded yet
+    (and is not abandoned), so that the round ends once all its results are
+    reported (see startRound).
+
+    Args:
+        matches: List of tuples (p1, s1, p2, s2, key, pairing_id) of valid
+                 results (see s_parseResults).
+        pairings: Pairings of the results as returned by s_getPairingsOf.
+    Returns:
+        A list of tuples (pairing_id, status), one for each result:
+            pairing_id: ID of the pairing the match is recorded for (None if
+                        no pairing was provided and none is open)
+            status: None if the match can be recorded, 'invalid_pairing' if
+                    the provided pairing is not a pairing of the players in
+                    the tournament, 'abandoned' if it was abandoned
+    """
+    provided = dict((r[0], r) for r in pairings if not r[4])
+    # open pairings by players (not those provided with other results)
+    opened = {}
+    for (pairing_id, pl1_id, pl2_id, abandoned, is_open) in pairings:
+        if is_open and pairing_id not in provided:
+            opened.setdefault(tuple(sorted((pl1_id, pl2_id))),
+                              []).append(pairing_id)
+
+    res = []
+    for (p1, s1, p2, s2, key, pairing_id) in matches:
+        players = tuple(sorted((p1, p2)))
+        if pairing_id is None:
+            ids = opened.get(players)
+            res.append((ids.pop(0) if ids else None, None))
+            continue
+        pairing = provided.get(pairing_id)
+        if pairing is None or tuple(sorted(pairing[1:3])) != players:
+            res.append((pairing_id, 'invalid_pairing'))
+        elif pairing[3]:
+            res.append((pairing_id, 'abandoned'))
+        else:
+            res.append((pairing_id, None))
+    return res
+
+
+def s_existingResults(rows, keys, pairing_ids):
+    """Map idempotency keys and pairings to results recorded before.
+
+    Args:
+        rows: List of tuples (key, pairing_id, p1, s1, p2, s2) of matches
+              recorded with any of the keys or pairings.
+        keys: Idempotency keys of the batch which were not inserted.
+        pairing_ids: Pairings of the batch which were not inserted.
+    Returns:
+        A dictionary mapping ('key', key) and ('pairing', pairing_id) to
+        result (p1, s1, p2, s2) of the match recorded with it (as expected
+        by s_keyedStatuses).
+    """
+    existing = {}
+    for r in rows:
+        if r[0] is not None and r[0] in keys:
+            existing[('key', r[0])] = r[2:]
+        if r[1] is not None and r[1] in pairing_ids:
+            existing[('pairing', r[1])] = r[2:]
+    return existing
+
+
+def s_keyedStatuses(accepted, inserted, existing):
+    """Return status of each accepted result after inserting them at once.
+
+    Results whose idempotency key or pairing was recorded before (or earlier
+    within the same batch) were not inserted.
+
+    Args:
+        accepted: List of tuples (p1, s1, p2, s2, key, pairing_id) in order
+                  of the batch.
+        inserted: Set of tuples (key, pairing_id) of the inserted matches.
+        existing: Dictionary mapping ('key', key) and ('pairing', pairing_id)
+                  of each match recorded before to its result (p1, s1, p2,
+                  s2) (see s_existingResults).
+    Returns:
+        A list of statuses ('recorded' if inserted, 'duplicate' if the same
+        result was recorded before, 'conflict' if a different one was).
+    """
+    first = dict(existing)
+    statuses = []
+    for r in accepted:
+        (result, key, pairing_id) = (r[:4], r[4], r[5])
+        ids = [i for i in (('key', key), ('pairing', pairing_id))
+               if i[1] is not None]
+        recorded = [first[i] for i in ids if i in first]
+        if not recorded and (not ids or (key, pairing_id) in inserted):
+            for i in ids:
+                first[i] = result
+            statuses.append('recorded')
+        elif recorded and all(s_sameResult(m, result) for m in recorded):
+            statuses.append('duplicate')
+        else:
+            statuses.append('conflict')
+    return statuses
+
+
 # ADMIN FUNCTIONS
 # functions used only during testing - not for production
 
@@ -196,16 +979,14 @@ def a_deleteAllTours():
     registrations, matches and any related views (due to cascading in sql
     setup).
     """
-    db = s_connect()
-    c = db.cursor()
-
-    c.execute("DELETE FROM tournaments")
-
-    db.commit()
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("DELETE FROM tournaments")
+        c.close()
+    s_clearOpponentIndexes()
+    s_invalidateCache()
 
-    print "All tournaments deleted."
+    logger.info("All tournaments deleted.")
 
 
 def a_deleteAllPlayers():
@@ -219,16 +1000,14 @@ def a_deleteAllPlayers():
     registrations, matches and any related views (due to cascading in sql
     setup).
     """
-    db = s_connect()
-    c = db.cursor()
-
-    c.execute("DELETE FROM players")
-
-    db.commit()
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("DELETE FROM players")
+        c.close()
+    s_clearOpponentIndexes()
+    s_invalidateCache()
 
-    print "All players deleted."
+    logger.info("All players deleted.")
 
 
 def a_deleteAllRegistrations():
@@ -238,21 +1017,20 @@ def a_deleteAllRegistrations():
     allowed to delete more than one player or tournament from table
     'registrations' at a time.
     """
-    db = s_connect()
-    c = db.cursor()
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("DELETE FROM registrations")
+        c.close()
+    s_clearOpponentIndexes()
+    s_invalidateCache()
 
-    c.execute("DELETE FROM registrations")
-
-    db.commit()
-    c.close()
-    db.close()
-
-    print "All registrations deleted."
+    logger.info("All registrations deleted.")
 
 
 # USER FUNCTIONS
 
 
+@instrumented
 def createNewTour(name):
     """Add a new tournament to table 'tournaments'.
 
@@ -261,44 +1039,120 @@ def createNewTour(name):
 
     Args:
         name: Complete name of the tournament (need not be unique).
+    Returns:
+        ID number of the new tournament as integer.
     """
-    db = s_connect()
-    c = db.cursor()
+    with s_connect() as db:
+        c = db.cursor()
+
+        c.execute("INSERT INTO tournaments (name, status) "
+                  "VALUES (%s, 'planned') RETURNING id", (name, ))
+
+        tour_id = c.fetchone()[0]
+
+        c.close()
 
-    c.execute("INSERT INTO tournaments (name, status) "
-              "VALUES (%s, 'planned')", (name, ))
-    c.execute("SELECT id FROM tournaments ORDER BY id DESC")
+    logger.info("Tournament '%s' created with the following id: '%s'.",
+                name, tour_id)
+    return tour_id
 
-    tour_id = c.fetchone()[0]
 
-    db.commit()
-    c.close()
-    db.close()
+@instrumented
+def createNewTours(names):
+    """Add multiple tournaments to table 'tournaments' at once.
 
-    print ("Tournament '{0}' created with the following "
-           "id: '{1}'.".format(name, tour_id))
+    All tournaments are inserted by one statement; each gets an id and
+    'planned' status the same way as by createNewTour.
 
+    Args:
+        names: List of complete names of the tournaments.
+    Returns:
+        A list of ID numbers of the new tournaments (in order of names).
+    """
+    tour_ids = s_createTP('tournaments', 'planned', names)
+    logger.info("%s tournaments created.", len(tour_ids))
+    return tour_ids
 
+
+@instrumented
 def changeTourName(tour_id, new_name):
     """Change name of tournament in the tournaments table.
 
     Args:
         tour_id: ID of tournament to be edited as string.
         new_name: New complete name of tournament as string.
+    Returns:
+        True upon success, None in case of invalid id.
     """
-    s_editTP('tournaments', tour_id, name=new_name)
+    return s_editTP('tournaments', tour_id, name=new_name)
 
 
+@instrumented
 def changeTourStatus(tour_id, new_status):
     """Change status of tournament in the tournaments table.
 
     Args:
         tour_id: ID of tournament to be edited as string.
         new_status: New status of tournament as string.
+    Returns:
+        True upon success, None in case of invalid id or archived
+        tournament.
     """
-    s_editTP('tournaments', tour_id, status=new_status)
+    return s_editTP('tournaments', tour_id, status=new_status)
 
 
+@instrumented
+def archiveTour(tour_id):
+    """Move a closed tournament to the archived partitions.
+
+    Registrations and matches of the tournament (and the pairings and
+    statistics referencing them) are moved from the live partitions of their
+    tables to the archived ones in one transaction, so that queries of live
+    tournaments no longer read them. Standings and pairings of the
+    tournament can still be read; its status cannot be changed any more.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+    Returns:
+        True upon success, None in case of invalid id or a tournament which
+        is not closed or already archived.
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT status, archived FROM tournaments WHERE id = %s "
+                  "FOR UPDATE", (tour_id,))
+        res = c.fetchone()
+        if res is None:
+            c.close()
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        if res[1]:
+            c.close()
+            logger.warning("Tournament '%s' is already archived!", tour_id)
+            return None
+        if res[0] != 'closed':
+            c.close()
+            logger.warning("Unable to archive tournament '%s' with status "
+                           "'%s'!", tour_id, res[0])
+            return None
+        c.execute("UPDATE tournaments SET archived = true WHERE id = %s",
+                  (tour_id,))
+        # matches first, the registrations they reference are checked at
+        # commit; pairings and statistics follow registrations by cascade
+        c.execute("UPDATE matchesRaw SET archived = true "
+                  "WHERE tour_id = %s AND NOT archived", (tour_id,))
+        matches = c.rowcount
+        c.execute("UPDATE registrations SET archived = true "
+                  "WHERE tour_id = %s AND NOT archived", (tour_id,))
+        c.close()
+    s_invalidateCache(tour_id)
+
+    logger.info("Tournament '%s' archived (%s matches moved).", tour_id,
+                matches)
+    return True
+
+
+@instrumented
 def countTours(*status):
     """Count tournaments (either all or by status).
 
@@ -315,6 +1169,7 @@ def countTours(*status):
     return s_countTP('t', *status)
 
 
+@instrumented
 def createNewPlayer(name):
     """Add a new player to table 'players'.
 
@@ -323,44 +1178,68 @@ def createNewPlayer(name):
 
     Args:
         name: Full name of the player (need not be unique).
+    Returns:
+        ID number of the new player as integer.
     """
-    db = s_connect()
-    c = db.cursor()
+    with s_connect() as db:
+        c = db.cursor()
+
+        c.execute("INSERT INTO players (name, status) "
+                  "VALUES (%s, 'active') RETURNING id", (name, ))
+
+        player_id = c.fetchone()[0]
 
-    c.execute("INSERT INTO players (name, status) "
-              "VALUES (%s, 'active')", (name, ))
-    c.execute("SELECT id FROM players ORDER BY id DESC")
+        c.close()
 
-    player_id = c.fetchone()[0]
+    logger.info("Player '%s' created with the following id: '%s'.",
+                name, player_id)
+    return player_id
 
-    db.commit()
-    c.close()
-    db.close()
 
-    print ("Player '{0}' created with the following "
-           "id: '{1}'.".format(name, player_id))
+@instrumented
+def createNewPlayers(names):
+    """Add multiple players to table 'players' at once.
 
+    All players are inserted by one statement; each gets an id and 'active'
+    status the same way as by createNewPlayer.
 
+    Args:
+        names: List of full names of the players.
+    Returns:
+        A list of ID numbers of the new players (in order of names).
+    """
+    player_ids = s_createTP('players', 'active', names)
+    logger.info("%s players created.", len(player_ids))
+    return player_ids
+
+
+@instrumented
 def changePlayerName(player_id, new_name):
     """Change name of player in the players table.
 
     Args:
         player_id: ID of player to be edited as string.
         new_name: New full name of player as string.
+    Returns:
+        True upon success, None in case of invalid id.
     """
-    s_editTP('players', player_id, name=new_name)
+    return s_editTP('players', player_id, name=new_name)
 
 
+@instrumented
 def changePlayerStatus(player_id, new_status):
     """Change status of player in the players table.
 
     Args:
         player_id: ID of player to be edited as string.
         new_status: New status of player as string.
+    Returns:
+        True upon success, None in case of invalid id.
     """
-    s_editTP('players', player_id, status=new_status)
+    return s_editTP('players', player_id, status=new_status)
 
 
+@instrumented
 def countPlayers(*status):
     """Count players (either all or by status/es).
 
@@ -377,50 +1256,83 @@ def countPlayers(*status):
     return s_countTP('p', *status)
 
 
+@instrumented
 def registerPlayers(tour_id, *player_id):
     """Register one or multiple players for provided tournament.
 
     Restrictions:
         - tournament must have status 'planned'.
         - players must be 'active'.
+        - players already registered for the tournament are skipped.
 
     Args:
         tour_id: ID number of tournament for which players are being
                  registered as integer
         *player_id: ID number for each player to be registered for a
                      provided tournament.
+    Returns:
+        A list of ItemStatus (player_id, status), one for each of the
+        provided players (duplicates omitted) in the provided order, status
+        being 'registered' or the reason why the player was not registered
+        ('invalid', 'inactive' or 'already_registered'). None in case of
+        invalid tour_id or tournament not in 'planned' phase.
     """
-    # Check if provided tour_id is valid.
-    if s_isValidId('tournaments', tour_id) is False:
-        print "Invalid tournament id '{0}'!".format(tour_id)
-        return None
-    # Check if tournament is of status 'planned'
-    if s_getStatusById('tournaments', tour_id) != 'planned':
-        print ("Unable to register for tournament id '{0}'! Tournament no "
-               "longer in 'planned' phase.".format(tour_id))
-        return None
-    db = s_connect()
-    c = db.cursor()
+    # drop duplicate ids (keeping the order in which they were provided)
+    unique_ids, seen = [], set()
     for p in player_id:
-        # Check if provided player id is valid.
-        if s_isValidId('players', p) is False:
-            print "Invalid player id '{0}'!".format(p)
-            continue
-        # Check if player is of status 'active'.
-        if s_getStatusById('players', p) != 'active':
-            print ("Unable to register player id '{0}'! Player "
-                   "inactive.".format(p))
-            continue
-        # If both checks passed, register player (if not already registered)
-        c.execute("INSERT INTO registrations (tour_id, player_id) "
-                  "VALUES (%s, %s)", (tour_id, p))
-        print ("Player id '{0}' registered for tournament "
-               "id '{1}'.".format(p, tour_id))
-    db.commit()
-    c.close()
-    db.close()
+        if p not in seen:
+            seen.add(p)
+            unique_ids.append(p)
+    player_id = unique_ids
+
+    with s_connect() as db:
+        # Check tournament and all players at once.
+        tour_status, rejected = s_checkTourPlayers(tour_id, player_id,
+                                                   active=True,
+                                                   registered=False)
+        # Check if provided tour_id is valid.
+        if tour_status is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        # Check if tournament is of status 'planned'
+        if tour_status != 'planned':
+            logger.warning("Unable to register for tournament id '%s'! "
+                           "Tournament no longer in 'planned' phase.",
+                           tour_id)
+            return None
+        res = []
+        accepted = []
+        for p in player_id:
+            if rejected.get(p) == 'invalid':
+                logger.warning("Invalid player id '%s'!", p)
+                res.append(ItemStatus(p, 'invalid'))
+            elif rejected.get(p) == 'inactive':
+                logger.warning("Unable to register player id '%s'! Player "
+                               "inactive.", p)
+                res.append(ItemStatus(p, 'inactive'))
+            elif rejected.get(p) == 'registered':
+                logger.info("Player id '%s' already registered for "
+                            "tournament id '%s'.", p, tour_id)
+                res.append(ItemStatus(p, 'already_registered'))
+            else:
+                accepted.append(p)
+                res.append(ItemStatus(p, 'registered'))
+        # Register all players who passed the checks at once.
+        if accepted:
+            c = db.cursor()
+            c.execute("INSERT INTO registrations (tour_id, player_id) "
+                      "SELECT %s, unnest(%s::int[])", (tour_id, accepted))
+            c.close()
+        if logger.isEnabledFor(logging.INFO):
+            for p in accepted:
+                logger.info("Player id '%s' registered for tournament "
+                            "id '%s'.", p, tour_id)
+
+    s_invalidateCache(tour_id)
+    return res
 
 
+@instrumented
 def countRegPlayers(tour_id):
     """Count players registered to the provided tournament.
 
@@ -430,16 +1342,16 @@ def countRegPlayers(tour_id):
         An integer indicating current number of players registered to the
         provided tournament.
     """
-    db = s_connect()
-    c = db.cursor()
-    c.execute("SELECT count(*) FROM registrations "
-              "WHERE tour_id = %s", (tour_id,))
-    res = c.fetchone()[0]
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT count(*) FROM registrations "
+                  "WHERE tour_id = %s", (tour_id,))
+        res = c.fetchone()[0]
+        c.close()
     return res
 
 
+@instrumented
 def deregisterPlayers(tour_id, *player_id):
     """Deregister one, multiple, or all players of provided tournament.
 
@@ -454,48 +1366,84 @@ def deregisterPlayers(tour_id, *player_id):
         tour_id: ID number of tournament as integer.
         *player_id: (optional) ID number of player/s to be deregistered as
                     integer
+    Returns:
+        A list of ItemStatus (player_id, status), status being
+        'deregistered' or the reason why the player was not deregistered
+        ('invalid' or 'unregistered'), one for each of the provided players
+        (or for each deregistered player if no player_id was provided). None
+        in case of invalid tour_id or tournament not in 'planned' phase.
     """
-    # Check if provided tour_id is valid.
-    if s_isValidId('tournaments', tour_id) is False:
-        print "Invalid tournament id '{0}'!".format(tour_id)
-        return None
-    # Check if tournament is of status 'planned'
-    if s_getStatusById('tournaments', tour_id) != 'planned':
-        print ("Unable to change registrations for tournament id '{0}'! "
-               "Tournament no longer in 'planned' phase.".format(tour_id))
-        return None
-    db = s_connect()
-    c = db.cursor()
-    if player_id:
-        for p in player_id:
-            # Check if provided id is valid.
-            if s_isValidId('players', p) is False:
-                print "Invalid player id '{0}'!".format(p)
-                continue
+    with s_connect() as db:
+        # Check tournament and all players at once.
+        tour_status, rejected = s_checkTourPlayers(tour_id, player_id)
+        # Check if provided tour_id is valid.
+        if tour_status is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        # Check if tournament is of status 'planned'
+        if tour_status != 'planned':
+            logger.warning("Unable to change registrations for tournament "
+                           "id '%s'! Tournament no longer in 'planned' "
+                           "phase.", tour_id)
+            return None
+        c = db.cursor()
+        if player_id:
+            res = []
+            accepted = []
+            for p in player_id:
+                # Check if provided id is valid and registered.
+                if rejected.get(p) == 'invalid':
+                    logger.warning("Invalid player id '%s'!", p)
+                    res.append(ItemStatus(p, 'invalid'))
+                elif rejected.get(p) == 'unregistered':
+                    logger.info("Player id '%s' not registered for "
+                                "tournament id '%s'.", p, tour_id)
+                    res.append(ItemStatus(p, 'unregistered'))
+                else:
+                    accepted.append(p)
+                    res.append(ItemStatus(p, 'deregistered'))
             c.execute("DELETE FROM registrations WHERE tour_id = %s "
-                      "AND player_id = %s", (tour_id, p))
-            print ("Player id '{0}'' deregistered from tournament "
-                   "id '{1}'".format(p, tour_id))
-    else:
-        c.execute("DELETE FROM registrations WHERE tour_id = %s", (tour_id,))
-        print ("All players of tournament id '{0}' "
-               "deregistered.".format(tour_id))
-    db.commit()
-    c.close()
-    db.close()
+                      "AND player_id = ANY (%s::int[])", (tour_id, accepted))
+            if logger.isEnabledFor(logging.INFO):
+                for p in accepted:
+                    logger.info("Player id '%s' deregistered from "
+                                "tournament id '%s'.", p, tour_id)
+        else:
+            c.execute("DELETE FROM registrations WHERE tour_id = %s "
+                      "RETURNING player_id", (tour_id,))
+            res = [ItemStatus(r[0], 'deregistered') for r in c.fetchall()]
+            logger.info("All players of tournament id '%s' deregistered.",
+                        tour_id)
+        c.close()
+
+    s_invalidateCache(tour_id)
+    return res
 
 
-def tournamentStandings(tour_id):
+@instrumented
+def tournamentStandings(tour_id, tiebreaks=None):
     """Return a list of the players and their match records, sorted by wins.
 
     The first entry in the list is the player in first place, or a
     player tied for first place if there is currently a tie.
 
+    Players with equal wins and draws are ranked by OMW unless other
+    tiebreaks are requested. Requested tiebreaks are computed all at once
+    from the index of opponents of the tournament (see tiebreaks.py, NumPy is
+    required) and appended to each row in the requested order.
+
+    Standings are cached until the tournament changes (see s_getRevision).
+
     Args:
         tour_id: ID number of tournament as integer.
+        tiebreaks: (optional) List of names of tiebreaks by which players
+                   with equal wins and draws are ranked, in order of
+                   precedence (any of 'omw', 'buchholz', 'median_buchholz',
+                   'sonneborn_berger' and 'omw_pct').
     Returns:
         A list of tuples, each of which contains (tour_id, player_id, name,
-        matches, wins, draws, byes):
+        matches, wins, draws, byes, omw) followed by the requested
+        tiebreaks:
             tour_id: ID number of tournament
             id: the player's unique ID (assigned by the database)
             name: the player's full name (as registered)
@@ -503,23 +1451,246 @@ def tournamentStandings(tour_id):
             wins: the number of matches the player has won
             draws: the number of matches which resulted in a draw
             byes: the number of matches in which the player received a bye
+            omw: the number of wins of the player's opponents
     """
-    # Check if provided tour_id is valid.
-    if s_isValidId('tournaments', tour_id) is False:
-        print "Invalid tournament id '{0}'!".format(tour_id)
-        return None
+    if tiebreaks:
+        from tiebreaks import TIEBREAKS, computeTiebreaks
+        invalid = [t for t in tiebreaks if t not in TIEBREAKS]
+        if invalid:
+            logger.warning("Invalid tiebreak/s: %s!", invalid)
+            return None
 
-    db = s_connect()
-    c = db.cursor()
-    c.execute("SELECT * FROM v_tourStandings WHERE tour_id = %s", (tour_id,))
-    res = c.fetchall()
-    c.close()
-    db.close()
+    key = ('standings', tour_id, tuple(tiebreaks or ()))
+    with s_connect() as db:
+        # Check if provided tour_id is valid (and get its revision).
+        revision = s_getRevision(tour_id)
+        if revision is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        cacheable = s_isCacheable()
+        if cacheable:
+            res = _cache.get(key, revision)
+            if res is not None:
+                return list(res)
+
+        c = db.cursor()
+        c.execute("SELECT * FROM v_tourStandings WHERE tour_id = %s",
+                  (tour_id,))
+        res = c.fetchall()
+        c.close()
+        if tiebreaks:
+            index = s_getOpponentIndex(tour_id, cacheable)
+
+    if tiebreaks:
+        values = computeTiebreaks(index, [r[1] for r in res], tiebreaks)
+        res = [r + values[r[1]] for r in res]
+        # by wins, draws and then by tiebreaks (all descending)
+        res.sort(key=lambda r: [-v for v in (r[4], r[5]) + r[8:]])
+
+    if cacheable:
+        _cache.put(key, revision, res)
+    return list(res)
+
+
+# numbers of server-side cursors of iterStandings (names have to be unique
+# within a connection)
+_cursor_ids = itertools.count(1)
+
+
+@instrumented
+def iterStandings(tour_id, batch_size=1000):
+    """Iterate over the players and their match records, sorted by wins.
+
+    Unlike tournamentStandings, the standings are not read all at once but
+    by a server-side cursor fetching batch_size rows per round trip, so the
+    first rows are available quickly and memory use does not depend on the
+    number of players. The rows are read in one transaction on a pooled
+    connection of its own held until the iteration ends (or the iterator is
+    closed), so other calls made meanwhile (e.g. reporting a match) run in
+    their own transactions on another connection.
 
+    Args:
+        tour_id: ID number of tournament as integer.
+        batch_size: (optional) Number of rows fetched at once.
+    Returns:
+        An iterator of tuples (tour_id, player_id, name, matches, wins,
+        draws, byes, omw) as returned by tournamentStandings (without
+        tiebreaks) or None if the tournament does not exist.
+    """
+    if not s_isValidId('tournaments', tour_id):
+        logger.warning("Invalid tournament id '%s'!", tour_id)
+        return None
+    return s_iterStandings(tour_id, batch_size)
+
+
+def s_iterStandings(tour_id, batch_size):
+    """Yield rows of standings of a tournament (see iterStandings)."""
+    # not shared, the thread might make other calls between the rows
+    with s_connect(shared=False) as db:
+        c = db.cursor('standings_{0}'.format(next(_cursor_ids)))
+        c.itersize = batch_size
+        try:
+            c.execute("SELECT * FROM v_tourStandings WHERE tour_id = %s",
+                      (tour_id,))
+            for row in c:
+                yield row
+        finally:
+            if not db.closed:
+                c.close()
+
+
+@instrumented
+def standingsPage(tour_id, after=None, limit=50):
+    """Return a page of the players and their match records, sorted by wins.
+
+    Pages are read by keyset (rows following the last row of the previous
+    page in order of standings), so reading any page takes the same time
+    regardless of how many rows precede it. Consecutive pages are read in
+    separate transactions; rows of players whose records change in between
+    might be skipped or repeated.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+        after: (optional) Last row of the previous page (the first page is
+               returned by default).
+        limit: (optional) Maximum number of rows of the page.
+    Returns:
+        A list of at most limit tuples (tour_id, player_id, name, matches,
+        wins, draws, byes, omw) as returned by tournamentStandings (without
+        tiebreaks); an empty list after the last page.
+    """
+    with s_connect() as db:
+        if not s_isValidId('tournaments', tour_id):
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        c = db.cursor()
+        if after is None:
+            c.execute("SELECT * FROM v_tourStandings WHERE tour_id = %s "
+                      "LIMIT %s", (tour_id, limit))
+        else:
+            # same order as of the standings index (all columns descending)
+            c.execute("SELECT * FROM v_tourStandings WHERE tour_id = %s "
+                      "AND (wins, draws, omw, player_id) < (%s, %s, %s, %s) "
+                      "LIMIT %s",
+                      (tour_id, after[4], after[5], after[7], after[1],
+                       limit))
+        res = c.fetchall()
+        c.close()
     return res
 
 
-def reportMatch(tour_id, player1_id, player1_score, player2_id, player2_score):
+@instrumented
+def checkpointStandings(tour_id):
+    """Take a checkpoint of statistics of a tournament.
+
+    The checkpoint holds a snapshot of the statistics of all registered
+    players as of the last match recorded so far. Statistics rebuilt later
+    (see rebuildStandings) start from it and replay only the matches
+    recorded since, e.g. after each round. Matches of the tournament cannot
+    be recorded while the snapshot is taken.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+    Returns:
+        ID number of the last match included in the checkpoint as integer.
+    """
+    with s_connect() as db:
+        if not s_isValidId('tournaments', tour_id):
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        c = db.cursor()
+        c.execute("SELECT checkpoint_player_tour_stats(%s)", (tour_id,))
+        last_match_id = c.fetchone()[0]
+        c.close()
+
+    logger.info("Checkpoint of tournament '%s' taken at match '%s'.",
+                tour_id, last_match_id)
+    return last_match_id
+
+
+def s_rebuildStandings(c, tour_id):
+    """Rebuild statistics of a tournament and return them with replay count.
+
+    Args:
+        c: Cursor of the transaction to rebuild in.
+        tour_id: ID number of tournament as integer.
+    Returns:
+        A tuple (replayed, stats) of number of replayed matches and a
+        dictionary mapping id of each player to a tuple (matches, wins,
+        draws, byes, omw) as rebuilt.
+    """
+    c.execute("SELECT rebuild_player_tour_stats(%s)", (tour_id,))
+    replayed = c.fetchone()[0]
+    return replayed, s_statsOf(c, tour_id)
+
+
+def s_statsOf(c, tour_id):
+    """Return statistics of all players of a tournament by player id."""
+    c.execute("SELECT player_id, matches, wins, draws, byes, omw "
+              "FROM player_tour_stats WHERE tour_id = %s", (tour_id,))
+    return dict((row[0], tuple(row[1:])) for row in c.fetchall())
+
+
+@instrumented
+def rebuildStandings(tour_id):
+    """Rebuild statistics of a tournament from its checkpoint.
+
+    Statistics are restored from the last checkpoint (see
+    checkpointStandings) and the matches recorded since are replayed in
+    order, so the work depends on the number of matches after the checkpoint
+    only. Without a checkpoint all matches are recomputed. Matches of the
+    tournament cannot be recorded meanwhile.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+    Returns:
+        Number of replayed matches as integer.
+    """
+    with s_connect() as db:
+        if not s_isValidId('tournaments', tour_id):
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        c = db.cursor()
+        replayed = s_rebuildStandings(c, tour_id)[0]
+        c.close()
+    s_invalidateCache(tour_id)
+
+    logger.info("Statistics of tournament '%s' rebuilt (%s matches "
+                "replayed).", tour_id, replayed)
+    return replayed
+
+
+@instrumented
+def auditStandings(tour_id):
+    """Compare statistics of a tournament with those rebuilt from matches.
+
+    Statistics are rebuilt as by rebuildStandings and compared with the
+    current ones; the rebuilt statistics are discarded afterwards.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+    Returns:
+        A sorted list of IDs of players whose current statistics differ from
+        the rebuilt ones (an empty list if all of them are correct).
+    """
+    with s_connect() as db:
+        if not s_isValidId('tournaments', tour_id):
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
+        c = db.cursor()
+        c.execute("SAVEPOINT audit")
+        current = s_statsOf(c, tour_id)
+        rebuilt = s_rebuildStandings(c, tour_id)[1]
+        c.execute("ROLLBACK TO SAVEPOINT audit")
+        c.close()
+
+    return sorted(player_id for player_id in set(current) | set(rebuilt)
+                  if current.get(player_id) != rebuilt.get(player_id))
+
+
+@instrumented
+def reportMatch(tour_id, player1_id, player1_score, player2_id, player2_score,
+                pairing_id=None, idempotency_key=None):
     """Record the outcome of a single match.
 
     Each player gets assigned a score based on which the winner is determined
@@ -530,9 +1701,20 @@ def reportMatch(tour_id, player1_id, player1_score, player2_id, player2_score):
     assigned. A bye is recorded when player1_id and player2_id are equal and
     counts as a (free) win (equal to regular win in standings).
 
+    Reports of one tournament are serialized (by a lock of the tournament
+    held until the match is committed), so a match is never recorded after
+    the tournament got closed. Result of a pairing (or with an idempotency
+    key) is recorded only once: the same result submitted again (e.g. retried
+    by a client or sent by another scorer) is not recorded again and the id
+    of the recorded match is returned as a duplicate.
+
     restrictions:
         - tournament must have status 'ongoing'.
-        - players must be registered to given tournament (handled by db).
+        - players must be registered to given tournament.
+        - pairing (if provided) must be a pairing of the same players within
+          given tournament which was not abandoned.
+        - result of the same pairing or idempotency key must not have been
+          reported differently before.
 
     Args:
         tour_id: ID number of tournament as integer.
@@ -540,82 +1722,568 @@ def reportMatch(tour_id, player1_id, player1_score, player2_id, player2_score):
         player1_score: score of the first player as integer.
         player2_id: ID number of the second player as integer.
         player2_score: score of the second player as integer.
+        pairing_id: (optional) ID number of the pairing (see startRound) the
+                    match was played for (by default the pairing of the
+                    players in the round started last, if it has no match
+                    recorded yet).
+        idempotency_key: (optional) String chosen by the client identifying
+                         the result within the tournament (e.g. a random
+                         UUID kept for retries of the same submission).
+    Returns:
+        ItemStatus (match_id, status) (None if the match was rejected):
+            match_id: ID number of the recorded match
+            status: 'recorded' if the match was recorded by this call,
+                    'duplicate' if it was recorded before
     """
-    # Check if provided tour_id is valid.
-    if s_isValidId('tournaments', tour_id) is False:
-        print "Invalid id '{0}'!".format(tour_id)
-        return None
-    # Check if tournament is of status 'ongoing'
-    if s_getStatusById('tournaments', tour_id) != 'ongoing':
-        print ("Unable to report a match for tournament id '{0}'! Tournament "
-               "needs to be 'ongoing' to report results.".format(tour_id))
-        return None
-    for p in (player1_id, player2_id):
-        # Check if provided player_id is valid.
-        if s_isValidId('players', p) is False:
-            print "Invalid player id '{0}'!".format(p)
+    with s_connect() as db:
+        # Check tournament and both players at once.
+        tour_status, rejected = s_checkTourPlayers(
+            tour_id, (player1_id, player2_id), lock=True)
+        # Check if provided tour_id is valid.
+        if tour_status is None:
+            logger.warning("Invalid id '%s'!", tour_id)
+            return None
+        # Check if tournament is of status 'ongoing'
+        if tour_status != 'ongoing':
+            logger.warning("Unable to report a match for tournament id '%s'! "
+                           "Tournament needs to be 'ongoing' to report "
+                           "results.", tour_id)
+            return None
+        for p in (player1_id, player2_id):
+            # Check if provided player_id is valid.
+            if rejected.get(p) == 'invalid':
+                logger.warning("Invalid player id '%s'!", p)
+                return None
+            # Check if player is registered for the tournament.
+            if rejected.get(p) == 'unregistered':
+                logger.warning("Player id '%s' not registered for "
+                               "tournament id '%s'!", p, tour_id)
+                return None
+
+        c = db.cursor()
+        # Check if provided pairing is the pairing of the players (or find
+        # the open pairing of the players).
+        match = (player1_id, player1_score, player2_id, player2_score,
+                 idempotency_key, pairing_id)
+        (pairing_id, status) = s_linkPairings(
+            [match], s_getPairingsOf(c, tour_id, [match]))[0]
+        if status == 'invalid_pairing':
+            logger.warning("Invalid pairing id '%s'!", pairing_id)
+            c.close()
             return None
+        if status == 'abandoned':
+            logger.warning("Pairing id '%s' was abandoned!", pairing_id)
+            c.close()
+            return None
+        # A result of a pairing or idempotency key is recorded only once
+        # (both are unique).
+        c.execute("INSERT INTO matchesRaw "
+                  "(tour_id, pl1_id, pl1_score, pl2_id, pl2_score, "
+                  "pairing_id, idempotency_key) "
+                  "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                  "ON CONFLICT DO NOTHING "
+                  "RETURNING id, pl1_id, pl2_id, winner_id",
+                  (tour_id, player1_id, player1_score,
+                   player2_id, player2_score, pairing_id, idempotency_key))
+        recorded = c.fetchall()
+        if not recorded:
+            # the match of the pairing and the match of the key (the same
+            # one if the result was submitted before)
+            c.execute("SELECT id, pl1_id, pl1_score, pl2_id, pl2_score "
+                      "FROM matchesRaw WHERE pairing_id = %s "
+                      "UNION "
+                      "SELECT id, pl1_id, pl1_score, pl2_id, pl2_score "
+                      "FROM matchesRaw "
+                      "WHERE tour_id = %s AND idempotency_key = %s "
+                      "ORDER BY id",
+                      (pairing_id, tour_id, idempotency_key))
+            matches = c.fetchall()
+            c.close()
+            if not matches:
+                # the conflicting match is gone (e.g. deleted meanwhile)
+                logger.warning("Unable to report a match for tournament id "
+                               "'%s'! Conflicting match not found, the "
+                               "match needs to be reported again.", tour_id)
+                return None
+            return s_reportedBefore(matches, player1_id, player1_score,
+                                    player2_id, player2_score)
+        c.close()
+        committed = s_isCacheable()
+
+    s_addToOpponentIndex(tour_id, recorded, committed)
+    s_invalidateCache(tour_id)
+    logger.info("Match id '%s' recorded for tournament id '%s'.",
+                recorded[0][0], tour_id)
+    return ItemStatus(recorded[0][0], 'recorded')
 
-    db = s_connect()
-    c = db.cursor()
-    query = "INSERT INTO matchesRaw VALUES (default, %s, %s, %s, %s, %s)"
-    c.execute(
-        query, (tour_id, player1_id, player1_score, player2_id, player2_score)
-    )
-    db.commit()
-    c.close()
-    db.close()
 
+@instrumented
+def reportMatches(tour_id, results):
+    """Record the outcome of multiple matches (e.g. a whole round) at once.
 
+    The whole batch is validated by a single query and all accepted matches
+    are recorded by one multi-row insert within one transaction. Winners,
+    draws and byes are determined the same way as by reportMatch.
+
+    Results are linked to pairings the same way as by reportMatch. Results
+    with an idempotency key or a pairing already recorded (before or earlier
+    in the batch) are not recorded again, so a batch can be retried as a
+    whole.
+
+    restrictions:
+        - tournament must have status 'ongoing'.
+        - players must be registered to given tournament (matches of other
+          players are rejected).
+        - pairing (if provided) must be a pairing of the same players within
+          given tournament which was not abandoned.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+        results: Iterable of tuples (player1_id, player1_score, player2_id,
+                 player2_score[, idempotency_key[, pairing_id]]) with the
+                 same meaning as the arguments of reportMatch.
+    Returns:
+        A list of MatchStatus (player1_id, player2_id, status), one for each
+        of the provided results (in the same order):
+            player1_id: ID number of the first player
+            player2_id: ID number of the second player
+            status: 'recorded' if the match was recorded, 'duplicate' if
+                    the same result with the same idempotency key or
+                    pairing was recorded before, otherwise the reason why
+                    it was rejected ('malformed', 'invalid', 'unregistered',
+                    'invalid_pairing', 'abandoned' or 'conflict' for a
+                    different result with the key or pairing)
+    """
+    matches = s_parseResults(results)
+    player_ids = set(m[i] for m in matches for i in (0, 2) if m[i] is not None)
+
+    with s_connect() as db:
+        # Check tournament and all players of the batch at once.
+        tour_status, rejected = s_checkTourPlayers(tour_id, player_ids,
+                                                   lock=True)
+        # Check if provided tour_id is valid.
+        if tour_status is None:
+            logger.warning("Invalid id '%s'!", tour_id)
+            return None
+        # Check if tournament is of status 'ongoing'
+        if tour_status != 'ongoing':
+            logger.warning("Unable to report matches for tournament id "
+                           "'%s'! Tournament needs to be 'ongoing' to report "
+                           "results.", tour_id)
+            return None
+
+        res = []
+        accepted = []
+        for m in matches:
+            (p1, s1, p2, s2) = m[:4]
+            if None in (p1, s1, p2, s2):
+                status = 'malformed'
+            else:
+                status = rejected.get(p1) or rejected.get(p2) or 'recorded'
+            if status == 'recorded':
+                accepted.append((len(res), m))
+            res.append(MatchStatus(p1, p2, status))
+
+        recorded = []
+        c = db.cursor()
+        if accepted:
+            links = s_linkPairings([m for (i, m) in accepted],
+                                   s_getPairingsOf(c, tour_id,
+                                                   [m for (i, m) in accepted]))
+            linked = []
+            for ((i, m), (pairing_id, status)) in zip(accepted, links):
+                if status is None:
+                    linked.append((i, m[:5] + (pairing_id,)))
+                else:
+                    res[i] = res[i]._replace(status=status)
+            accepted = linked
+        if accepted:
+            recorded = psycopg2.extras.execute_values(
+                c, "INSERT INTO matchesRaw "
+                   "(tour_id, pl1_id, pl1_score, pl2_id, pl2_score, "
+                   "idempotency_key, pairing_id) "
+                   "VALUES %s ON CONFLICT DO NOTHING "
+                   "RETURNING id, pl1_id, pl2_id, winner_id, "
+                   "idempotency_key, pairing_id",
+                [(tour_id,) + m for (i, m) in accepted],
+                page_size=1000, fetch=True)
+            keys = (set(m[4] for (i, m) in accepted if m[4] is not None) -
+                    set(r[4] for r in recorded))
+            pairing_ids = (set(m[5] for (i, m) in accepted
+                               if m[5] is not None) -
+                           set(r[5] for r in recorded))
+            existing = {}
+            if keys or pairing_ids:
+                c.execute("SELECT idempotency_key, pairing_id, pl1_id, "
+                          "pl1_score, pl2_id, pl2_score FROM matchesRaw "
+                          "WHERE tour_id = %s "
+                          "AND (idempotency_key = ANY (%s::text[]) "
+                          "OR pairing_id = ANY (%s::int[]))",
+                          (tour_id, list(keys), list(pairing_ids)))
+                existing = s_existingResults(c.fetchall(), keys, pairing_ids)
+            statuses = s_keyedStatuses([m for (i, m) in accepted],
+                                       set(r[4:] for r in recorded),
+                                       existing)
+            for ((i, m), status) in zip(accepted, statuses):
+                res[i] = res[i]._replace(status=status)
+            recorded = [r[:4] for r in recorded]
+        c.close()
+        committed = s_isCacheable()
+
+    s_addToOpponentIndex(tour_id, recorded, committed)
+    s_invalidateCache(tour_id)
+    return res
+
+
+@instrumented
 def swissPairings(tour_id):
     """Return a list of players matched for the next round of given tournament.
 
     Each player appears exactly once in the pairings. Each player is paired
-    with another player with an equal or nearly-equal win record, that is, a
-    player adjacent to him or her in the standings. If there is an odd number
-    of players registered, a random player is assigned a "bye" match which
-    results in being assigned as both players to a match. No player can
-    receive more than one "bye" in a single tournament.
+    with another player with an equal or nearly-equal score whom he or she
+    has not played yet (a rematch happens only if it can not be avoided). If
+    there is an odd number of players registered, the lowest-ranked player
+    without a bye is assigned a "bye" match which results in being assigned
+    as both players to a match. No player can receive more than one "bye" in
+    a single tournament (unless all players already had one).
+
+    Standings are loaded once, opponents are taken from the index of
+    opponents of the tournament (see s_getOpponentIndex) and the pairing
+    itself is done in memory by pairing.pairPlayers. Pairings are cached
+    until the tournament changes (see s_getRevision).
 
+    Args:
+        tour_id: ID number of tournament as integer.
     Returns:
-        A list of tuples, each of which contains (id1, name1, id2,
-        name2, bye2)
+        A list of tuples, each of which contains (id1, name1, id2, name2)
+        (a bye, if any, comes first, then pairs from the top of standings)
             id1: the first player's unique id
             name1: the first player's full name
             id2: the second player's unique id
             name2: the second player's full name
     """
-    # Check if provided tour_id is valid.
-    if s_isValidId('tournaments', tour_id) is False:
-        print "Invalid id '{0}'!".format(tour_id)
-        return None
-
-    db = s_connect()
-    c = db.cursor()
-    c.execute("SELECT player_id, name, byes FROM v_tourstandings "
-              "WHERE tour_id = %s", (tour_id,))
-    all_players = c.fetchall()
-    c.close()
-    db.close()
+    key = ('pairings', tour_id)
+    with s_connect() as db:
+        # Check if provided tour_id is valid (and get its revision).
+        revision = s_getRevision(tour_id)
+        if revision is None:
+            logger.warning("Invalid id '%s'!", tour_id)
+            return None
+        cacheable = s_isCacheable()
+        if cacheable:
+            res = _cache.get(key, revision)
+            if res is not None:
+                return list(res)
+
+        c = db.cursor()
+        c.execute("SELECT s.player_id, p.name, s.points, s.byes "
+                  "FROM player_tour_stats AS s "
+                  "JOIN players AS p ON p.id = s.player_id "
+                  "WHERE s.tour_id = %s "
+                  "ORDER BY s.wins DESC, s.draws DESC, s.omw DESC, "
+                  "s.player_id DESC",
+                  (tour_id,))
+        standings = c.fetchall()
+        c.close()
+        index = s_getOpponentIndex(tour_id, cacheable)
+
+    names = dict((i, n) for (i, n, points, byes) in standings)
+    with index.lock:
+        (pairs, bye) = pairPlayers(
+            [(i, points, byes) for (i, n, points, byes) in standings], index)
 
     res = []
-    # if odd number of players
-    if countRegPlayers(tour_id) % 2 != 0:
-        # make list of candidates-players with 0 "byes"
-        bye_candidates = [(i, n) for (i, n, b) in all_players if b == 0]
-
-        # chose random candidate to get a "bye"
-        bye = random.choice(bye_candidates)
-        all_players = [(i, n) for (i, n, b) in all_players if i != bye[0]]
-        # append bye player to result list
-        res.append(bye + bye)
+    if bye is not None:
+        res.append((bye, names[bye], bye, names[bye]))
+    for (id1, id2) in pairs:
+        res.append((id1, names[id1], id2, names[id2]))
+
+    if cacheable:
+        _cache.put(key, revision, res)
+    return list(res)
+
+
+# tournaments are paired by a process pool only if they have at least this
+# many players altogether (fewer are paired faster than a pool starts and
+# their data is passed to it)
+PARALLEL_MIN_PLAYERS = 20000
+
+
+@instrumented
+def pairAllOngoing(processes=None):
+    """Pair players for the next round of all 'ongoing' tournaments at once.
+
+    Standings and opponents of all ongoing tournaments are read by two
+    queries from one snapshot of the database, the tournaments are paired
+    the same way as by swissPairings in a pool of processes (see
+    PARALLEL_MIN_PLAYERS) and all pairings are written to table
+    proposed_pairings in one transaction, together with revision of the
+    tournament they were computed from. Pairings are also cached, so that
+    following calls of swissPairings return them until the tournament
+    changes.
+
+    Args:
+        processes: (optional) Number of processes pairing the tournaments
+                   (number of CPUs by default, 1 to pair them in this
+                   process).
+    Returns:
+        A dictionary mapping ID of each ongoing tournament to its pairings,
+        a list of tuples (id1, name1, id2, name2) as returned by
+        swissPairings.
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        if db.status == psycopg2.extensions.STATUS_READY:
+            # transaction not started yet, standings and opponents are read
+            # from the same snapshot
+            c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        c.execute("SELECT t.id, t.revision, s.player_id, p.name, s.points, "
+                  "s.byes "
+                  "FROM tournaments AS t "
+                  "LEFT JOIN player_tour_stats AS s ON s.tour_id = t.id "
+                  "LEFT JOIN players AS p ON p.id = s.player_id "
+                  "WHERE t.status = 'ongoing' "
+                  "ORDER BY t.id, s.wins DESC, s.draws DESC, s.omw DESC, "
+                  "s.player_id DESC")
+        rows = c.fetchall()
+        # each pair of players who have met once (byes excluded)
+        c.execute("SELECT DISTINCT m.tour_id, least(m.pl1_id, m.pl2_id), "
+                  "greatest(m.pl1_id, m.pl2_id) "
+                  "FROM tournaments AS t "
+                  "JOIN matchesRaw AS m ON m.tour_id = t.id "
+                  "WHERE t.status = 'ongoing' AND NOT m.archived "
+                  "AND m.pl1_id != m.pl2_id")
+        met = c.fetchall()
+        c.close()
+        cacheable = s_isCacheable()
+
+    revisions = {}
+    players = {}
+    names = {}
+    for (tour_id, revision, player_id, name, points, byes) in rows:
+        revisions[tour_id] = revision
+        players.setdefault(tour_id, [])
+        if player_id is not None:
+            players[tour_id].append((player_id, points, byes))
+            names[player_id] = name
+    opponents = dict((tour_id, {}) for tour_id in revisions)
+    for (tour_id, a, b) in met:
+        opponents[tour_id].setdefault(a, set()).add(b)
+        opponents[tour_id].setdefault(b, set()).add(a)
+
+    jobs = [(tour_id, players[tour_id], opponents[tour_id])
+            for tour_id in sorted(revisions)]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if (processes == 1 or len(jobs) < 2 or
+            sum(len(p) for p in players.values()) < PARALLEL_MIN_PLAYERS):
+        results = [pairJob(job) for job in jobs]
     else:
-        # remove number of byes from player info
-        all_players = [(i, n) for (i, n, b) in all_players]
-    while all_players:
-        # append the topmost two players as a tuple to the result list
-        res.append(all_players[0]+all_players[1])
-        # delete topmost two players
-        del all_players[:2]
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(pairJob, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    res = {}
+    proposed = []
+    for (tour_id, (pairs, bye)) in results:
+        pairings = []
+        if bye is not None:
+            pairings.append((bye, names[bye], bye, names[bye]))
+        for (id1, id2) in pairs:
+            pairings.append((id1, names[id1], id2, names[id2]))
+        res[tour_id] = pairings
+        proposed.extend((tour_id, position, revisions[tour_id], p[0], p[2])
+                        for (position, p) in enumerate(pairings))
+
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("DELETE FROM proposed_pairings "
+                  "WHERE tour_id = ANY (%s::int[])", (list(revisions),))
+        psycopg2.extras.execute_values(
+            c, "INSERT INTO proposed_pairings "
+               "(tour_id, position, revision, pl1_id, pl2_id) VALUES %s",
+            proposed, page_size=1000)
+        c.close()
+
+    if cacheable:
+        for (tour_id, pairings) in res.items():
+            _cache.put(('pairings', tour_id), revisions[tour_id],
+                       list(pairings))
+    logger.info("Pairings proposed for %s tournaments.", len(res))
+    return res
+
+
+@instrumented
+def startRound(tour_id):
+    """Start the next round of given tournament and store its pairings.
+
+    Pairings of the round are computed once and stored in table pairings,
+    from which they are read by getPairings. Pairings proposed by
+    pairAllOngoing are used if the tournament has not changed since,
+    otherwise the round is paired by swissPairings. The round started last
+    is returned instead until each of its pairings has its match recorded
+    (by reportMatch or reportMatches, see s_linkPairings) or is abandoned
+    (see abandonPairing).
+
+    restrictions:
+        - tournament must have status 'ongoing'.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+    Returns:
+        A list of Pairing (id, round, player1_id, player1_name, player2_id,
+        player2_name) of the round, a bye (if any) first. None in case of
+        invalid tour_id or tournament not in 'ongoing' phase.
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        # rounds of a tournament are started one at a time
+        c.execute("SELECT status, revision FROM tournaments WHERE id = %s "
+                  "FOR UPDATE", (tour_id,))
+        tour = c.fetchone()
+        if tour is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            c.close()
+            return None
+        (status, revision) = tour
+        if status != 'ongoing':
+            logger.warning("Unable to start a round of tournament id '%s'! "
+                           "Tournament needs to be 'ongoing'.", tour_id)
+            c.close()
+            return None
+
+        # the round started last with numbers of its pairings still to be
+        # played and of those abandoned
+        c.execute("SELECT r.round, r.revision, count(p.id) FILTER ("
+                  "WHERE NOT p.abandoned AND NOT EXISTS (SELECT 1 "
+                  "FROM matchesRaw AS m WHERE m.pairing_id = p.id)), "
+                  "count(p.id) FILTER (WHERE p.abandoned) "
+                  "FROM (SELECT round, revision FROM rounds "
+                  "WHERE tour_id = %s ORDER BY round DESC LIMIT 1) AS r "
+                  "LEFT JOIN pairings AS p "
+                  "ON p.tour_id = %s AND p.round = r.round "
+                  "GROUP BY r.round, r.revision", (tour_id, tour_id))
+        last = c.fetchone()
+        # the round is not over until each of its pairings has its match
+        # recorded or is abandoned (and nothing changed since it started)
+        if last is not None and (last[2] or (last[1] == revision and
+                                             not last[3])):
+            c.close()
+            return getPairings(tour_id, last[0])
+        round_no = last[0] + 1 if last is not None else 1
+
+        c.execute("SELECT pl1_id, pl2_id FROM proposed_pairings "
+                  "WHERE tour_id = %s AND revision = %s ORDER BY position",
+                  (tour_id, revision))
+        pairs = c.fetchall()
+        if not pairs:
+            pairs = [(p[0], p[2]) for p in swissPairings(tour_id)]
+        c.execute("INSERT INTO rounds (tour_id, round, revision) "
+                  "VALUES (%s, %s, %s)", (tour_id, round_no, revision))
+        c.execute("INSERT INTO pairings "
+                  "(tour_id, round, position, pl1_id, pl2_id) "
+                  "SELECT %s, %s, p.ord - 1, p.pl1_id, p.pl2_id "
+                  "FROM unnest(%s::int[], %s::int[]) WITH ORDINALITY "
+                  "AS p (pl1_id, pl2_id, ord)",
+                  (tour_id, round_no, [p[0] for p in pairs],
+                   [p[1] for p in pairs]))
+        c.close()
+        res = getPairings(tour_id, round_no)
+
+    logger.info("Round %s of tournament id '%s' started.", round_no, tour_id)
+    return res
 
+
+@instrumented
+def abandonPairing(tour_id, pairing_id):
+    """Mark a pairing as not to be played.
+
+    An abandoned pairing (e.g. of a player who did not show up) no longer
+    holds up the next round (see startRound) and no match can be reported
+    for it.
+
+    restrictions:
+        - tournament must have status 'ongoing'.
+        - no match must have been recorded for the pairing.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+        pairing_id: ID number of the pairing (see startRound) as integer.
+    Returns:
+        True upon success, None in case of invalid tour_id or pairing_id,
+        tournament not in 'ongoing' phase or pairing already played.
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        # the same lock as taken by reportMatch and startRound
+        c.execute("SELECT status FROM tournaments WHERE id = %s "
+                  "FOR UPDATE", (tour_id,))
+        tour = c.fetchone()
+        if tour is None:
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            c.close()
+            return None
+        if tour[0] != 'ongoing':
+            logger.warning("Unable to abandon a pairing of tournament id "
+                           "'%s'! Tournament needs to be 'ongoing'.", tour_id)
+            c.close()
+            return None
+        c.execute("SELECT EXISTS (SELECT 1 FROM matchesRaw "
+                  "WHERE pairing_id = p.id) "
+                  "FROM pairings AS p WHERE p.id = %s AND p.tour_id = %s",
+                  (pairing_id, tour_id))
+        played = c.fetchone()
+        if played is None:
+            logger.warning("Invalid pairing id '%s'!", pairing_id)
+            c.close()
+            return None
+        if played[0]:
+            logger.warning("Match of pairing id '%s' already recorded!",
+                           pairing_id)
+            c.close()
+            return None
+        c.execute("UPDATE pairings SET abandoned = true WHERE id = %s",
+                  (pairing_id,))
+        c.close()
+
+    logger.info("Pairing id '%s' of tournament id '%s' abandoned.",
+                pairing_id, tour_id)
+    return True
+
+
+@instrumented
+def getPairings(tour_id, round_no=None):
+    """Return stored pairings of a round of given tournament.
+
+    Args:
+        tour_id: ID number of tournament as integer.
+        round_no: (optional) Number of the round, the round started last by
+                  default.
+    Returns:
+        A list of Pairing (id, round, player1_id, player1_name, player2_id,
+        player2_name) of the round in order of position (a bye, if any,
+        first), empty if the round has not been started. None in case of
+        invalid tour_id.
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT p.id, p.round, p.pl1_id, n1.name, p.pl2_id, "
+                  "n2.name "
+                  "FROM pairings AS p "
+                  "JOIN players AS n1 ON n1.id = p.pl1_id "
+                  "JOIN players AS n2 ON n2.id = p.pl2_id "
+                  "WHERE p.tour_id = %(tour_id)s AND p.round = coalesce("
+                  "%(round)s, (SELECT max(round) FROM rounds "
+                  "WHERE tour_id = %(tour_id)s)) "
+                  "ORDER BY p.position",
+                  {'tour_id': tour_id, 'round': round_no})
+        res = [Pairing(*r) for r in c.fetchall()]
+        c.close()
+        # Check if provided tour_id is valid (only if no pairings found).
+        if not res and not s_isValidId('tournaments', tour_id):
+            logger.warning("Invalid tournament id '%s'!", tour_id)
+            return None
     return res
@@ -19,7 +19,11 @@ CREATE TYPE playerStatus AS ENUM ('active', 'inactive');
 CREATE TABLE tournaments (
     id serial PRIMARY KEY,
     name text NOT NULL,
-    status tourStatus NOT NULL
+    status tourStatus NOT NULL,
+    -- bumped whenever registrations or matches of the tournament change (used to validate cached standings and pairings)
+    revision int NOT NULL DEFAULT 0,
+    -- registrations and matches of archived tournaments are kept in the archived partitions (see archiveTour); only closed tournaments get archived
+    archived boolean NOT NULL DEFAULT false CHECK (NOT archived OR status = 'closed')
 );
 
 CREATE TABLE players (
@@ -28,49 +32,170 @@ CREATE TABLE players (
     status playerStatus NOT NULL
 );
 
+-- Registrations and matches are partitioned by the archived flag of their
+-- tournament, so that queries of live tournaments (with NOT archived) read
+-- only the live partitions. Other tables referencing registrations carry the
+-- flag too and follow it by ON UPDATE CASCADE when a tournament gets
+-- archived.
 CREATE TABLE registrations (
-    id serial PRIMARY KEY,
+    id serial NOT NULL,
     -- ON DELETE CASCADE is set to simplify testing since deleting is
     -- restricted to admins (for testing only)
     tour_id int NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
     player_id int NOT NULL REFERENCES players (id) ON DELETE CASCADE,
+    archived boolean NOT NULL DEFAULT false,
     -- each player can be registered only once for given tournament
-    UNIQUE (tour_id, player_id)
+    PRIMARY KEY (tour_id, player_id, archived)
+) PARTITION BY LIST (archived);
+
+CREATE TABLE registrations_live PARTITION OF registrations FOR VALUES IN (false);
+CREATE TABLE registrations_archived PARTITION OF registrations FOR VALUES IN (true);
+
+-- rounds started by startRound, numbered from 1 within each tournament
+CREATE TABLE rounds (
+    tour_id int NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
+    round int NOT NULL,
+    -- revision of the tournament the pairings of the round were computed from
+    revision int NOT NULL,
+    started timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (tour_id, round)
 );
 
-CREATE TABLE matchesRaw (
+-- pairings of each started round (in order of position, a bye first)
+CREATE TABLE pairings (
     id serial PRIMARY KEY,
     tour_id int NOT NULL,
+    round int NOT NULL,
+    position int NOT NULL,
+    -- equal ids for a bye
+    pl1_id int NOT NULL,
+    pl2_id int NOT NULL,
+    archived boolean NOT NULL DEFAULT false,
+    -- set by abandonPairing for a game which will not be played; the next round is started once each pairing of the current one has its match recorded or is abandoned
+    abandoned boolean NOT NULL DEFAULT false,
+    -- pairings of a round are read by this key
+    UNIQUE (tour_id, round, position),
+    FOREIGN KEY (tour_id, round) REFERENCES rounds (tour_id, round) ON DELETE CASCADE,
+    FOREIGN KEY (tour_id, pl1_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (tour_id, pl2_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE TABLE matchesRaw (
+    id serial NOT NULL,
+    tour_id int NOT NULL,
     pl1_id int NOT NULL,
     pl1_score int NOT NULL,
     pl2_id int NOT NULL,
     pl2_score int NOT NULL,
-    -- ON DELETE CASCADE is set to simplify testing since deleting is
-    -- restricted to admins (for testing only)
-    FOREIGN KEY (tour_id, pl1_id) REFERENCES registrations(tour_id, player_id) ON DELETE CASCADE,
-    FOREIGN KEY (tour_id, pl2_id) REFERENCES registrations(tour_id, player_id) ON DELETE CASCADE
+    -- winner: id of player with higher score or id of player with assigned bye or empty (null) in case of a draw
+    winner_id int GENERATED ALWAYS AS (
+        CASE WHEN pl1_score > pl2_score THEN pl1_id
+             WHEN pl1_score < pl2_score THEN pl2_id
+             WHEN pl1_id = pl2_id THEN pl1_id -- bye case
+        END
+    ) STORED,
+    is_draw boolean GENERATED ALWAYS AS (pl1_score = pl2_score AND pl1_id != pl2_id) STORED,
+    is_bye boolean GENERATED ALWAYS AS (pl1_id = pl2_id) STORED,
+    -- pairing the match was played for (if reported with one)
+    pairing_id int REFERENCES pairings (id) ON DELETE CASCADE,
+    -- key chosen by the client reporting the match (if any), unique within the tournament so that retried reports are recorded once
+    idempotency_key text,
+    archived boolean NOT NULL DEFAULT false,
+    PRIMARY KEY (id, archived)
+) PARTITION BY LIST (archived);
+
+-- Players of matches are checked against the registrations partition of the
+-- same flag: a check against the partitioned table costs several times more,
+-- which counts for the table written most. Matches are therefore moved by
+-- archiveTour before the registrations they reference (checked at commit).
+-- ON DELETE CASCADE is set to simplify testing since deleting is restricted
+-- to admins (for testing only)
+CREATE TABLE matchesRaw_live PARTITION OF matchesRaw (
+    FOREIGN KEY (tour_id, pl1_id, archived) REFERENCES registrations_live (tour_id, player_id, archived) ON DELETE CASCADE,
+    FOREIGN KEY (tour_id, pl2_id, archived) REFERENCES registrations_live (tour_id, player_id, archived) ON DELETE CASCADE
+) FOR VALUES IN (false);
+CREATE TABLE matchesRaw_archived PARTITION OF matchesRaw (
+    FOREIGN KEY (tour_id, pl1_id, archived) REFERENCES registrations_archived (tour_id, player_id, archived) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    FOREIGN KEY (tour_id, pl2_id, archived) REFERENCES registrations_archived (tour_id, player_id, archived) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED
+) FOR VALUES IN (true);
+
+-- matches of a player within a tournament (as the first or the second player); also support the foreign keys
+CREATE INDEX matchesRaw_tour_pl1_idx ON matchesRaw (tour_id, pl1_id) INCLUDE (pl2_id, id);
+CREATE INDEX matchesRaw_tour_pl2_idx ON matchesRaw (tour_id, pl2_id) INCLUDE (pl1_id, id);
+-- wins of a player within a tournament
+CREATE INDEX matchesRaw_tour_winner_idx ON matchesRaw (tour_id, winner_id);
+-- the match of a pairing (at most one, so that a result submitted again is not recorded twice; also supports the foreign key)
+CREATE UNIQUE INDEX matchesRaw_pairing_idx ON matchesRaw (pairing_id, archived) WHERE pairing_id IS NOT NULL;
+-- the match reported with an idempotency key
+CREATE UNIQUE INDEX matchesRaw_idempotency_key_idx ON matchesRaw (tour_id, idempotency_key, archived) WHERE idempotency_key IS NOT NULL;
+
+-- statistics of each registered player within the tournament (kept current by triggers defined below)
+CREATE TABLE player_tour_stats (
+    tour_id int NOT NULL,
+    player_id int NOT NULL,
+    matches int NOT NULL DEFAULT 0,
+    wins int NOT NULL DEFAULT 0,
+    draws int NOT NULL DEFAULT 0,
+    byes int NOT NULL DEFAULT 0,
+    -- 3 points for a win (including a bye), 1 point for a draw
+    points int GENERATED ALWAYS AS (3 * wins + draws) STORED,
+    -- opponent match wins: sum of wins of all (distinct) opponents
+    omw int NOT NULL DEFAULT 0,
+    archived boolean NOT NULL DEFAULT false,
+    PRIMARY KEY (tour_id, player_id),
+    FOREIGN KEY (tour_id, player_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- standings of a tournament are read in this order (player_id makes the order total, so that standings can be read page by page from any row)
+CREATE INDEX player_tour_stats_standings_idx ON player_tour_stats (tour_id, wins DESC, draws DESC, omw DESC, player_id DESC);
+
+-- pairings of the next round proposed for each ongoing tournament (see pairAllOngoing), replaced by every new proposal; valid while revision of the tournament equals revision of the proposal
+CREATE TABLE proposed_pairings (
+    tour_id int NOT NULL,
+    -- order of pairings as returned by swissPairings (a bye, if any, first)
+    position int NOT NULL,
+    revision int NOT NULL,
+    -- equal ids for a bye
+    pl1_id int NOT NULL,
+    pl2_id int NOT NULL,
+    archived boolean NOT NULL DEFAULT false,
+    PRIMARY KEY (tour_id, position),
+    FOREIGN KEY (tour_id, pl1_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (tour_id, pl2_id, archived) REFERENCES registrations (tour_id, player_id, archived) ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+
+-- number of tournaments and players by status (one row per value of the
+-- status type, kept up to date by the triggers t_status_counts)
+CREATE TABLE status_counts (
+    table_name text NOT NULL,
+    status text NOT NULL,
+    count bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, status)
 );
 
+INSERT INTO status_counts (table_name, status)
+    SELECT 'tournaments', unnest(enum_range(NULL::tourStatus))::text
+    UNION ALL
+    SELECT 'players', unnest(enum_range(NULL::playerStatus))::text;
+
 
 -- VIEWS --
 
+-- counts served from status_counts (maintained by triggers, see below)
 CREATE VIEW v_toursCountByStatus AS
-    SELECT status, count(*)
-    FROM tournaments
-    GROUP BY status;
+    SELECT status, count
+    FROM status_counts
+    WHERE table_name = 'tournaments';
 
 CREATE VIEW v_playersCountByStatus AS
-    SELECT status, count(*)
-    FROM players
-    GROUP BY status;
+    SELECT status, count
+    FROM status_counts
+    WHERE table_name = 'players';
 
+-- matches with their winner (kept for compatibility, winner_id is now stored in matchesRaw)
 CREATE VIEW v_matches AS
-    SELECT *,
-            -- add winner: select id of player with higher score as winner or id of player with assigned bye as winner or leave empty (null) in case of a draw
-            CASE WHEN pl1_score > pl2_score THEN pl1_id
-                 WHEN pl1_score < pl2_score THEN pl2_id
-                 WHEN pl1_id = pl2_id THEN pl1_id -- bye case
-            END AS winner_id
+    SELECT id, tour_id, pl1_id, pl1_score, pl2_id, pl2_score, winner_id
     FROM matchesRaw;
 
 -- function for creating a view of opponents of a given player in a given tournament
@@ -84,39 +209,355 @@ CREATE OR REPLACE FUNCTION opponents(tour_id int, player_id int)
         FROM v_matches
         WHERE tour_id = $1 AND pl1_id != pl2_id AND (pl1_id = $2 OR pl2_id = $2)
     $body$
-    language sql;
+    -- stable (read-only) so that the function can be inlined into the calling query and use indexes of matchesRaw
+    language sql STABLE;
 
 CREATE VIEW v_tourStandings AS
-    SELECT r.tour_id,
-           r.player_id,
+    SELECT s.tour_id,
+           s.player_id,
            -- name matched from players table
-           (SELECT name FROM players WHERE id = r.player_id),
-           -- matches played: count of IDs from v_matches with matching tour_id and player_id (either as player 1 or player 2)
-           (SELECT count(id) AS matches FROM v_matches WHERE tour_id = r.tour_id AND (pl1_id = r.player_id OR pl2_id = r.player_id)),
-           -- wins: count of winner_IDs from v_matches with matching tour_id where given player_id equals winner_id
-           (SELECT count(winner_id) AS wins FROM v_matches WHERE tour_id = r.tour_id AND winner_id = r.player_id),
-           -- draws: count of IDs from v_matches with matching tour_id and player_id (either as player 1 or player 2) where winner_id is null
-           (SELECT count(id) AS draws FROM v_matches WHERE tour_id = r.tour_id AND (pl1_id = r.player_id OR pl2_id = r.player_id) AND winner_id IS NULL),
-           -- byes: count of IDs from v_matches with matching tour_id where player 1 equals player 2
-           (SELECT count(id) AS byes FROM v_matches WHERE tour_id = r.tour_id AND pl1_id = r.player_id AND pl1_id = pl2_id),
-           -- omw (opponent match wins): sum of wins of all opponents of given player within given tournament
-           (SELECT sum(wins) as omw
-            FROM (
-                -- winners with number of wins by tournament
-                SELECT tour_id, winner_id, count(winner_id) AS wins 
-                FROM v_matches 
-                WHERE winner_id IS NOT NULL 
-                GROUP BY tour_id, winner_id
-            ) AS wins
-            WHERE tour_id = r.tour_id AND winner_id IN (
-                -- opponents of r.player_id
-                SELECT * FROM opponents(r.tour_id, r.player_id)
-                -- SELECT CASE WHEN pl1_id = r.player_id THEN pl2_id
-                --             WHEN pl2_id = r.player_id THEN pl1_id
-                --        END
-                -- FROM v_matches
-                -- -- exclude byes
-                -- WHERE pl1_id != pl2_id
-            ))
-    FROM registrations AS r
-    ORDER BY r.tour_id, wins DESC, draws DESC, omw DESC;
+           p.name,
+           s.matches,
+           s.wins,
+           s.draws,
+           s.byes,
+           s.omw
+    FROM player_tour_stats AS s
+    JOIN players AS p ON p.id = s.player_id
+    ORDER BY s.tour_id, s.wins DESC, s.draws DESC, s.omw DESC, s.player_id DESC;
+
+
+-- STANDINGS MAINTENANCE --
+
+-- function recomputing statistics of all players of a given tournament from scratch (used when matches get deleted and to fill player_tour_stats of existing tournaments)
+CREATE OR REPLACE FUNCTION refresh_player_tour_stats(tour_id int)
+    RETURNS void
+    AS
+    $body$
+        WITH games AS (
+            -- each match once for each of its players (byes only once)
+            SELECT pl1_id AS player_id, pl2_id AS opponent_id, winner_id, is_draw, is_bye
+            FROM matchesRaw
+            WHERE tour_id = $1 AND archived = (SELECT archived FROM tournaments WHERE id = $1)
+            UNION ALL
+            SELECT pl2_id, pl1_id, winner_id, is_draw, is_bye
+            FROM matchesRaw
+            WHERE tour_id = $1 AND archived = (SELECT archived FROM tournaments WHERE id = $1) AND NOT is_bye
+        ), totals AS (
+            SELECT player_id,
+                   count(*) AS matches,
+                   count(*) FILTER (WHERE winner_id = player_id) AS wins,
+                   count(*) FILTER (WHERE is_draw) AS draws,
+                   count(*) FILTER (WHERE is_bye) AS byes
+            FROM games
+            GROUP BY player_id
+        ), omw AS (
+            -- sum of wins of distinct opponents (byes excluded)
+            SELECT o.player_id, sum(t.wins) AS omw
+            FROM (SELECT DISTINCT player_id, opponent_id FROM games WHERE NOT is_bye) AS o
+            JOIN totals AS t ON t.player_id = o.opponent_id
+            GROUP BY o.player_id
+        )
+        UPDATE player_tour_stats AS s
+        SET matches = coalesce(t.matches, 0),
+            wins = coalesce(t.wins, 0),
+            draws = coalesce(t.draws, 0),
+            byes = coalesce(t.byes, 0),
+            omw = coalesce(o.omw, 0)
+        FROM player_tour_stats AS x
+        LEFT JOIN totals AS t ON t.player_id = x.player_id
+        LEFT JOIN omw AS o ON o.player_id = x.player_id
+        WHERE x.tour_id = $1 AND s.tour_id = x.tour_id AND s.player_id = x.player_id;
+    $body$
+    language sql;
+
+-- newly registered players start with empty statistics
+CREATE OR REPLACE FUNCTION t_registrations_stats()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        INSERT INTO player_tour_stats (tour_id, player_id)
+        SELECT tour_id, player_id FROM new_rows;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER registrations_stats AFTER INSERT ON registrations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_registrations_stats();
+
+-- applies a recorded match to statistics of its players and omw of the opponents of its winner (only matches recorded earlier, i.e. with lower id, are taken into account, so matches are applied in order of their ids; used by the trigger below and to replay matches after a checkpoint)
+CREATE OR REPLACE FUNCTION apply_match_stats(m matchesRaw)
+    RETURNS void
+    AS
+    $body$
+    BEGIN
+        -- players meeting for the first time add each other's wins to their omw
+        IF NOT m.is_bye AND NOT EXISTS (
+            SELECT 1
+            FROM matchesRaw
+            WHERE tour_id = m.tour_id AND archived = m.archived AND id < m.id
+              AND ((pl1_id = m.pl1_id AND pl2_id = m.pl2_id) OR (pl1_id = m.pl2_id AND pl2_id = m.pl1_id))
+        ) THEN
+            UPDATE player_tour_stats AS s
+            SET omw = s.omw + o.wins
+            FROM player_tour_stats AS o
+            WHERE s.tour_id = m.tour_id AND o.tour_id = m.tour_id
+              AND ((s.player_id = m.pl1_id AND o.player_id = m.pl2_id) OR (s.player_id = m.pl2_id AND o.player_id = m.pl1_id));
+        END IF;
+
+        UPDATE player_tour_stats
+        SET matches = matches + 1,
+            wins = wins + (player_id IS NOT DISTINCT FROM m.winner_id)::int,
+            draws = draws + m.is_draw::int,
+            byes = byes + m.is_bye::int
+        WHERE tour_id = m.tour_id AND player_id IN (m.pl1_id, m.pl2_id);
+
+        -- a win adds to omw of every (distinct) opponent of the winner
+        IF m.winner_id IS NOT NULL THEN
+            UPDATE player_tour_stats
+            SET omw = omw + 1
+            WHERE tour_id = m.tour_id AND player_id IN (
+                SELECT CASE WHEN pl1_id = m.winner_id THEN pl2_id ELSE pl1_id END
+                FROM matchesRaw
+                WHERE tour_id = m.tour_id AND archived = m.archived AND id <= m.id AND NOT is_bye
+                  AND (pl1_id = m.winner_id OR pl2_id = m.winner_id)
+            );
+        END IF;
+    END;
+    $body$
+    language plpgsql;
+
+-- each recorded match updates the statistics (rows inserted by one statement are processed one by one)
+CREATE OR REPLACE FUNCTION t_matchesRaw_stats()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        PERFORM apply_match_stats(NEW);
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+-- skipped by bulk loads (see transfer.py), which set tournaments.bulk_load to 'on' for their transaction and recompute statistics of the loaded tournaments at once afterwards, and for matches moved to the archived partition (see archiveTour; moving rows between partitions inserts them)
+CREATE TRIGGER matchesRaw_stats AFTER INSERT ON matchesRaw
+    FOR EACH ROW
+    WHEN (NOT NEW.archived AND current_setting('tournaments.bulk_load', true) IS DISTINCT FROM 'on')
+    EXECUTE PROCEDURE t_matchesRaw_stats();
+
+-- deleted matches (admins only) are not subtracted, statistics of the affected tournaments get recomputed instead
+CREATE OR REPLACE FUNCTION t_matchesRaw_refresh_stats()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        PERFORM refresh_player_tour_stats(t.tour_id)
+        FROM (SELECT DISTINCT tour_id FROM old_rows) AS t;
+        -- checkpoints no longer match the remaining matches
+        DELETE FROM stats_checkpoints
+        WHERE tour_id IN (SELECT tour_id FROM old_rows);
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER matchesRaw_refresh_stats AFTER DELETE ON matchesRaw
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_matchesRaw_refresh_stats();
+
+
+
+-- CHECKPOINTS --
+
+-- checkpoint of statistics of a tournament: snapshot of its player_tour_stats as of its match last_match_id (all matches with lower or equal ids applied, none with higher ids); statistics are rebuilt from the snapshot by replaying only the later matches
+CREATE TABLE stats_checkpoints (
+    tour_id int PRIMARY KEY REFERENCES tournaments (id) ON DELETE CASCADE,
+    last_match_id int NOT NULL,
+    taken timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE player_tour_stats_snapshots (
+    tour_id int NOT NULL REFERENCES stats_checkpoints (tour_id) ON DELETE CASCADE,
+    player_id int NOT NULL,
+    matches int NOT NULL,
+    wins int NOT NULL,
+    draws int NOT NULL,
+    byes int NOT NULL,
+    omw int NOT NULL,
+    PRIMARY KEY (tour_id, player_id)
+);
+
+-- function replacing the checkpoint of a given tournament by its current statistics, returns id of the last match applied to them; no matches of the tournament can be recorded meanwhile (its row is locked by each transaction recording its matches before it inserts them, so the lock waits for all of them and no match with a lower id can be committed later; matches of other tournaments are recorded as usual)
+CREATE OR REPLACE FUNCTION checkpoint_player_tour_stats(tour_id int)
+    RETURNS int
+    AS
+    $body$
+    DECLARE
+        last_id int;
+    BEGIN
+        PERFORM 1 FROM tournaments AS t WHERE t.id = $1 FOR UPDATE;
+        SELECT coalesce(max(id), 0) INTO last_id
+        FROM matchesRaw
+        WHERE matchesRaw.tour_id = $1;
+
+        DELETE FROM stats_checkpoints AS k WHERE k.tour_id = $1;
+        INSERT INTO stats_checkpoints (tour_id, last_match_id)
+        VALUES ($1, last_id);
+        INSERT INTO player_tour_stats_snapshots
+        SELECT s.tour_id, s.player_id, s.matches, s.wins, s.draws, s.byes, s.omw
+        FROM player_tour_stats AS s
+        WHERE s.tour_id = $1;
+        RETURN last_id;
+    END;
+    $body$
+    language plpgsql;
+
+-- function rebuilding statistics of a given tournament from its checkpoint (or from scratch if there is none) and replaying the matches recorded after it, returns number of matches replayed (locks the tournament the same way)
+CREATE OR REPLACE FUNCTION rebuild_player_tour_stats(tour_id int)
+    RETURNS int
+    AS
+    $body$
+    DECLARE
+        last_id int;
+        m matchesRaw;
+        replayed int := 0;
+    BEGIN
+        PERFORM 1 FROM tournaments AS t WHERE t.id = $1 FOR UPDATE;
+        SELECT k.last_match_id INTO last_id
+        FROM stats_checkpoints AS k
+        WHERE k.tour_id = $1;
+
+        IF last_id IS NULL THEN
+            PERFORM refresh_player_tour_stats($1);
+            SELECT count(*) INTO replayed
+            FROM matchesRaw
+            WHERE matchesRaw.tour_id = $1;
+        ELSE
+            -- players registered after the checkpoint start with empty statistics
+            UPDATE player_tour_stats AS s
+            SET matches = coalesce(x.matches, 0),
+                wins = coalesce(x.wins, 0),
+                draws = coalesce(x.draws, 0),
+                byes = coalesce(x.byes, 0),
+                omw = coalesce(x.omw, 0)
+            FROM player_tour_stats AS p
+            LEFT JOIN player_tour_stats_snapshots AS x
+                ON x.tour_id = p.tour_id AND x.player_id = p.player_id
+            WHERE p.tour_id = $1 AND s.tour_id = p.tour_id AND s.player_id = p.player_id;
+
+            FOR m IN
+                SELECT * FROM matchesRaw
+                WHERE matchesRaw.tour_id = $1 AND id > last_id
+                ORDER BY id
+            LOOP
+                PERFORM apply_match_stats(m);
+                replayed := replayed + 1;
+            END LOOP;
+        END IF;
+
+        -- cached standings and proposed pairings are no longer valid
+        UPDATE tournaments SET revision = revision + 1 WHERE id = $1;
+        RETURN replayed;
+    END;
+    $body$
+    language plpgsql;
+
+-- REVISIONS --
+
+-- each statement changing registrations or matches bumps revision of the affected tournaments (once per statement)
+CREATE OR REPLACE FUNCTION t_bump_tour_revision()
+    RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            UPDATE tournaments SET revision = revision + 1
+            WHERE id IN (SELECT tour_id FROM old_rows);
+        ELSE
+            UPDATE tournaments SET revision = revision + 1
+            WHERE id IN (SELECT tour_id FROM new_rows);
+        END IF;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER registrations_revision_ins AFTER INSERT ON registrations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER registrations_revision_del AFTER DELETE ON registrations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER matchesRaw_revision_ins AFTER INSERT ON matchesRaw
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+CREATE TRIGGER matchesRaw_revision_del AFTER DELETE ON matchesRaw
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_bump_tour_revision();
+
+
+-- changes of number of rows by status applied once per statement (deltas in
+-- order of status, so concurrent statements lock the counters in the same
+-- order)
+CREATE FUNCTION t_status_counts() RETURNS trigger
+    AS
+    $body$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO status_counts AS s (table_name, status, count)
+            SELECT TG_TABLE_NAME, status::text, count(*)
+            FROM new_rows
+            GROUP BY status ORDER BY status
+            ON CONFLICT (table_name, status)
+            DO UPDATE SET count = s.count + EXCLUDED.count;
+        ELSIF TG_OP = 'DELETE' THEN
+            INSERT INTO status_counts AS s (table_name, status, count)
+            SELECT TG_TABLE_NAME, status::text, -count(*)
+            FROM old_rows
+            GROUP BY status ORDER BY status
+            ON CONFLICT (table_name, status)
+            DO UPDATE SET count = s.count + EXCLUDED.count;
+        ELSE
+            INSERT INTO status_counts AS s (table_name, status, count)
+            SELECT TG_TABLE_NAME, status::text, sum(delta)
+            FROM (SELECT status, 1 AS delta FROM new_rows
+                  UNION ALL
+                  SELECT status, -1 FROM old_rows) AS d
+            GROUP BY status HAVING sum(delta) <> 0 ORDER BY status
+            ON CONFLICT (table_name, status)
+            DO UPDATE SET count = s.count + EXCLUDED.count;
+        END IF;
+        RETURN NULL;
+    END;
+    $body$
+    language plpgsql;
+
+CREATE TRIGGER tournaments_status_counts_ins AFTER INSERT ON tournaments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER tournaments_status_counts_upd AFTER UPDATE ON tournaments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER tournaments_status_counts_del AFTER DELETE ON tournaments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER players_status_counts_ins AFTER INSERT ON players
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER players_status_counts_upd AFTER UPDATE ON players
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
+
+CREATE TRIGGER players_status_counts_del AFTER DELETE ON players
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE t_status_counts();
@@ -1,5 +1,11 @@
 """Test cases for tournament.py."""
 
+import multiprocessing
+import random
+import sys
+import time
+from StringIO import StringIO
+
 from tournaments import *
 
 
@@ -18,15 +24,14 @@ def t_getIdByName(table, name):
         An integer referencing the id of provided player/tournament in the
         provided table.
     """
-    db = s_connect()
-    c = db.cursor()
-    # order by name to enable reusing names without the need to delete all
-    # data from the database for each new test case
-    c.execute("SELECT id FROM {0} WHERE name = '{1}' "
-              "ORDER BY id DESC".format(table, name))
-    t_id = c.fetchone()[0]
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        # order by name to enable reusing names without the need to delete
+        # all data from the database for each new test case
+        c.execute("SELECT id FROM {0} WHERE name = '{1}' "
+                  "ORDER BY id DESC".format(table, name))
+        t_id = c.fetchone()[0]
+        c.close()
     return t_id
 
 
@@ -67,13 +72,12 @@ def testEditPlayer():
     changePlayerName(p_id, "Nikola Tesla")
     changePlayerStatus(p_id, "inactive")
 
-    db = s_connect()
-    c = db.cursor()
-    # get changed name and status
-    c.execute("SELECT name, status FROM players WHERE id = %s", (p_id,))
-    p_details = c.fetchone()
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        # get changed name and status
+        c.execute("SELECT name, status FROM players WHERE id = %s", (p_id,))
+        p_details = c.fetchone()
+        c.close()
     # compare new name and status to the desired ones
     if p_details[0] == "Nikola Tesla":
         print "5a. Success: player name changed."
@@ -97,13 +101,13 @@ def testEditTour():
     changeTourName(t_id, "Beer-pong")
     changeTourStatus(t_id, "ongoing")
 
-    db = s_connect()
-    c = db.cursor()
-    # get changed name and status
-    c.execute("SELECT name, status FROM tournaments WHERE id = %s", (t_id,))
-    t_details = c.fetchone()
-    c.close()
-    db.close()
+    with s_connect() as db:
+        c = db.cursor()
+        # get changed name and status
+        c.execute("SELECT name, status FROM tournaments WHERE id = %s",
+                  (t_id,))
+        t_details = c.fetchone()
+        c.close()
     # compare new name and status to the desired ones
     if t_details[0] == "Beer-pong":
         print "6a. Success: tournament name changed."
@@ -198,11 +202,12 @@ def testRegisterOnePlayer():
     # register player
     registerPlayers(t_id, p_id)
 
-    db = s_connect()
-    c = db.cursor()
-    c.execute("SELECT player_id FROM registrations "
-              "WHERE tour_id = %s", (t_id,))
-    res = c.fetchone()[0]
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT player_id FROM registrations "
+                  "WHERE tour_id = %s", (t_id,))
+        res = c.fetchone()[0]
+        c.close()
     if res != p_id:
         raise ValueError("Player %s failed to be registered." % (p_id))
     else:
@@ -465,6 +470,979 @@ def testPairingsOdd():
     print "20. Success: all five players paired."
 
 
+def testReportMatchesBatch():
+    """Test reporting a whole round of matches at once."""
+    players = ["Jack Sparrow", "Fluttershy", "Applejack", "Pinkie Pie",
+               "Peter Pan"]
+    # create test players
+    for p in players:
+        createNewPlayer(p)
+    # get test player IDs
+    p1_id = t_getIdByName('players', 'Jack Sparrow')
+    p2_id, p3_id, p4_id, p5_id = p1_id + 1, p1_id + 2, p1_id + 3, p1_id + 4
+    # create test tournament
+    createNewTour("Give a Jack")
+    # get test tournament id
+    t_id = t_getIdByName('tournaments', 'Give a Jack')
+    # register all players but the last one to provided tournament
+    registerPlayers(t_id, p1_id, p2_id, p3_id, p4_id)
+    changeTourStatus(t_id, "ongoing")
+
+    report = reportMatches(t_id, [(p1_id, 6, p2_id, 3),  # w(1)
+                                  (p3_id, 2, p4_id, 2),  # w( ) - draw
+                                  (p4_id, 1, p5_id, 0),  # unregistered
+                                  (p1_id, 6, p2_id)])    # malformed
+    statuses = [status for (i1, i2, status) in report]
+    if statuses != ['recorded', 'recorded', 'unregistered', 'malformed']:
+        raise ValueError("reportMatches() should accept valid results and "
+                         "reject the others, got {0}.".format(statuses))
+    standings = tournamentStandings(t_id)
+    if sum(m for (t, i, n, m, w, d, b, o) in standings) != 4:
+        raise ValueError("Only accepted results should be recorded.")
+    print "21. Success: a batch of results can be reported."
+
+
+def testStandingsUseIndexes():
+    """Test that queries over matches use indexes on a large table.
+
+    One million matches are seeded (within a transaction which is rolled back
+    at the end) and plans of the queries used to maintain standings are
+    checked for the indexes of table matchesRaw.
+    """
+    with s_connect() as db:
+        c = db.cursor()
+        # 200 tournaments with the same 100 players registered to each
+        c.execute("INSERT INTO tournaments (name, status) "
+                  "SELECT 'Index Cup', 'ongoing' FROM generate_series(1, 200)")
+        c.execute("INSERT INTO players (name, status) "
+                  "SELECT 'Index Player', 'active' "
+                  "FROM generate_series(1, 100)")
+        c.execute("INSERT INTO registrations (tour_id, player_id) "
+                  "SELECT t.id, p.id FROM tournaments AS t, players AS p "
+                  "WHERE t.name = 'Index Cup' AND p.name = 'Index Player'")
+        # seed the matches without maintaining standings (not needed here)
+        c.execute("ALTER TABLE matchesRaw DISABLE TRIGGER matchesRaw_stats")
+        c.execute("INSERT INTO matchesRaw "
+                  "(tour_id, pl1_id, pl1_score, pl2_id, pl2_score) "
+                  "SELECT t.ids[1 + g % 200], p.ids[1 + (g / 200) % 100], "
+                  "g % 3, p.ids[1 + (g / 20000) % 100], g % 2 "
+                  "FROM generate_series(0, 999999) AS g, "
+                  "(SELECT array_agg(id) AS ids FROM tournaments "
+                  "WHERE name = 'Index Cup') AS t, "
+                  "(SELECT array_agg(id) AS ids FROM players "
+                  "WHERE name = 'Index Player') AS p")
+        c.execute("ANALYZE matchesRaw")
+        c.execute("SELECT tour_id, pl1_id FROM matchesRaw "
+                  "ORDER BY id DESC LIMIT 1")
+        (t_id, p_id) = c.fetchone()
+
+        queries = [
+            ("SELECT pl2_id FROM matchesRaw "
+             "WHERE tour_id = %s AND pl1_id = %s AND NOT archived",
+             ['matchesraw_tour_pl1_idx']),
+            ("SELECT pl1_id FROM matchesRaw "
+             "WHERE tour_id = %s AND pl2_id = %s AND NOT archived",
+             ['matchesraw_tour_pl2_idx']),
+            ("SELECT * FROM opponents(%s, %s)",
+             ['matchesraw_tour_pl1_idx', 'matchesraw_tour_pl2_idx']),
+            ("SELECT count(*) FROM v_matches "
+             "WHERE tour_id = %s AND winner_id = %s",
+             ['matchesraw_tour_winner_idx']),
+        ]
+        for (query, indexes) in queries:
+            c.execute("EXPLAIN " + query, (t_id, p_id))
+            plan = "\n".join(row[0] for row in c.fetchall())
+            for index in indexes:
+                # index of the live partition attached to the index
+                c.execute("SELECT i.inhrelid::regclass::text "
+                          "FROM pg_inherits AS i "
+                          "JOIN pg_index AS x ON x.indexrelid = i.inhrelid "
+                          "WHERE i.inhparent = %s::regclass "
+                          "AND x.indrelid = 'matchesraw_live'::regclass",
+                          (index,))
+                index = c.fetchone()[0]
+                if index not in plan:
+                    raise ValueError("Query '{0}' should use index {1}, "
+                                     "plan:\n{2}".format(query, index, plan))
+        c.close()
+        db.rollback()
+    print "22. Success: queries over one million matches use indexes."
+
+
+def testPairingsNoRematch():
+    """Test that swiss pairings avoid rematches."""
+    players = ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"]
+    # create test players
+    for p in players:
+        createNewPlayer(p)
+    # get test player IDs
+    p1_id = t_getIdByName('players', 'Twilight Sparkle')
+    p2_id, p3_id, p4_id = p1_id + 1, p1_id + 2, p1_id + 3
+    # create test tournament
+    createNewTour("Knight or Knave")
+    # get test tournament id
+    t_id = t_getIdByName('tournaments', 'Knight or Knave')
+    # register all players to provided tournament
+    registerPlayers(t_id, p1_id, p2_id, p3_id, p4_id)
+    changeTourStatus(t_id, "ongoing")
+    reportMatch(t_id, p1_id, 6, p2_id, 3)  # w(1)
+    reportMatch(t_id, p3_id, 6, p4_id, 3)  # w(3)
+    reportMatch(t_id, p1_id, 6, p3_id, 3)  # w(1)
+    reportMatch(t_id, p2_id, 6, p4_id, 3)  # w(2)
+
+    # standings: 1 (2 wins), 3 and 2 (1 win), 4 (0 wins); neighbours in
+    # standings have already met each other
+    pairings = swissPairings(t_id)
+    correct_pairs = set([frozenset([p1_id, p4_id]), frozenset([p2_id, p3_id])])
+    actual_pairs = set(frozenset([i1, i2]) for (i1, n1, i2, n2) in pairings)
+    if correct_pairs != actual_pairs:
+        raise ValueError("Players who already met should not be paired.")
+
+    # a match reported within a transaction of a caller which is rolled back
+    # is not remembered by the index of opponents
+    class Rollback(Exception):
+        pass
+    try:
+        with s_connect():
+            reportMatch(t_id, p1_id, 6, p4_id, 3)
+            swissPairings(t_id)
+            raise Rollback()
+    except Rollback:
+        pass
+    if s_getOpponentIndex(t_id).have_met(p1_id, p4_id):
+        raise ValueError("Match rolled back should not count as played.")
+    print "23. Success: after two rounds, no rematches are paired."
+
+
+def testPairingsScale():
+    """Test pairing 10000 players over several rounds (without database)."""
+    random.seed(0)
+    points = dict((i, 0) for i in range(1, 10001))
+    index = OpponentIndex(0)
+    match_id = 0
+    for r in range(8):
+        players = sorted(((i, p, 0) for (i, p) in points.items()),
+                         key=lambda x: -x[1])
+        start = time.time()
+        (pairs, bye) = pairPlayers(players, index)
+        duration = time.time() - start
+        if duration > 1:
+            raise ValueError("Pairing 10000 players should take less than a "
+                             "second, took {0:.2f}s.".format(duration))
+        if any(index.have_met(id1, id2) for (id1, id2) in pairs):
+            raise ValueError("Players who already met should not be paired.")
+        for (id1, id2) in pairs:
+            winner = random.choice((id1, id2))
+            points[winner] += 3
+            match_id += 1
+            index.addMatch(match_id, id1, id2, winner)
+    print "24. Success: 10000 players paired in less than a second."
+
+
+def testStandingsTiebreaks():
+    """Test tiebreaks requested in addition to standings."""
+    players = ["Elon Musk", "Bruno Walton", "Boots O'Neal", "Cathy Burton",
+               "Diane Grant"]
+    # create test players
+    for p in players:
+        createNewPlayer(p)
+    # get test player IDs
+    p1_id = t_getIdByName('players', 'Elon Musk')
+    p2_id, p3_id, p4_id, p5_id = p1_id + 1, p1_id + 2, p1_id + 3, p1_id + 4
+    # create test tournament
+    createNewTour("Knight or Knave")
+    # get test tournament id
+    t_id = t_getIdByName('tournaments', 'Knight or Knave')
+    # register all players to provided tournament
+    registerPlayers(t_id, p1_id, p2_id, p3_id, p4_id, p5_id)
+
+    changeTourStatus(t_id, "ongoing")
+    reportMatch(t_id, p1_id, 6, p2_id, 3)  # w(1)
+    reportMatch(t_id, p3_id, 1, p4_id, 3)  # w(4)
+    reportMatch(t_id, p5_id, 0, p5_id, 0)  # w(5) - bye
+
+    reportMatch(t_id, p1_id, 2, p4_id, 1)  # w(1)
+    reportMatch(t_id, p2_id, 0, p2_id, 0)  # w(2) - bye
+    reportMatch(t_id, p3_id, 3, p5_id, 3)  # w( ) - draw
+
+    reportMatch(t_id, p1_id, 0, p5_id, 1)  # w(5)
+    reportMatch(t_id, p4_id, 4, p2_id, 3)  # w(4)
+    reportMatch(t_id, p3_id, 0, p3_id, 0)  # w(3) - bye
+
+    if tournamentStandings(t_id, tiebreaks=['sos']) is not None:
+        raise ValueError("Unknown tiebreaks should be rejected.")
+    standings = tournamentStandings(
+        t_id, tiebreaks=['median_buchholz', 'buchholz', 'sonneborn_berger',
+                         'omw_pct'])
+    # points: 1 - 6, 2 - 3, 3 - 4, 4 - 6, 5 - 7
+    correct = {
+        p1_id: (6, 16, 9.0, 16 / 27.0),
+        p2_id: (12, 12, 0.0, 12 / 18.0),
+        p3_id: (13, 13, 3.5, 13 / 18.0),
+        p4_id: (4, 13, 7.0, 13 / 27.0),
+        p5_id: (10, 10, 8.0, 10 / 18.0),
+    }
+    for r in standings:
+        if len(r) != 12:
+            raise ValueError("Each requested tiebreak should be appended to "
+                             "standings.")
+        (mb, b, sb, pct) = r[8:]
+        if ((mb, b, sb) != correct[r[1]][:3] or
+                abs(pct - correct[r[1]][3]) > 1e-9):
+            raise ValueError("Player id '{0}' should have tiebreaks "
+                             "{1}.".format(r[1], correct[r[1]]))
+    if [r[1] for r in standings] != [p5_id, p1_id, p4_id, p3_id, p2_id]:
+        raise ValueError("Players should be ranked by requested tiebreaks.")
+    print "25. Success: tiebreaks are computed and used to rank players."
+
+
+def testTiebreaksScale():
+    """Test computing tiebreaks of 5000 players after 15 rounds."""
+    from tiebreaks import computeTiebreaks
+    random.seed(0)
+    ids = range(1, 5001)
+    index = OpponentIndex(0)
+    match_id = 0
+    for r in range(15):
+        random.shuffle(ids)
+        for k in range(0, len(ids), 2):
+            (id1, id2) = (ids[k], ids[k + 1])
+            match_id += 1
+            index.addMatch(match_id, id1, id2,
+                           random.choice((id1, id2, None)))
+    start = time.time()
+    res = computeTiebreaks(index, ids)
+    duration = time.time() - start
+    if len(res) != 5000:
+        raise ValueError("Tiebreaks should be computed for all players.")
+    if duration > 1:
+        raise ValueError("Computing tiebreaks of 5000 players should take "
+                         "less than a second, took {0:.2f}s.".format(duration))
+    print ("26. Success: tiebreaks of 5000 players computed in less than a "
+           "second.")
+
+
+def testStandingsCache():
+    """Test that standings are cached until the tournament changes."""
+    players = ["Twilight Sparkle", "Fluttershy"]
+    # create test players
+    for p in players:
+        createNewPlayer(p)
+    # get test player IDs
+    p1_id = t_getIdByName('players', 'Twilight Sparkle')
+    p2_id = p1_id + 1
+    # create test tournament
+    createNewTour("Knight or Knave")
+    # get test tournament id
+    t_id = t_getIdByName('tournaments', 'Knight or Knave')
+    # register all players to provided tournament
+    registerPlayers(t_id, p1_id, p2_id)
+    changeTourStatus(t_id, "ongoing")
+
+    stats = cacheStats()
+    first = tournamentStandings(t_id)
+    second = tournamentStandings(t_id)
+    if first != second or cacheStats()['hits'] != stats['hits'] + 1:
+        raise ValueError("Unchanged standings should be served from cache.")
+    reportMatch(t_id, p1_id, 6, p2_id, 3)  # w(1)
+    if tournamentStandings(t_id)[0][4] != 1:
+        raise ValueError("Reporting a match should invalidate cached "
+                         "standings.")
+    # a match recorded by another process bumps revision of the tournament
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("INSERT INTO matchesRaw "
+                  "(tour_id, pl1_id, pl1_score, pl2_id, pl2_score) "
+                  "VALUES (%s, %s, 6, %s, 3)", (t_id, p2_id, p1_id))
+        c.close()
+    if [r[4] for r in tournamentStandings(t_id)] != [1, 1]:
+        raise ValueError("Standings changed by another process should not "
+                         "be served from cache.")
+    print "27. Success: standings are cached until the tournament changes."
+
+
+def testStatistics():
+    """Test that calls and queries of public functions are recorded."""
+    players = ["Twilight Sparkle", "Fluttershy"]
+    # create test players
+    for p in players:
+        createNewPlayer(p)
+    # get test player IDs
+    p1_id = t_getIdByName('players', 'Twilight Sparkle')
+    p2_id = p1_id + 1
+    # create test tournament
+    createNewTour("Knight or Knave")
+    # get test tournament id
+    t_id = t_getIdByName('tournaments', 'Knight or Knave')
+    # register all players to provided tournament
+    registerPlayers(t_id, p1_id, p2_id)
+    changeTourStatus(t_id, "ongoing")
+
+    s_resetStats()
+    reportMatch(t_id, p1_id, 6, p2_id, 3)  # w(1)
+    stats = dumpStats()
+    calls = stats['functions'].get('reportMatch', {})
+    if calls.get('calls') != 1 or calls.get('acquires') != 1:
+        raise ValueError("Each call of a public function should be "
+                         "recorded.")
+    queries = stats['queries']['reportMatch']
+    if not [q for (fp, q) in queries.items()
+            if fp.startswith("INSERT INTO matchesRaw") and q['rows'] == 1]:
+        raise ValueError("Queries should be recorded under the public "
+                         "function which executed them.")
+    reportMatches(t_id, [(p1_id, 1, p2_id, 0)] * 2)
+    reportMatches(t_id, [(p1_id, 1, p2_id, 0)] * 3)
+    inserts = [fp for fp in dumpStats()['queries']['reportMatches']
+               if fp.startswith("INSERT INTO matchesRaw")]
+    if len(inserts) != 1:
+        raise ValueError("Batches of any size should share a fingerprint.")
+    if ('tournaments_function_calls_total{function="reportMatch"} 1'
+            not in prometheusStats().splitlines()):
+        raise ValueError("Statistics should be exported in Prometheus "
+                         "text format.")
+    print "28. Success: calls and queries of public functions are recorded."
+
+
+def testStructuredResults():
+    """Test that results of operations are returned (not only logged)."""
+    p1_id = createNewPlayer("Twilight Sparkle")
+    p2_id = createNewPlayer("Fluttershy")
+    if p1_id != t_getIdByName('players', 'Twilight Sparkle'):
+        raise ValueError("createNewPlayer() should return id of the player.")
+    t_id = createNewTour("Knight or Knave")
+    if t_id != t_getIdByName('tournaments', 'Knight or Knave'):
+        raise ValueError("createNewTour() should return id of the "
+                         "tournament.")
+    changePlayerStatus(p2_id, 'inactive')
+    res = registerPlayers(t_id, p1_id, p2_id, p1_id, -1)
+    if res != [(p1_id, 'registered'), (p2_id, 'inactive'), (-1, 'invalid')]:
+        raise ValueError("registerPlayers() should return status of each "
+                         "player.")
+    if registerPlayers(t_id, p1_id) != [(p1_id, 'already_registered')]:
+        raise ValueError("Players registered already should be reported.")
+    res = deregisterPlayers(t_id, p1_id, p2_id)
+    if res != [(p1_id, 'deregistered'), (p2_id, 'unregistered')]:
+        raise ValueError("deregisterPlayers() should return status of each "
+                         "player.")
+
+    # messages are printed only when verbose
+    (stdout, sys.stdout) = (sys.stdout, StringIO())
+    try:
+        createNewPlayer("Pinkie Pie")
+        setVerbose(True)
+        p3_id = createNewPlayer("Applejack")
+        setVerbose(False)
+        printed = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    if printed != ("Player 'Applejack' created with the following id: "
+                   "'{0}'.\n".format(p3_id)):
+        raise ValueError("Messages should be printed only when verbose.")
+    print "29. Success: results of operations are returned."
+
+
+def testBulkCreate():
+    """Test creating many players and tournaments at once."""
+    names = ["Player {0}".format(i) for i in range(50000)]
+    start = time.time()
+    player_ids = createNewPlayers(names)
+    duration = time.time() - start
+    if len(player_ids) != len(names):
+        raise ValueError("createNewPlayers() should return id of each "
+                         "player.")
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT id, name FROM players WHERE id = ANY (%s)",
+                  (player_ids,))
+        created = dict(c.fetchall())
+        c.close()
+    if [created[i] for i in player_ids] != names:
+        raise ValueError("Ids should be returned in order of names.")
+    if duration > 5:
+        raise ValueError("Creating 50000 players should take less than 5 "
+                         "seconds, took {0:.2f}s.".format(duration))
+    tour_ids = createNewTours(["Knight or Knave", "Jolly Roger"])
+    if tour_ids != [t_getIdByName('tournaments', 'Knight or Knave'),
+                    t_getIdByName('tournaments', 'Jolly Roger')]:
+        raise ValueError("createNewTours() should return ids in order of "
+                         "names.")
+    print "30. Success: 50000 players created at once."
+
+
+def testTransfer():
+    """Test exporting a tournament and importing it back by COPY."""
+    from transfer import TABLES, exportData, importData
+    players = ["Elon Musk", "Bruno Walton", "Boots O'Neal", "Cathy Burton"]
+    p_ids = createNewPlayers(players)
+    t_id = createNewTour("Knight or Knave")
+    registerPlayers(t_id, *p_ids)
+    changeTourStatus(t_id, "ongoing")
+    for p in startRound(t_id):
+        reportMatch(t_id, p.player1_id, 2, p.player2_id, 1, pairing_id=p.id,
+                    idempotency_key="round 1/{0}".format(p.player1_id))
+    reportMatch(t_id, p_ids[0], 3, p_ids[2], 0)
+    reportMatch(t_id, p_ids[1], 0, p_ids[1], 0, idempotency_key="bye")
+
+    def rows(tour_id):
+        return sorted(r[2:] for r in tournamentStandings(tour_id))
+
+    def links(tour_id):
+        with s_connect() as db:
+            c = db.cursor()
+            c.execute("SELECT m.idempotency_key, p.round, p.position "
+                      "FROM matchesRaw AS m "
+                      "LEFT JOIN pairings AS p ON p.id = m.pairing_id "
+                      "WHERE m.tour_id = %s ORDER BY m.id", (tour_id,))
+            res = c.fetchall()
+            c.close()
+        return res
+
+    for fmt in ('csv', 'binary'):
+        files = dict((table, StringIO()) for table in TABLES)
+        counts = exportData(files, fmt, [t_id])
+        if counts != {'players': 4, 'tournaments': 1, 'registrations': 4,
+                      'rounds': 1, 'pairings': 2, 'matches': 4}:
+            raise ValueError("All rows of the tournament should be "
+                             "exported, got {0}.".format(counts))
+        tours = countTours()
+        for f in files.values():
+            f.seek(0)
+        if importData(files, fmt) != counts:
+            raise ValueError("All exported rows should be imported.")
+        if countTours() != tours + 1:
+            raise ValueError("Imported tournament should get a new id.")
+        new_id = t_getIdByName('tournaments', 'Knight or Knave')
+        if new_id == t_id or rows(new_id) != rows(t_id):
+            raise ValueError("Standings of the imported tournament should "
+                             "be the same as of the exported one "
+                             "({0}).".format(fmt))
+        if (links(new_id) != links(t_id) or
+                [p[3::2] for p in getPairings(new_id, 1)] !=
+                [p[3::2] for p in getPairings(t_id, 1)]):
+            raise ValueError("Matches should be imported with their "
+                             "pairings and keys ({0}).".format(fmt))
+        bye_id = t_getIdByName('players', players[1])
+        if reportMatch(new_id, bye_id, 0, bye_id, 0,
+                       idempotency_key="bye").status != 'duplicate':
+            raise ValueError("Retried result of an imported match should "
+                             "not be recorded again.")
+        if startRound(new_id)[0].round != 2:
+            raise ValueError("Imported round should be over.")
+
+    files = dict((table, StringIO()) for table in TABLES)
+    exportData(files, 'csv', [t_id])
+    files['matches'] = StringIO(files['matches'].getvalue() +
+                                "0,{0},{1},1,-1,0,,\n".format(t_id,
+                                                              p_ids[0]))
+    tours = countTours()
+    for f in files.values():
+        f.seek(0)
+    if importData(files, 'csv') is not None or countTours() != tours:
+        raise ValueError("Invalid data should not be imported.")
+    print "31. Success: tournaments are exported and imported by COPY."
+
+
+def testStandingsStreaming():
+    """Test reading standings by server-side cursor and by pages."""
+    p_ids = createNewPlayers(["Player {0}".format(i) for i in range(2001)])
+    t_id = createNewTour("Knight or Knave")
+    registerPlayers(t_id, *p_ids)
+    changeTourStatus(t_id, "ongoing")
+    random.seed(0)
+    reportMatches(t_id, [(p_ids[i], random.randint(0, 1), p_ids[i + 1],
+                          random.randint(0, 1))
+                         for i in range(0, 200, 2)] +
+                  [(p_ids[2000], 0, p_ids[2000], 0)])
+    standings = tournamentStandings(t_id)
+
+    if iterStandings(0) is not None or standingsPage(0) is not None:
+        raise ValueError("Standings of invalid tournament should be "
+                         "rejected.")
+    if list(iterStandings(t_id, batch_size=300)) != standings:
+        raise ValueError("iterStandings() should yield the same rows as "
+                         "tournamentStandings().")
+    # an abandoned iterator returns its connection when closed
+    rows = iterStandings(t_id, batch_size=10)
+    first = [next(rows) for i in range(5)]
+    rows.close()
+    if first != standings[:5] or countRegPlayers(t_id) != 2001:
+        raise ValueError("Closed iterator should release its connection.")
+
+    pages = [standingsPage(t_id, limit=700)]
+    while pages[-1]:
+        pages.append(standingsPage(t_id, after=pages[-1][-1], limit=700))
+    if ([len(p) for p in pages] != [700, 700, 601, 0] or
+            [r for p in pages for r in p] != standings):
+        raise ValueError("Pages should follow each other in order of "
+                         "standings.")
+
+    # a match reported while iterating is committed on its own
+    for row in iterStandings(t_id, batch_size=1):
+        match = reportMatch(t_id, p_ids[300], 1, p_ids[301], 0)
+        break
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT count(*) FROM matchesRaw WHERE id = %s",
+                  (match.id,))
+        count = c.fetchone()[0]
+        c.close()
+    if count != 1:
+        raise ValueError("Match reported while iterating should be kept "
+                         "after the iteration ends.")
+    print "32. Success: standings are streamed and paged."
+
+
+def testPairAllOngoing():
+    """Test pairing all ongoing tournaments at once."""
+    import tournaments
+    a_deleteAllTours()
+    tour_ids = createNewTours(["Tour {0}".format(i) for i in range(6)])
+    for (i, t_id) in enumerate(tour_ids):
+        p_ids = createNewPlayers(["Player {0}/{1}".format(i, j)
+                                  for j in range(10 + i)])
+        registerPlayers(t_id, *p_ids)
+        if i < 5:
+            changeTourStatus(t_id, "ongoing")
+    random.seed(0)
+    for t_id in tour_ids[:5]:
+        for r in range(2):
+            reportMatches(t_id, [(id1, random.randint(0, 1), id2,
+                                  random.randint(0, 1))
+                                 for (id1, n1, id2, n2)
+                                 in swissPairings(t_id)])
+
+    min_players = tournaments.PARALLEL_MIN_PLAYERS
+    for processes in (1, 2):
+        # pool is used regardless of the number of players
+        tournaments.PARALLEL_MIN_PLAYERS = 0
+        try:
+            res = pairAllOngoing(processes=processes)
+        finally:
+            tournaments.PARALLEL_MIN_PLAYERS = min_players
+        if sorted(res) != tour_ids[:5]:
+            raise ValueError("All ongoing tournaments should be paired.")
+        for t_id in tour_ids[:5]:
+            s_invalidateCache(t_id)
+            if res[t_id] != swissPairings(t_id):
+                raise ValueError("Pairings should be the same as by "
+                                 "swissPairings().")
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT tour_id, count(*), min(revision), max(revision) "
+                  "FROM proposed_pairings GROUP BY tour_id ORDER BY tour_id")
+        proposed = c.fetchall()
+        c.execute("SELECT id, revision FROM tournaments ORDER BY id")
+        revisions = dict(c.fetchall())
+        c.close()
+    if proposed != [(t_id, len(res[t_id]), revisions[t_id], revisions[t_id])
+                    for t_id in tour_ids[:5]]:
+        raise ValueError("Proposed pairings should be stored with revision "
+                         "of their tournament.")
+    print "33. Success: all ongoing tournaments are paired at once."
+
+
+def testRounds():
+    """Test starting rounds and reporting matches of stored pairings."""
+    p_ids = createNewPlayers(["Player {0}".format(i) for i in range(7)])
+    t_id = createNewTour("Knight or Knave")
+    registerPlayers(t_id, *p_ids)
+    if startRound(t_id) is not None:
+        raise ValueError("Rounds of planned tournament should be rejected.")
+    changeTourStatus(t_id, "ongoing")
+    if getPairings(t_id) != [] or getPairings(0) is not None:
+        raise ValueError("No pairings should be stored before the first "
+                         "round.")
+
+    pairings = startRound(t_id)
+    if ([(p.player1_id, p.player1_name, p.player2_id, p.player2_name)
+         for p in pairings] != swissPairings(t_id) or
+            set(p.round for p in pairings) != set([1])):
+        raise ValueError("First round should be paired by swissPairings().")
+    if startRound(t_id) != pairings or getPairings(t_id, 1) != pairings:
+        raise ValueError("Round should be paired only once.")
+
+    (bye, p1, p2) = pairings[:3]
+    if reportMatch(t_id, p1.player1_id, 1, p1.player2_id, 0,
+                   pairing_id=p2.id) is not None:
+        raise ValueError("Match of other players than paired should be "
+                         "rejected.")
+    for p in pairings[:-1]:
+        if reportMatch(t_id, p.player2_id, 0, p.player1_id, 1,
+                       pairing_id=p.id) is None:
+            raise ValueError("Match of a pairing should be recorded.")
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT count(DISTINCT pairing_id) FROM matchesRaw "
+                  "WHERE tour_id = %s", (t_id,))
+        reported = c.fetchone()[0]
+        c.close()
+    if reported != len(pairings) - 1:
+        raise ValueError("Matches should reference their pairings.")
+
+    # the round goes on until its last pairing is played or abandoned
+    if startRound(t_id) != pairings:
+        raise ValueError("Round should not end before all of its pairings "
+                         "are played.")
+    last = pairings[-1]
+    if (abandonPairing(t_id, p1.id) is not None or
+            abandonPairing(t_id, 0) is not None or
+            abandonPairing(t_id, last.id) is not True):
+        raise ValueError("Only pairings not played should be abandoned.")
+    if reportMatch(t_id, last.player1_id, 1, last.player2_id, 0,
+                   pairing_id=last.id) is not None:
+        raise ValueError("Match of abandoned pairing should be rejected.")
+
+    # second round as proposed by pairAllOngoing
+    proposed = pairAllOngoing()[t_id]
+    pairings = startRound(t_id)
+    if ([(p.player1_id, p.player1_name, p.player2_id, p.player2_name)
+         for p in pairings] != proposed or pairings[0].round != 2 or
+            getPairings(t_id) != pairings):
+        raise ValueError("Second round should be paired as proposed.")
+
+    # results of a batch are linked to the pairings of their players
+    (bye, p1) = pairings[:2]
+    res = reportMatches(t_id, [
+        (p1.player1_id, 1, p1.player2_id, 0, None, bye.id),
+        (bye.player1_id, 0, bye.player1_id, 0, None, bye.id)] +
+        [(p.player2_id, 0, p.player1_id, 1) for p in pairings[1:]])
+    if [r.status for r in res] != ['invalid_pairing'] + ['recorded'] * 4:
+        raise ValueError("Results of a round should be accepted.")
+    if startRound(t_id)[0].round != 3:
+        raise ValueError("Round reported by reportMatches() should end.")
+    print ("34. Success: rounds are paired once, their pairings stored and "
+           "the next round started once they are played.")
+
+
+def testStatusCounts():
+    """Test counts of tournaments and players kept by status."""
+    a_deleteAllTours()
+    a_deleteAllPlayers()
+    tour_ids = createNewTours(["Tour {0}".format(i) for i in range(3)])
+    player_ids = createNewPlayers(["Player {0}".format(i) for i in range(5)])
+    changeTourStatus(tour_ids[0], 'closed')
+    changePlayerStatus(player_ids[0], 'inactive')
+    changePlayerStatus(player_ids[1], 'inactive')
+    changePlayerStatus(player_ids[1], 'active')
+    if (countTours() != 3 or countTours('planned') != 2 or
+            countTours('closed', 'ongoing') != 1 or countPlayers() != 5 or
+            countPlayers('inactive') != 1):
+        raise ValueError("Counts should follow changes of statuses.")
+    # matches bump revision of tournament without changing its status
+    registerPlayers(tour_ids[1], *player_ids[1:])
+    changeTourStatus(tour_ids[1], 'ongoing')
+    reportMatch(tour_ids[1], player_ids[1], 1, player_ids[2], 0)
+    if countTours('ongoing') != 1 or countTours('planned') != 1:
+        raise ValueError("Counts should not change by other updates.")
+    a_deleteAllTours()
+    if countTours() != 0 or countPlayers('active') != 4:
+        raise ValueError("Deleted tournaments should not be counted.")
+    # catalog is read again after invalidation
+    s_invalidateStatuses()
+    if (s_getStatuses('tourStatus') != ('planned', 'ongoing', 'closed') or
+            countTours('invalid') is not None):
+        raise ValueError("Statuses should be read from the catalog.")
+    print "35. Success: tournaments and players are counted by status."
+
+
+def testCheckpoints():
+    """Test rebuilding statistics from a checkpoint and the later matches."""
+    p_ids = createNewPlayers(["Player {0}".format(i) for i in range(9)])
+    t_id = createNewTour("Knight or Knave")
+    registerPlayers(t_id, *p_ids)
+    changeTourStatus(t_id, 'ongoing')
+
+    def play():
+        random.seed(len(tournamentStandings(t_id)))
+        pairings = swissPairings(t_id)
+        reportMatches(t_id, [(id1, random.randint(0, 2), id2,
+                              random.randint(0, 2))
+                             for (id1, n1, id2, n2) in pairings])
+
+    play()
+    play()
+    if checkpointStandings(t_id) is None or checkpointStandings(0) is not None:
+        raise ValueError("Checkpoint should be taken of valid tournament.")
+    play()
+    play()
+    standings = tournamentStandings(t_id)
+    if auditStandings(t_id) != []:
+        raise ValueError("Current statistics should pass the audit.")
+
+    # statistics lost by a player are found by the audit and rebuilt
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("UPDATE player_tour_stats SET wins = 0, omw = 0 "
+                  "WHERE tour_id = %s AND player_id = %s", (t_id, p_ids[0]))
+        c.close()
+    if auditStandings(t_id) != [p_ids[0]]:
+        raise ValueError("Audit should find the changed statistics.")
+    if rebuildStandings(t_id) != 10 or tournamentStandings(t_id) != standings:
+        raise ValueError("Matches after the checkpoint should be replayed.")
+
+    # deleted matches drop the checkpoint (all matches are recomputed)
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("DELETE FROM matchesRaw WHERE id = (SELECT max(id) "
+                  "FROM matchesRaw WHERE tour_id = %s)", (t_id,))
+        c.close()
+    if rebuildStandings(t_id) != 19 or auditStandings(t_id) != []:
+        raise ValueError("Statistics should be rebuilt without checkpoint.")
+
+    # a checkpoint in progress holds up reports of its tournament only
+    import psycopg2
+    other_id = createNewTour("Jolly Roger")
+    registerPlayers(other_id, *p_ids)
+    changeTourStatus(other_id, 'ongoing')
+    other = psycopg2.connect(POOL_SETTINGS['dsn'])
+    blocked = []
+    try:
+        other.cursor().execute("SELECT checkpoint_player_tour_stats(%s)",
+                               (t_id,))
+        for tour_id in (other_id, t_id):
+            try:
+                with s_connect() as db:
+                    c = db.cursor()
+                    c.execute("SET LOCAL lock_timeout = '1s'")
+                    c.close()
+                    reportMatch(tour_id, p_ids[0], 1, p_ids[1], 0)
+            except psycopg2.OperationalError:
+                blocked.append(tour_id)
+    finally:
+        other.close()
+    if blocked != [t_id]:
+        raise ValueError("Checkpoint should lock its tournament only.")
+    print "36. Success: statistics are rebuilt from checkpoints."
+
+
+def testConcurrentReports():
+    """Test 64 scorers reporting results of the same pairings at once."""
+    import threading
+    s_configurePool(maxconn=64)
+    t_ids = createNewTours(["Tour {0}".format(i) for i in range(4)])
+    pairings = []
+    for t_id in t_ids:
+        p_ids = createNewPlayers(["Player {0}".format(i) for i in range(16)])
+        registerPlayers(t_id, *p_ids)
+        changeTourStatus(t_id, 'ongoing')
+        pairings.extend((t_id, p) for p in startRound(t_id))
+
+    # two scorers submit the result of each of the 32 pairings
+    start = threading.Event()
+    results = [None] * 64
+
+    def scorer(i):
+        (t_id, p) = pairings[i // 2]
+        start.wait()
+        results[i] = reportMatch(t_id, p.player1_id, 1, p.player2_id, 0,
+                                 pairing_id=p.id)
+
+    threads = [threading.Thread(target=scorer, args=(i,)) for i in range(64)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    with s_connect() as db:
+        c = db.cursor()
+        c.execute("SELECT pairing_id, id FROM matchesRaw "
+                  "WHERE tour_id = ANY (%s)", (t_ids,))
+        recorded = dict(c.fetchall())
+        c.close()
+    if (len(recorded) != 32 or None in results or
+            [r.id for r in results] != [recorded[p.id] for (t_id, p)
+                                        in pairings for i in range(2)] or
+            sorted(r.status for r in results) !=
+            ['duplicate'] * 32 + ['recorded'] * 32):
+        raise ValueError("Result of each pairing should be recorded once.")
+    if [auditStandings(t_id) for t_id in t_ids] != [[]] * 4:
+        raise ValueError("Statistics should be correct after concurrent "
+                         "reports.")
+    (t_id, p) = pairings[0]
+    if reportMatch(t_id, p.player1_id, 0, p.player2_id, 1,
+                   pairing_id=p.id) is not None:
+        raise ValueError("Different result of a pairing should be rejected.")
+
+    # writers on separate tournaments do not wait for each other
+    tours = []
+    for t_id in createNewTours(["Tour {0}".format(i) for i in range(4, 12)]):
+        p_ids = createNewPlayers(["Player 1", "Player 2"])
+        registerPlayers(t_id, *p_ids)
+        changeTourStatus(t_id, 'ongoing')
+        tours.append((t_id, p_ids))
+
+    def timedWriters(n):
+        def writer(t_id, id1, id2):
+            for i in range(50):
+                reportMatch(t_id, id1, 1, id2, 0)
+        threads = [threading.Thread(target=writer, args=(t_id,) + tuple(ids))
+                   for (t_id, ids) in tours[:n]]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+    timedWriters(1)
+    single = sorted(timedWriters(1) for i in range(3))[1]
+    several = timedWriters(8)
+    # a single core only overlaps waiting for the database, so the bound
+    # merely rules out writers of other tournaments queueing for a lock
+    slack = 0.75 if multiprocessing.cpu_count() > 1 else 1.5
+    if several > slack * 8 * single:
+        raise ValueError("8 writers on separate tournaments should take well "
+                         "under 8 times as long as one ({0:.2f}s vs {1:.2f}s)."
+                         .format(several, single))
+
+    # a report held open in one tournament does not block another one
+    (t_id, (id1, id2)) = tours[0]
+    reported = threading.Event()
+
+    def holder():
+        with s_connect():
+            reportMatch(t_id, id1, 1, id2, 0)
+            reported.set()
+            time.sleep(1)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    reported.wait()
+    start = time.time()
+    (t_id, (id1, id2)) = tours[1]
+    reportMatch(t_id, id1, 1, id2, 0)
+    duration = time.time() - start
+    thread.join()
+    if duration > 0.5:
+        raise ValueError("Reports of another tournament should not wait for "
+                         "an open report, took {0:.2f}s.".format(duration))
+
+    # no match is recorded once closing the tournament is committed
+    t_id = t_ids[0]
+    closed = threading.Event()
+    late = []
+
+    def writer():
+        while True:
+            was_closed = closed.is_set()
+            if reportMatch(t_id, p.player1_id, 1, p.player2_id, 0) is None:
+                break
+            if was_closed:
+                late.append(True)
+
+    threads = [threading.Thread(target=writer) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    changeTourStatus(t_id, 'closed')
+    closed.set()
+    for thread in threads:
+        thread.join()
+    s_configurePool(maxconn=10)
+    if late:
+        raise ValueError("Matches should not be recorded after closing.")
+    print "37. Success: concurrent reports are recorded once."
+
+
+def testIdempotencyKeys():
+    """Test that results retried with the same key are recorded once."""
+    p_ids = createNewPlayers(["Player {0}".format(i) for i in range(4)])
+    t_id = createNewTour("Knight or Knave")
+    registerPlayers(t_id, *p_ids)
+    changeTourStatus(t_id, 'ongoing')
+
+    first = reportMatch(t_id, p_ids[0], 2, p_ids[1], 1, idempotency_key='a')
+    retry = reportMatch(t_id, p_ids[1], 1, p_ids[0], 2, idempotency_key='a')
+    if (first.status != 'recorded' or
+            retry != ItemStatus(first.id, 'duplicate')):
+        raise ValueError("Retried result should not be recorded again.")
+    if reportMatch(t_id, p_ids[0], 0, p_ids[1], 1,
+                   idempotency_key='a') is not None:
+        raise ValueError("Different result with the same key should be "
+                         "rejected.")
+
+    batch = [(p_ids[2], 1, p_ids[3], 1, 'b'),
+             (p_ids[0], 1, p_ids[2], 0, 'c'),
+             (p_ids[0], 1, p_ids[2], 0, 'c'),
+             (p_ids[1], 3, p_ids[3], 0)]
+    statuses = [r.status for r in reportMatches(t_id, batch)]
+    if statuses != ['recorded', 'recorded', 'duplicate', 'recorded']:
+        raise ValueError("Repeated key within a batch should be recorded "
+                         "once, got {0}.".format(statuses))
+    statuses = [r.status for r in reportMatches(
+        t_id, batch[:2] + [(p_ids[0], 0, p_ids[1], 1, 'a')])]
+    if statuses != ['duplicate', 'duplicate', 'conflict']:
+        raise ValueError("Retried batch should not be recorded again, got "
+                         "{0}.".format(statuses))
+    standings = tournamentStandings(t_id)
+    if sum(m for (t, i, n, m, w, d, b, o) in standings) != 8:
+        raise ValueError("Each result should be counted once.")
+
+    # the pairing and the key of a result belong to different matches
+    (a, b) = startRound(t_id)
+    reportMatch(t_id, b.player1_id, 1, b.player2_id, 0, pairing_id=b.id,
+                idempotency_key='e')
+    reportMatch(t_id, a.player1_id, 1, a.player2_id, 0, pairing_id=a.id,
+                idempotency_key='d')
+    if reportMatch(t_id, b.player1_id, 1, b.player2_id, 0, pairing_id=b.id,
+                   idempotency_key='d') is not None:
+        raise ValueError("Result with a key of another match should be "
+                         "rejected.")
+    print "38. Success: results retried with the same key are recorded once."
+
+
+def testArchiveTour():
+    """Test moving a closed tournament to the archived partitions."""
+    p_ids = createNewPlayers(["Player {0}".format(i) for i in range(6)])
+    (t_id, live_id) = createNewTours(["Knight or Knave", "Jolly Roger"])
+    for tour_id in (t_id, live_id):
+        registerPlayers(tour_id, *p_ids)
+        changeTourStatus(tour_id, 'ongoing')
+    pairings = startRound(t_id)
+    for p in pairings:
+        reportMatch(t_id, p.player1_id, 1, p.player2_id, 0, pairing_id=p.id)
+    reportMatches(t_id, [(id1, 0, id2, 0)
+                         for (id1, n1, id2, n2) in swissPairings(t_id)])
+    if archiveTour(t_id) is not None or archiveTour(0) is not None:
+        raise ValueError("Only closed tournaments should be archived.")
+    changeTourStatus(t_id, 'closed')
+    standings = tournamentStandings(t_id)
+    if archiveTour(t_id) is not True or archiveTour(t_id) is not None:
+        raise ValueError("Closed tournament should be archived once.")
+
+    with s_connect() as db:
+        c = db.cursor()
+        counts = []
+        for table in ('matchesRaw_live', 'matchesRaw_archived',
+                      'registrations_live', 'registrations_archived'):
+            c.execute("SELECT count(*) FROM {0} "
+                      "WHERE tour_id = %s".format(table), (t_id,))
+            counts.append(c.fetchone()[0])
+        # queries of live tournaments read the live partition only
+        c.execute("EXPLAIN SELECT id FROM matchesRaw "
+                  "WHERE tour_id = %s AND NOT archived", (live_id,))
+        plan = ' '.join(row[0] for row in c.fetchall())
+        c.close()
+    if counts != [0, 6, 0, 6]:
+        raise ValueError("Matches and registrations should be moved to the "
+                         "archived partitions, got {0}.".format(counts))
+    if 'matchesraw_live' not in plan or 'matchesraw_archived' in plan:
+        raise ValueError("Archived partition should be pruned from plans "
+                         "of live queries.")
+
+    s_invalidateCache(t_id)
+    if (tournamentStandings(t_id) != standings or
+            auditStandings(t_id) != [] or
+            getPairings(t_id, 1) != pairings):
+        raise ValueError("Archived tournament should be read as before.")
+    if changeTourStatus(t_id, 'ongoing') is not None:
+        raise ValueError("Status of archived tournament should not change.")
+    (id1, n1, id2, n2) = swissPairings(live_id)[0]
+    if reportMatch(live_id, id1, 1, id2, 0).status != 'recorded':
+        raise ValueError("Matches of live tournaments should be recorded.")
+    print "39. Success: closed tournaments are archived."
+
+
 # TESTS
 
 if __name__ == '__main__':
@@ -488,4 +1466,23 @@ if __name__ == '__main__':
     testReportMatches()
     testPairings()
     testPairingsOdd()
+    testReportMatchesBatch()
+    testStandingsUseIndexes()
+    testPairingsNoRematch()
+    testPairingsScale()
+    testStandingsTiebreaks()
+    testTiebreaksScale()
+    testStandingsCache()
+    testStatistics()
+    testStructuredResults()
+    testBulkCreate()
+    testTransfer()
+    testStandingsStreaming()
+    testPairAllOngoing()
+    testRounds()
+    testStatusCounts()
+    testCheckpoints()
+    testConcurrentReports()
+    testIdempotencyKeys()
+    testArchiveTour()
     print "All tests passed successfully!"
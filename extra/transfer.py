@@ -0,0 +1,427 @@
+"""Bulk import and export of tournaments data using PostgreSQL COPY.
+
+Players, tournaments, registrations, rounds, their pairings and matches
+(with the pairing they were played for and their idempotency keys) are
+exported by COPY TO STDOUT and imported by COPY FROM STDIN, streamed between
+the database and file objects in CSV or binary COPY format, so memory use
+does not depend on the amount of data.
+
+Imported data is first copied to temporary staging tables and validated
+there (ids, statuses and references between the imported tables) by a few
+set-based queries. Only if everything is valid, players, tournaments and
+pairings get new ids drawn from the sequences of their tables (so that they
+never clash with existing data) and all rows are merged by one INSERT ...
+SELECT per table. Imported rounds get revision -1, which no tournament has,
+so that each of them is over once all its pairings are played or abandoned
+(see tournaments.startRound). Incremental maintenance of player_tour_stats
+is switched off for the import (see tournaments.bulk_load in
+tournaments.sql) and statistics of the imported tournaments are computed
+once at the end instead.
+
+Usage:
+    python transfer.py export DIRECTORY [--format binary] [--tours 1,2]
+    python transfer.py import DIRECTORY [--format binary]
+"""
+
+import argparse
+import os
+import sys
+
+import psycopg2.extensions
+
+from instrumentation import instrumented
+from tournaments import logger, s_connect, setVerbose
+
+
+# tables in order in which they are imported (as named in exported files)
+TABLES = ('players', 'tournaments', 'registrations', 'rounds', 'pairings',
+          'matches')
+# formats of exported data and extensions of exported files
+FORMATS = {'csv': 'csv', 'binary': 'copy'}
+
+# columns (and their types in staging tables) of each exported table
+COLUMNS = {
+    'players': (('id', 'int'), ('name', 'text'), ('status', 'text')),
+    'tournaments': (('id', 'int'), ('name', 'text'), ('status', 'text')),
+    'registrations': (('tour_id', 'int'), ('player_id', 'int')),
+    'rounds': (('tour_id', 'int'), ('round', 'int'),
+               ('started', 'timestamptz')),
+    'pairings': (('id', 'int'), ('tour_id', 'int'), ('round', 'int'),
+                 ('position', 'int'), ('pl1_id', 'int'), ('pl2_id', 'int'),
+                 ('abandoned', 'boolean')),
+    'matches': (('id', 'int'), ('tour_id', 'int'), ('pl1_id', 'int'),
+                ('pl1_score', 'int'), ('pl2_id', 'int'),
+                ('pl2_score', 'int'), ('pairing_id', 'int'),
+                ('idempotency_key', 'text')),
+}
+
+# queries selecting exported data (of all tournaments or of those listed in
+# %(tours)s)
+EXPORT_QUERIES = {
+    'players': ("SELECT id, name, status::text FROM players {0} ORDER BY id",
+                "WHERE id IN (SELECT player_id FROM registrations "
+                "WHERE tour_id = ANY (%(tours)s))"),
+    'tournaments': ("SELECT id, name, status::text FROM tournaments {0} "
+                    "ORDER BY id",
+                    "WHERE id = ANY (%(tours)s)"),
+    'registrations': ("SELECT tour_id, player_id FROM registrations {0} "
+                      "ORDER BY tour_id, player_id",
+                      "WHERE tour_id = ANY (%(tours)s)"),
+    'rounds': ("SELECT tour_id, round, started FROM rounds {0} "
+               "ORDER BY tour_id, round",
+               "WHERE tour_id = ANY (%(tours)s)"),
+    'pairings': ("SELECT id, tour_id, round, position, pl1_id, pl2_id, "
+                 "abandoned FROM pairings {0} ORDER BY id",
+                 "WHERE tour_id = ANY (%(tours)s)"),
+    'matches': ("SELECT id, tour_id, pl1_id, pl1_score, pl2_id, pl2_score, "
+                "pairing_id, idempotency_key FROM matchesRaw {0} "
+                "ORDER BY id",
+                "WHERE tour_id = ANY (%(tours)s)"),
+}
+
+# validation of staged data: description of invalid rows and query counting
+# them
+CHECKS = (
+    ("players with duplicate id",
+     "SELECT count(*) - count(DISTINCT id) FROM stage_players"),
+    ("players without id or name",
+     "SELECT count(*) FROM stage_players WHERE id IS NULL OR name IS NULL"),
+    ("players with invalid status",
+     "SELECT count(*) FROM stage_players WHERE status IS NULL OR status "
+     "NOT IN (SELECT unnest(enum_range(NULL::playerStatus))::text)"),
+    ("tournaments with duplicate id",
+     "SELECT count(*) - count(DISTINCT id) FROM stage_tournaments"),
+    ("tournaments without id or name",
+     "SELECT count(*) FROM stage_tournaments "
+     "WHERE id IS NULL OR name IS NULL"),
+    ("tournaments with invalid status",
+     "SELECT count(*) FROM stage_tournaments WHERE status IS NULL OR status "
+     "NOT IN (SELECT unnest(enum_range(NULL::tourStatus))::text)"),
+    ("duplicate registrations",
+     "SELECT count(*) - count(DISTINCT (tour_id, player_id)) "
+     "FROM stage_registrations"),
+    ("registrations of unknown players",
+     "SELECT count(*) FROM stage_registrations AS r "
+     "WHERE NOT EXISTS (SELECT 1 FROM stage_players AS p "
+     "WHERE p.id = r.player_id)"),
+    ("registrations for unknown tournaments",
+     "SELECT count(*) FROM stage_registrations AS r "
+     "WHERE NOT EXISTS (SELECT 1 FROM stage_tournaments AS t "
+     "WHERE t.id = r.tour_id)"),
+    ("duplicate rounds",
+     "SELECT count(*) - count(DISTINCT (tour_id, round)) FROM stage_rounds"),
+    ("rounds with missing values",
+     "SELECT count(*) FROM stage_rounds WHERE tour_id IS NULL "
+     "OR round IS NULL OR started IS NULL"),
+    ("rounds of unknown tournaments",
+     "SELECT count(*) FROM stage_rounds AS r "
+     "WHERE NOT EXISTS (SELECT 1 FROM stage_tournaments AS t "
+     "WHERE t.id = r.tour_id)"),
+    ("pairings with duplicate id",
+     "SELECT count(*) - count(DISTINCT id) FROM stage_pairings"),
+    ("pairings with duplicate position",
+     "SELECT count(*) - count(DISTINCT (tour_id, round, position)) "
+     "FROM stage_pairings"),
+    ("pairings with missing values",
+     "SELECT count(*) FROM stage_pairings WHERE id IS NULL "
+     "OR tour_id IS NULL OR round IS NULL OR position IS NULL "
+     "OR pl1_id IS NULL OR pl2_id IS NULL OR abandoned IS NULL"),
+    ("pairings of unknown rounds",
+     "SELECT count(*) FROM stage_pairings AS p "
+     "WHERE NOT EXISTS (SELECT 1 FROM stage_rounds AS r "
+     "WHERE r.tour_id = p.tour_id AND r.round = p.round)"),
+    ("pairings of unregistered players",
+     "SELECT count(*) FROM stage_pairings AS p "
+     "WHERE NOT EXISTS (SELECT 1 FROM stage_registrations AS r "
+     "WHERE r.tour_id = p.tour_id AND r.player_id = p.pl1_id) "
+     "OR NOT EXISTS (SELECT 1 FROM stage_registrations AS r "
+     "WHERE r.tour_id = p.tour_id AND r.player_id = p.pl2_id)"),
+    ("matches with missing values",
+     "SELECT count(*) FROM stage_matches WHERE tour_id IS NULL "
+     "OR pl1_id IS NULL OR pl1_score IS NULL "
+     "OR pl2_id IS NULL OR pl2_score IS NULL"),
+    ("matches of unregistered players",
+     "SELECT count(*) FROM stage_matches AS m "
+     "WHERE NOT EXISTS (SELECT 1 FROM stage_registrations AS r "
+     "WHERE r.tour_id = m.tour_id AND r.player_id = m.pl1_id) "
+     "OR NOT EXISTS (SELECT 1 FROM stage_registrations AS r "
+     "WHERE r.tour_id = m.tour_id AND r.player_id = m.pl2_id)"),
+    ("matches of unknown pairings",
+     "SELECT count(*) FROM stage_matches AS m "
+     "WHERE m.pairing_id IS NOT NULL AND NOT EXISTS (SELECT 1 "
+     "FROM stage_pairings AS p "
+     "WHERE p.id = m.pairing_id AND p.tour_id = m.tour_id)"),
+    ("matches of the same pairing",
+     "SELECT count(pairing_id) - count(DISTINCT pairing_id) "
+     "FROM stage_matches"),
+    ("matches with duplicate idempotency key",
+     "SELECT count(idempotency_key) "
+     "- count(DISTINCT (tour_id, idempotency_key)) "
+     "FILTER (WHERE idempotency_key IS NOT NULL) FROM stage_matches"),
+)
+
+# merge of validated staged data (new ids of players, tournaments and
+# pairings are taken from map_players, map_tournaments and map_pairings)
+MERGE_QUERIES = (
+    ('players',
+     "INSERT INTO players (id, name, status) "
+     "SELECT m.new_id, s.name, s.status::playerStatus "
+     "FROM stage_players AS s JOIN map_players AS m ON m.old_id = s.id "
+     "ORDER BY m.new_id"),
+    ('tournaments',
+     "INSERT INTO tournaments (id, name, status) "
+     "SELECT m.new_id, s.name, s.status::tourStatus "
+     "FROM stage_tournaments AS s "
+     "JOIN map_tournaments AS m ON m.old_id = s.id "
+     "ORDER BY m.new_id"),
+    ('registrations',
+     "INSERT INTO registrations (tour_id, player_id) "
+     "SELECT t.new_id, p.new_id "
+     "FROM stage_registrations AS s "
+     "JOIN map_tournaments AS t ON t.old_id = s.tour_id "
+     "JOIN map_players AS p ON p.old_id = s.player_id"),
+    ('rounds',
+     "INSERT INTO rounds (tour_id, round, revision, started) "
+     "SELECT t.new_id, s.round, -1, s.started "
+     "FROM stage_rounds AS s "
+     "JOIN map_tournaments AS t ON t.old_id = s.tour_id"),
+    ('pairings',
+     "INSERT INTO pairings "
+     "(id, tour_id, round, position, pl1_id, pl2_id, abandoned) "
+     "SELECT m.new_id, t.new_id, s.round, s.position, p1.new_id, "
+     "p2.new_id, s.abandoned "
+     "FROM stage_pairings AS s "
+     "JOIN map_pairings AS m ON m.old_id = s.id "
+     "JOIN map_tournaments AS t ON t.old_id = s.tour_id "
+     "JOIN map_players AS p1 ON p1.old_id = s.pl1_id "
+     "JOIN map_players AS p2 ON p2.old_id = s.pl2_id "
+     "ORDER BY m.new_id"),
+    ('matches',
+     "INSERT INTO matchesRaw "
+     "(tour_id, pl1_id, pl1_score, pl2_id, pl2_score, pairing_id, "
+     "idempotency_key) "
+     "SELECT t.new_id, p1.new_id, s.pl1_score, p2.new_id, s.pl2_score, "
+     "pa.new_id, s.idempotency_key "
+     "FROM stage_matches AS s "
+     "JOIN map_tournaments AS t ON t.old_id = s.tour_id "
+     "JOIN map_players AS p1 ON p1.old_id = s.pl1_id "
+     "JOIN map_players AS p2 ON p2.old_id = s.pl2_id "
+     "LEFT JOIN map_pairings AS pa ON pa.old_id = s.pairing_id "
+     "ORDER BY s.id"),
+)
+
+
+# SUPPORTING FUNCTIONS
+
+
+def s_copyOptions(fmt):
+    """Return options of COPY for given format ('csv' or 'binary')."""
+    if fmt not in FORMATS:
+        raise ValueError("Invalid format: '{0}'".format(fmt))
+    if fmt == 'csv':
+        return "WITH (FORMAT csv, HEADER true)"
+    return "WITH (FORMAT binary)"
+
+
+def s_stage(c, files, fmt):
+    """Copy imported data to temporary staging tables.
+
+    Args:
+        c: Cursor of the importing transaction.
+        files: Dictionary mapping name of table (see TABLES) to file object
+               to read data from (tables not provided are left empty).
+        fmt: Format of data ('csv' or 'binary').
+    """
+    options = s_copyOptions(fmt)
+    for table in TABLES:
+        columns = COLUMNS[table]
+        c.execute("CREATE TEMP TABLE stage_{0} ({1}) ON COMMIT DROP".format(
+            table, ', '.join('{0} {1}'.format(*col) for col in columns)))
+        if files.get(table) is not None:
+            c.copy_expert("COPY stage_{0} ({1}) FROM STDIN {2}".format(
+                table, ', '.join(col[0] for col in columns), options),
+                files[table])
+        # staging tables are not analyzed automatically
+        c.execute("ANALYZE stage_{0}".format(table))
+
+
+def s_validate(c):
+    """Validate staged data.
+
+    Returns:
+        A list of tuples (description, count) of kinds of invalid rows found
+        in the staging tables (empty if all data is valid).
+    """
+    res = []
+    for (description, query) in CHECKS:
+        c.execute(query)
+        count = c.fetchone()[0]
+        if count:
+            res.append((description, count))
+    return res
+
+
+# USER FUNCTIONS
+
+
+@instrumented
+def exportData(files, fmt='csv', tour_ids=None):
+    """Export players, tournaments, registrations, rounds and matches.
+
+    All tables are exported from one snapshot of the database.
+
+    Args:
+        files: Dictionary mapping name of table (see TABLES) to file object
+               to write its data to (only the provided tables are exported).
+        fmt: Format of data, 'csv' (with header) or 'binary' (COPY binary
+             format, for files opened in binary mode).
+        tour_ids: (optional) List of ID numbers of tournaments to export
+                  (with their registered players), all by default.
+    Returns:
+        A dictionary mapping name of each exported table to number of
+        exported rows.
+    """
+    options = s_copyOptions(fmt)
+    res = {}
+    with s_connect() as db:
+        c = db.cursor()
+        if db.status == psycopg2.extensions.STATUS_READY:
+            # transaction not started yet, all tables can be exported from
+            # the same snapshot
+            c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        for table in TABLES:
+            if files.get(table) is None:
+                continue
+            (query, where) = EXPORT_QUERIES[table]
+            query = query.format(where if tour_ids is not None else '')
+            query = c.mogrify(query, {'tours': list(tour_ids or ())})
+            if not isinstance(query, str):
+                query = query.decode('utf-8')
+            c.copy_expert("COPY ({0}) TO STDOUT {1}".format(query, options),
+                          files[table])
+            res[table] = c.rowcount
+        c.close()
+
+    logger.info("Exported %s.", ', '.join(
+        '{0} {1}'.format(res[t], t) for t in TABLES if t in res))
+    return res
+
+
+@instrumented
+def importData(files, fmt='csv'):
+    """Import players, tournaments, registrations, rounds and matches.
+
+    Imported players, tournaments and pairings get new ids (ids in the
+    imported data are used only to link the imported rows to each other).
+    Nothing is imported if any of the imported rows is invalid.
+
+    Args:
+        files: Dictionary mapping name of table (see TABLES) to file object
+               to read its data from (as written by exportData).
+        fmt: Format of data ('csv' or 'binary').
+    Returns:
+        A dictionary mapping name of each table to number of imported rows
+        (None if the data is invalid).
+    """
+    res = {}
+    with s_connect() as db:
+        c = db.cursor()
+        s_stage(c, files, fmt)
+
+        problems = s_validate(c)
+        if problems:
+            for (description, count) in problems:
+                logger.warning("Import rejected: %s %s!", count, description)
+            c.close()
+            return None
+
+        # new ids (in order of the imported ones)
+        for table in ('players', 'tournaments', 'pairings'):
+            c.execute("CREATE TEMP TABLE map_{0} ON COMMIT DROP AS "
+                      "SELECT old_id, "
+                      "nextval(pg_get_serial_sequence('{0}', 'id'))::int "
+                      "AS new_id "
+                      "FROM (SELECT id AS old_id FROM stage_{0} "
+                      "ORDER BY id) AS s".format(table))
+            c.execute("ANALYZE map_{0}".format(table))
+
+        # statistics are computed at once after all matches are imported
+        c.execute("SET LOCAL tournaments.bulk_load = 'on'")
+        for (table, query) in MERGE_QUERIES:
+            c.execute(query)
+            res[table] = c.rowcount
+        c.execute("RESET tournaments.bulk_load")
+        # plans of the statistics query depend on up to date statistics of
+        # the tables which have just grown (autovacuum analyzes them later)
+        for table in ('registrations', 'matchesRaw', 'player_tour_stats'):
+            c.execute("ANALYZE {0}".format(table))
+        c.execute("SELECT refresh_player_tour_stats(new_id) "
+                  "FROM map_tournaments")
+        c.close()
+
+    logger.info("Imported %s.", ', '.join(
+        '{0} {1}'.format(res[t], t) for t in TABLES))
+    return res
+
+
+def exportToDirectory(directory, fmt='csv', tour_ids=None):
+    """Export all tables to files in given directory (see exportData).
+
+    Files are named by tables with extension by format (e.g. players.csv).
+    """
+    files = {}
+    try:
+        for table in TABLES:
+            files[table] = open(os.path.join(
+                directory, '{0}.{1}'.format(table, FORMATS[fmt])), 'wb')
+        return exportData(files, fmt, tour_ids)
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def importFromDirectory(directory, fmt='csv'):
+    """Import tables from files in given directory (see importData).
+
+    Files are expected to be named as by exportToDirectory (missing files
+    are treated as empty tables).
+    """
+    files = {}
+    try:
+        for table in TABLES:
+            path = os.path.join(directory,
+                                '{0}.{1}'.format(table, FORMATS[fmt]))
+            if os.path.exists(path):
+                files[table] = open(path, 'rb')
+        return importData(files, fmt)
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Import or export tournaments data.")
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('directory')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--tours', help="comma separated ids of tournaments "
+                                        "to export (all by default)")
+    args = parser.parse_args(argv)
+
+    setVerbose(True)
+    try:
+        if args.command == 'export':
+            tour_ids = None
+            if args.tours:
+                tour_ids = [int(t) for t in args.tours.split(',')]
+            res = exportToDirectory(args.directory, args.format, tour_ids)
+        else:
+            res = importFromDirectory(args.directory, args.format)
+    finally:
+        setVerbose(False)
+    return 0 if res is not None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())